@@ -454,7 +454,7 @@ function App() {
 
       const data = await response.json();
       setTouristId(data.tourist_id);
-      setQrData(data.qr_code_data);
+      setQrData(`http://localhost:8000${data.qr_code_url}`);
       handleNext(); // Move to the confirmation step
     } catch (error) {
       console.error("Registration failed:", error);
@@ -1,5 +1,6 @@
 // src/components/SafetyScoreWidget.js - Real-time safety score display
 import React, { useState, useEffect } from 'react';
+import api from '../utils/api';
 
 const SafetyScoreWidget = ({ location, destination }) => {
     const [safetyScore, setSafetyScore] = useState(null);
@@ -16,18 +17,9 @@ const SafetyScoreWidget = ({ location, destination }) => {
         setLoading(true);
         try {
             const locationName = destination || 'current_location';
-            const response = await fetch(`http://localhost:8000/safety-scores/${locationName}`);
-            
-            if (response.ok) {
-                const data = await response.json();
-                setSafetyScore(data.score);
-                setRecommendations(data.recommendations || []);
-            } else {
-                // Fallback to mock data
-                const mockScore = getMockSafetyScore(locationName);
-                setSafetyScore(mockScore.score);
-                setRecommendations(mockScore.recommendations);
-            }
+            const data = await api.getSafetyScore(locationName);
+            setSafetyScore(data.safety_score);
+            setRecommendations(data.safety_tips || []);
         } catch (error) {
             console.error('Error fetching safety score:', error);
             // Fallback to mock data
@@ -1,86 +1,81 @@
 // src/tourist/components/TouristHeatMap.js
-import React, { useState, useEffect } from 'react';
-import { MapContainer, TileLayer, Marker, Popup, Circle } from 'react-leaflet';
-import L from 'leaflet';
+import React, { useState, useEffect, useCallback } from 'react';
+import { MapContainer, TileLayer, Popup, CircleMarker, useMapEvents } from 'react-leaflet';
 import { Users, MapPin, TrendingUp, AlertCircle } from 'lucide-react';
 
-const TouristHeatMap = () => {
-    const [heatMapData, setHeatMapData] = useState([]);
-    const [densityZones, setDensityZones] = useState([]);
-    const [timeFilter, setTimeFilter] = useState('24h');
-    const [viewMode, setViewMode] = useState('density'); // 'density', 'movement', 'safety'
+const HEATMAP_MAX_ZOOM = 16;
+const MAX_TILES_PER_VIEW = 64;
+
+// Slippy-map tile index containing a point at the given zoom
+const tileFor = (lat, lng, zoom) => {
+    const n = 2 ** zoom;
+    const clampedLat = Math.max(-85.0511, Math.min(85.0511, lat));
+    const latRad = clampedLat * Math.PI / 180;
+    const x = Math.floor((lng + 180) / 360 * n);
+    const y = Math.floor((1 - Math.log(Math.tan(latRad) + 1 / Math.cos(latRad)) / Math.PI) / 2 * n);
+    return [Math.min(Math.max(x, 0), n - 1), Math.min(Math.max(y, 0), n - 1)];
+};
 
-    useEffect(() => {
-        fetchHeatMapData();
-    }, [timeFilter]);
+// Fetches the pre-aggregated density tiles covering the current viewport
+const HeatmapTileLoader = ({ refreshKey, onCells }) => {
+    const loadTiles = useCallback(async (map) => {
+        const zoom = Math.min(Math.max(Math.round(map.getZoom()), 0), HEATMAP_MAX_ZOOM);
+        const bounds = map.getBounds();
+        const [minX, minY] = tileFor(bounds.getNorth(), bounds.getWest(), zoom);
+        const [maxX, maxY] = tileFor(bounds.getSouth(), bounds.getEast(), zoom);
+
+        const requests = [];
+        for (let x = minX; x <= maxX; x++) {
+            for (let y = minY; y <= maxY; y++) {
+                if (requests.length < MAX_TILES_PER_VIEW) {
+                    requests.push(
+                        fetch(`http://localhost:8000/police/heatmap/${zoom}/${x}/${y}`)
+                            .then(response => response.json())
+                    );
+                }
+            }
+        }
 
-    const fetchHeatMapData = async () => {
         try {
-            // Fetch tourist locations for heatmap
-            const response = await fetch('http://localhost:8000/police/locations/');
-            const data = await response.json();
-
-            // Create density zones based on tourist concentration
-            const zones = calculateDensityZones(data);
-            setDensityZones(zones);
-            setHeatMapData(data);
+            const tiles = await Promise.all(requests);
+            onCells(tiles.flatMap(tile => tile.cells.map(cell => ({
+                ...cell,
+                id: `${tile.z}/${tile.x}/${tile.y}/${cell.i}/${cell.j}`
+            }))));
         } catch (error) {
             console.error('Failed to fetch heat map data:', error);
         }
-    };
+    }, [onCells]);
 
-    const calculateDensityZones = (tourists) => {
-        // Group tourists by location proximity (simplified)
-        const zones = [
-            {
-                id: 1,
-                center: [28.6139, 77.2090], // Delhi
-                radius: 5000,
-                density: tourists.filter(t => 
-                    Math.abs(t.lat - 28.6139) < 0.1 && Math.abs(t.lng - 77.2090) < 0.1
-                ).length,
-                area: 'Central Delhi'
-            },
-            {
-                id: 2,
-                center: [19.0760, 72.8777], // Mumbai
-                radius: 4000,
-                density: tourists.filter(t => 
-                    Math.abs(t.lat - 19.0760) < 0.1 && Math.abs(t.lng - 72.8777) < 0.1
-                ).length,
-                area: 'Mumbai Central'
-            },
-            {
-                id: 3,
-                center: [15.2993, 74.1240], // Goa
-                radius: 3000,
-                density: tourists.filter(t => 
-                    Math.abs(t.lat - 15.2993) < 0.1 && Math.abs(t.lng - 74.1240) < 0.1
-                ).length,
-                area: 'North Goa'
-            },
-            {
-                id: 4,
-                center: [30.1204, 78.2706], // Baghi
-                radius: 2500,
-                density: tourists.filter(t => 
-                    Math.abs(t.lat - 30.1204) < 0.1 && Math.abs(t.lng - 78.2706) < 0.1
-                ).length,
-                area: 'Baghi Area'
-            },
-            {
-                id: 5,
-                center: [30.1464, 78.4322], // THDC Dam
-                radius: 2000,
-                density: tourists.filter(t => 
-                    Math.abs(t.lat - 30.1464) < 0.1 && Math.abs(t.lng - 78.4322) < 0.1
-                ).length,
-                area: 'THDC Dam Area'
-            }
-        ];
+    const map = useMapEvents({
+        moveend: () => loadTiles(map),
+        zoomend: () => loadTiles(map)
+    });
 
-        return zones.filter(zone => zone.density > 0);
-    };
+    useEffect(() => {
+        loadTiles(map);
+    }, [map, loadTiles, refreshKey]);
+
+    return null;
+};
+
+const TouristHeatMap = () => {
+    const [densityZones, setDensityZones] = useState([]);
+    const [timeFilter, setTimeFilter] = useState('24h');
+    const [viewMode, setViewMode] = useState('density'); // 'density', 'movement', 'safety'
+
+    const handleCells = useCallback((cells) => {
+        setDensityZones(cells.map(cell => ({
+            id: cell.id,
+            center: [cell.lat, cell.lng],
+            density: cell.count,
+            statuses: cell.statuses,
+            area: `${cell.lat.toFixed(3)}, ${cell.lng.toFixed(3)}`
+        })));
+    }, []);
+
+    const totalInView = densityZones.reduce((sum, zone) => sum + zone.density, 0);
+    const topZones = [...densityZones].sort((a, b) => b.density - a.density).slice(0, 6);
 
     const getDensityColor = (density) => {
         if (density >= 10) return '#dc2626'; // High density - Red
@@ -133,8 +128,8 @@ const TouristHeatMap = () => {
                         <div className="flex items-center">
                             <Users className="h-8 w-8 text-blue-500 mr-3" />
                             <div>
-                                <p className="text-sm text-gray-600">Total Tourists</p>
-                                <p className="text-2xl font-bold text-blue-600">{heatMapData.length}</p>
+                                <p className="text-sm text-gray-600">Tourists in View</p>
+                                <p className="text-2xl font-bold text-blue-600">{totalInView}</p>
                             </div>
                         </div>
                     </div>
@@ -194,12 +189,14 @@ const TouristHeatMap = () => {
                                 attribution='&copy; <a href="http://osm.org/copyright">OpenStreetMap</a>'
                             />
 
-                            {/* Density Circles */}
+                            <HeatmapTileLoader refreshKey={timeFilter} onCells={handleCells} />
+
+                            {/* Density Cells */}
                             {densityZones.map(zone => (
-                                <Circle
+                                <CircleMarker
                                     key={zone.id}
                                     center={zone.center}
-                                    radius={zone.radius}
+                                    radius={Math.min(8 + zone.density * 2, 30)}
                                     color={getDensityColor(zone.density)}
                                     fillColor={getDensityColor(zone.density)}
                                     fillOpacity={getIntensityOpacity(zone.density)}
@@ -209,36 +206,12 @@ const TouristHeatMap = () => {
                                         <div className="text-center">
                                             <strong>{zone.area}</strong><br />
                                             <span>Density: {zone.density} tourists</span><br />
-                                            <span>Radius: {(zone.radius / 1000).toFixed(1)}km</span>
-                                        </div>
-                                    </Popup>
-                                </Circle>
-                            ))}
-
-                            {/* Individual Tourist Markers */}
-                            {heatMapData.map((tourist, index) => (
-                                <Marker
-                                    key={index}
-                                    position={[tourist.lat, tourist.lng]}
-                                    icon={new L.Icon({
-                                        iconUrl: `https://cdn.rawgit.com/pointhi/leaflet-color-markers/master/img/marker-icon-2x-${
-                                            tourist.status === 'danger' ? 'red' :
-                                            tourist.status === 'warning' ? 'yellow' : 'green'
-                                        }.png`,
-                                        shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/0.7.7/images/marker-shadow.png',
-                                        iconSize: [15, 25],
-                                        iconAnchor: [7, 25],
-                                        popupAnchor: [1, -24],
-                                        shadowSize: [25, 25]
-                                    })}
-                                >
-                                    <Popup>
-                                        <div className="text-center">
-                                            <strong>{tourist.full_name}</strong><br />
-                                            <span>Status: {tourist.status}</span>
+                                            {Object.entries(zone.statuses).map(([status, count]) => (
+                                                <span key={status}>{status}: {count}<br /></span>
+                                            ))}
                                         </div>
                                     </Popup>
-                                </Marker>
+                                </CircleMarker>
                             ))}
                         </MapContainer>
                     </div>
@@ -249,7 +222,7 @@ const TouristHeatMap = () => {
             <div className="p-6 border-t border-gray-200">
                 <h3 className="text-lg font-semibold text-gray-900 mb-4">Zone Analysis</h3>
                 <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
-                    {densityZones.map(zone => (
+                    {topZones.map(zone => (
                         <div key={zone.id} className="bg-gray-50 p-4 rounded-lg">
                             <div className="flex items-center justify-between mb-2">
                                 <h4 className="font-semibold text-gray-900">{zone.area}</h4>
@@ -263,7 +236,7 @@ const TouristHeatMap = () => {
                                 </span>
                             </div>
                             <div className="space-y-1 text-sm text-gray-600">
-                                <p>Coverage: {(zone.radius / 1000).toFixed(1)}km radius</p>
+                                <p>Alerts: {(zone.statuses.warning || 0) + (zone.statuses.danger || 0)}</p>
                                 <p>Density: {zone.density > 0 ? 'Active' : 'Inactive'}</p>
                                 <p>Status: {zone.density >= 10 ? 'High Traffic' : 
                                            zone.density >= 5 ? 'Moderate' : 'Low Activity'}</p>
@@ -1,57 +1,73 @@
 // src/tourist/components/DigitalIDRecords.js
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Users, Search, Filter, Download, Eye, CheckCircle, AlertTriangle, XCircle } from 'lucide-react';
 
+// Columns shown in the records table; heavy columns are loaded per tourist on demand and
+// the QR image is fetched separately
+const RECORD_FIELDS = [
+    'tourist_id', 'full_name', 'nationality', 'id_type', 'id_number', 'phone',
+    'emergency_contact_name', 'emergency_contact_phone', 'destination',
+    'checkin_date', 'checkout_date', 'accommodation', 'documents', 'created_at', 'valid_until'
+].join(',');
+const RECORDS_PAGE_SIZE = 200;
+const SEARCH_DEBOUNCE_MS = 300;
+
 const DigitalIDRecords = () => {
     const [tourists, setTourists] = useState([]);
-    const [filteredTourists, setFilteredTourists] = useState([]);
     const [searchTerm, setSearchTerm] = useState('');
     const [statusFilter, setStatusFilter] = useState('all');
     const [selectedTourist, setSelectedTourist] = useState(null);
     const [loading, setLoading] = useState(false);
+    const [nextCursor, setNextCursor] = useState(null);
+    // Responses for filters that have since changed are dropped
+    const latestRequest = useRef(0);
 
+    // Filtering happens on the server so it covers every record, not just the loaded pages
     useEffect(() => {
-        fetchTouristRecords();
-    }, []);
-
-    useEffect(() => {
-        filterTourists();
-    }, [tourists, searchTerm, statusFilter]);
+        const timer = setTimeout(() => fetchTouristRecords(), searchTerm ? SEARCH_DEBOUNCE_MS : 0);
+        return () => clearTimeout(timer);
+    }, [searchTerm, statusFilter]);
 
-    const fetchTouristRecords = async () => {
+    const fetchTouristRecords = async (cursor = null) => {
+        const request = ++latestRequest.current;
         setLoading(true);
         try {
-            const response = await fetch('http://localhost:8000/tourists/');
+            const params = new URLSearchParams({ fields: RECORD_FIELDS, limit: RECORDS_PAGE_SIZE });
+            if (searchTerm) {
+                params.set('search', searchTerm);
+            }
+            if (statusFilter !== 'all') {
+                params.set('verification', statusFilter);
+            }
+            if (cursor) {
+                params.set('after_id', cursor);
+            }
+            const response = await fetch(`http://localhost:8000/tourists/?${params}`);
             const data = await response.json();
-            setTourists(data);
+            if (request !== latestRequest.current) {
+                return;
+            }
+            setTourists(prevTourists => cursor ? [...prevTourists, ...data] : data);
+            setNextCursor(response.headers.get('X-Next-Cursor'));
         } catch (error) {
             console.error('Failed to fetch tourist records:', error);
         } finally {
-            setLoading(false);
+            if (request === latestRequest.current) {
+                setLoading(false);
+            }
         }
     };
 
-    const filterTourists = () => {
-        let filtered = tourists;
-
-        // Filter by search term
-        if (searchTerm) {
-            filtered = filtered.filter(tourist =>
-                tourist.full_name?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                tourist.tourist_id?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                tourist.nationality?.toLowerCase().includes(searchTerm.toLowerCase())
-            );
-        }
-
-        // Filter by status
-        if (statusFilter !== 'all') {
-            filtered = filtered.filter(tourist => {
-                const status = getVerificationStatus(tourist);
-                return status === statusFilter;
-            });
+    const openTourist = async (tourist) => {
+        setSelectedTourist(tourist);
+        try {
+            const response = await fetch(`http://localhost:8000/tourist/${tourist.tourist_id}`);
+            if (response.ok) {
+                setSelectedTourist(await response.json());
+            }
+        } catch (error) {
+            console.error('Failed to fetch tourist details:', error);
         }
-
-        setFilteredTourists(filtered);
     };
 
     const getVerificationStatus = (tourist) => {
@@ -88,7 +104,7 @@ const DigitalIDRecords = () => {
     };
 
     const handleExportData = () => {
-        const csvData = filteredTourists.map(tourist => ({
+        const csvData = tourists.map(tourist => ({
             'Tourist ID': tourist.tourist_id,
             'Name': tourist.full_name,
             'Nationality': tourist.nationality,
@@ -124,7 +140,7 @@ const DigitalIDRecords = () => {
                 <div className="flex items-center justify-between">
                     <h2 className="text-xl font-bold text-gray-900 flex items-center">
                         <Users className="h-6 w-6 mr-2 text-blue-500" />
-                        Digital ID Records ({filteredTourists.length})
+                        Digital ID Records ({tourists.length})
                     </h2>
                     <div className="flex items-center space-x-4">
                         <div className="relative">
@@ -149,7 +165,7 @@ const DigitalIDRecords = () => {
                         </select>
                         <button
                             onClick={handleExportData}
-                            disabled={filteredTourists.length === 0}
+                            disabled={tourists.length === 0}
                             className="bg-blue-600 hover:bg-blue-700 disabled:bg-gray-300 text-white px-4 py-2 rounded-lg flex items-center space-x-2 text-sm"
                         >
                             <Download className="h-4 w-4" />
@@ -230,7 +246,7 @@ const DigitalIDRecords = () => {
                             </tr>
                         </thead>
                         <tbody className="bg-white divide-y divide-gray-200">
-                            {filteredTourists.map((tourist) => {
+                            {tourists.map((tourist) => {
                                 const status = getVerificationStatus(tourist);
                                 return (
                                     <tr key={tourist.tourist_id} className="hover:bg-gray-50">
@@ -267,7 +283,7 @@ const DigitalIDRecords = () => {
                                         </td>
                                         <td className="px-6 py-4 whitespace-nowrap text-sm font-medium space-x-2">
                                             <button
-                                                onClick={() => setSelectedTourist(tourist)}
+                                                onClick={() => openTourist(tourist)}
                                                 className="text-blue-600 hover:text-blue-900 flex items-center space-x-1"
                                             >
                                                 <Eye className="h-4 w-4" />
@@ -280,6 +296,16 @@ const DigitalIDRecords = () => {
                         </tbody>
                     </table>
                 )}
+                {nextCursor && !loading && (
+                    <div className="p-4 text-center">
+                        <button
+                            onClick={() => fetchTouristRecords(nextCursor)}
+                            className="text-blue-600 hover:text-blue-900 text-sm font-medium"
+                        >
+                            Load more records
+                        </button>
+                    </div>
+                )}
             </div>
 
             {/* Tourist Detail Modal */}
@@ -370,6 +396,16 @@ const DigitalIDRecords = () => {
                                                         <p className="text-xs text-gray-500">
                                                             {doc.content_type} • {(doc.size / 1024).toFixed(1)}KB
                                                         </p>
+                                                        {doc.url && (
+                                                            <a
+                                                                href={`http://localhost:8000${doc.url}`}
+                                                                target="_blank"
+                                                                rel="noopener noreferrer"
+                                                                className="text-xs text-blue-600 hover:underline"
+                                                            >
+                                                                View
+                                                            </a>
+                                                        )}
                                                     </div>
                                                 </div>
                                             </div>
@@ -379,12 +415,12 @@ const DigitalIDRecords = () => {
                             )}
 
                             {/* QR Code */}
-                            {selectedTourist.qr_code_data && (
+                            {selectedTourist.tourist_id && (
                                 <div className="mt-6">
                                     <h3 className="text-lg font-semibold text-gray-900 mb-4">Digital QR Code</h3>
                                     <div className="flex items-center space-x-4">
                                         <img 
-                                            src={selectedTourist.qr_code_data} 
+                                            src={`http://localhost:8000/tourist/${selectedTourist.tourist_id}/qr.png`} 
                                             alt="Tourist QR Code" 
                                             className="w-32 h-32 border border-gray-200 rounded"
                                         />
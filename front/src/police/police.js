@@ -122,6 +122,9 @@ function PoliceDashboard() {
     const [mapKey, setMapKey] = useState(0); // Force map re-render
 
     const wsRef = useRef(null);
+    const seenAlertSeqs = useRef(new Set());
+    // Newest server event_seq seen, so a reconnect only replays what was missed
+    const lastEventSeq = useRef(null);
 
     useEffect(() => {
         fetchInitialData();
@@ -155,6 +158,26 @@ function PoliceDashboard() {
                lng >= -180 && lng <= 180;
     };
 
+    const buildTouristData = (locations) => {
+        const touristData = {};
+        locations.forEach(tourist => {
+            if (isValidCoordinate(tourist.lat, tourist.lng)) {
+                touristData[tourist.tourist_id] = {
+                    id: tourist.tourist_id,
+                    name: tourist.full_name || 'Unknown Tourist',
+                    lat: parseFloat(tourist.lat),
+                    lng: parseFloat(tourist.lng),
+                    status: tourist.status || "safe",
+                    safetyScore: getSafetyScoreFromStatus(tourist.status),
+                    lastUpdate: new Date(),
+                    zone: getZoneFromStatus(tourist.status),
+                    nationality: "Unknown",
+                };
+            }
+        });
+        return touristData;
+    };
+
     const fetchInitialData = async () => {
         setIsLoading(true);
         try {
@@ -164,23 +187,7 @@ function PoliceDashboard() {
             }
             const data = await response.json();
 
-            const touristData = {};
-            data.forEach(tourist => {
-                if (isValidCoordinate(tourist.lat, tourist.lng)) {
-                    touristData[tourist.tourist_id] = {
-                        id: tourist.tourist_id,
-                        name: tourist.full_name || 'Unknown Tourist',
-                        lat: parseFloat(tourist.lat),
-                        lng: parseFloat(tourist.lng),
-                        status: tourist.status || "safe",
-                        safetyScore: getSafetyScoreFromStatus(tourist.status),
-                        lastUpdate: new Date(),
-                        zone: getZoneFromStatus(tourist.status),
-                        nationality: "Unknown",
-                    };
-                }
-            });
-
+            const touristData = buildTouristData(data);
             setTourists(touristData);
             updateStats(touristData);
             console.log('Loaded tourist locations:', Object.keys(touristData).length);
@@ -207,7 +214,10 @@ function PoliceDashboard() {
     const setupWebSocket = () => {
         const connectWebSocket = () => {
             try {
-                wsRef.current = new WebSocket("ws://localhost:8000/ws/police_dashboard");
+                const since = lastEventSeq.current !== null ? `&since=${lastEventSeq.current}` : '';
+                wsRef.current = new WebSocket(`ws://localhost:8000/ws/police_dashboard?stream=batched${since}`);
+                // Sequence numbers restart with every connection
+                seenAlertSeqs.current = new Set();
 
                 wsRef.current.onopen = () => {
                     console.log("Police WebSocket connected");
@@ -216,15 +226,15 @@ function PoliceDashboard() {
 
                 wsRef.current.onmessage = (event) => {
                     const data = JSON.parse(event.data);
-                    console.log('Real-time update received:', data);
-
-                    if (data.type === 'location_update') {
-                        handleRealTimeLocationUpdate(data);
-                    } else if (data.type === 'emergency_alert') {
-                        handleEmergencyAlert(data);
-                    } else if (data.type === 'geofence_alert') {
-                        handleGeofenceAlert(data);
+                    // Priority alerts carry a per-connection seq and are resent until acknowledged
+                    if (data.seq !== undefined) {
+                        wsRef.current.send(JSON.stringify({ action: 'ack', seq: data.seq }));
+                        if (seenAlertSeqs.current.has(data.seq)) {
+                            return;
+                        }
+                        seenAlertSeqs.current.add(data.seq);
                     }
+                    handleWebSocketMessage(data);
                 };
 
                 wsRef.current.onerror = (error) => {
@@ -251,16 +261,45 @@ function PoliceDashboard() {
     };
 
     const handleWebSocketMessage = (data) => {
+        if (data.event_seq !== undefined && data.type !== 'connection_status') {
+            lastEventSeq.current = Math.max(lastEventSeq.current ?? 0, data.event_seq);
+        }
         switch (data.type) {
             case 'location_update':
                 handleLocationUpdate(data);
                 break;
+            case 'location_batch':
+                // Latest position per tourist since the previous frame
+                data.updates.forEach(handleLocationUpdate);
+                break;
             case 'alert':
             case 'geofence_alert':
             case 'route_deviation':
                 handleNewAlert(data);
                 break;
+            case 'geofence_exit':
+                console.log(`🚶 ${data.tourist_id}: ${data.message}`);
+                break;
+            case 'replay':
+                // Events missed while disconnected, oldest first
+                data.events.forEach(handleWebSocketMessage);
+                lastEventSeq.current = Math.max(lastEventSeq.current ?? 0, data.to_seq);
+                break;
+            case 'snapshot': {
+                // The gap fell out of the server's log; start over from current state
+                const touristData = buildTouristData(data.tourists);
+                setTourists(touristData);
+                updateStats(touristData);
+                fetchGeofenceZones();
+                lastEventSeq.current = data.event_seq;
+                break;
+            }
             case 'connection_status':
+                if (lastEventSeq.current === null) {
+                    lastEventSeq.current = data.event_seq;
+                }
+                console.log('🔗 Connection message:', data.message);
+                break;
             case 'echo':
                 console.log('🔗 Connection message:', data.message);
                 break;
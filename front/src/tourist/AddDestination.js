@@ -1,5 +1,8 @@
 // src/tourist/components/AddDestination.js
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
+import api from '../utils/api';
+
+const SAFETY_LOOKUP_DELAY_MS = 300;
 
 function AddDestination({ touristId, onDestinationAdded, onCancel }) {
     const [formData, setFormData] = useState({
@@ -18,23 +21,32 @@ function AddDestination({ touristId, onDestinationAdded, onCancel }) {
             [name]: value
         }));
 
-        // Check safety score when location changes
-        if (name === 'location' && value.trim().length > 2) {
-            checkSafetyScore(value.trim());
-        }
     };
 
-    const checkSafetyScore = async (location) => {
-        try {
-            const response = await fetch(`http://localhost:8000/safety-scores/${encodeURIComponent(location)}`);
-            if (response.ok) {
-                const data = await response.json();
-                setSafetyScore(data);
-            }
-        } catch (error) {
-            console.error('Error fetching safety score:', error);
+    // Check safety score once typing pauses; repeated names come from the shared cache
+    useEffect(() => {
+        const location = formData.location.trim();
+        if (location.length <= 2) {
+            return undefined;
         }
-    };
+
+        let cancelled = false;
+        const timer = setTimeout(async () => {
+            try {
+                const data = await api.getSafetyScore(location);
+                if (!cancelled) {
+                    setSafetyScore(data);
+                }
+            } catch (error) {
+                console.error('Error fetching safety score:', error);
+            }
+        }, SAFETY_LOOKUP_DELAY_MS);
+
+        return () => {
+            cancelled = true;
+            clearTimeout(timer);
+        };
+    }, [formData.location]);
 
     const handleSubmit = async (e) => {
         e.preventDefault();
@@ -160,10 +160,10 @@ function TouristDashboard() {
                                     <p><strong>Destination:</strong> {touristData.destination}</p>
                                     <p><strong>Valid Until:</strong> {formatDate(touristData.valid_until)}</p>
                                 </div>
-                                {touristData.qr_code_data && (
+                                {touristData.tourist_id && (
                                     <div className="id-qr">
                                         <img 
-                                            src={touristData.qr_code_data} 
+                                            src={`http://localhost:8000/tourist/${touristData.tourist_id}/qr.png`} 
                                             alt="Tourist QR Code"
                                             style={{ width: '80px', height: '80px' }}
                                         />
@@ -1,9 +1,16 @@
 // src/utils/api.js - Centralized API utilities
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000';
+// Matches the server's SAFETY_SCORES_BATCH_LIMIT and SAFETY_SCORES_MAX_AGE
+const SAFETY_SCORES_BATCH_LIMIT = 200;
+const SAFETY_SCORE_TTL_MS = 5 * 60 * 1000;
 
 class ApiService {
     constructor() {
         this.baseURL = API_BASE_URL;
+        // Safety scores by normalized location -> { promise, expiresAt };
+        // lookups in the same tick share batch requests of at most SAFETY_SCORES_BATCH_LIMIT
+        this.safetyScoreCache = new Map();
+        this.pendingSafetyScores = null;
     }
 
     async request(endpoint, options = {}) {
@@ -84,12 +91,54 @@ class ApiService {
         });
     }
 
-    async getAllTourists() {
-        return this.request('/tourists/');
+    async getSafetyScore(location) {
+        const [score] = await this.getSafetyScores([location]);
+        return score;
     }
 
-    async getSafetyScore(location) {
-        return this.request(`/safety-scores/${location}`);
+    async getSafetyScores(locations) {
+        const now = Date.now();
+        return Promise.all(locations.map(location => {
+            const key = location.trim().toLowerCase();
+            const cached = this.safetyScoreCache.get(key);
+            if (cached && cached.expiresAt > now) {
+                return cached.promise;
+            }
+            const entry = { promise: this.queueSafetyScore(location), expiresAt: now + SAFETY_SCORE_TTL_MS };
+            // Drop failed lookups so they are retried next time
+            entry.promise.catch(() => {
+                if (this.safetyScoreCache.get(key) === entry) {
+                    this.safetyScoreCache.delete(key);
+                }
+            });
+            this.safetyScoreCache.set(key, entry);
+            return entry.promise;
+        }));
+    }
+
+    queueSafetyScore(location) {
+        if (!this.pendingSafetyScores || this.pendingSafetyScores.locations.length >= SAFETY_SCORES_BATCH_LIMIT) {
+            const batch = { locations: [], waiters: [] };
+            this.pendingSafetyScores = batch;
+            Promise.resolve().then(() => this.flushSafetyScores(batch));
+        }
+        const batch = this.pendingSafetyScores;
+        batch.locations.push(location);
+        return new Promise((resolve, reject) => batch.waiters.push({ resolve, reject }));
+    }
+
+    async flushSafetyScores(batch) {
+        if (this.pendingSafetyScores === batch) {
+            this.pendingSafetyScores = null;
+        }
+        const params = new URLSearchParams();
+        batch.locations.forEach(location => params.append('locations', location));
+        try {
+            const data = await this.request(`/safety-scores/batch?${params.toString()}`);
+            batch.waiters.forEach(({ resolve }, index) => resolve(data.scores[index]));
+        } catch (error) {
+            batch.waiters.forEach(({ reject }) => reject(error));
+        }
     }
 }
 
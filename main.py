@@ -1,9 +1,11 @@
 # main.py (Complete with Geofencing)
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks, WebSocket, WebSocketDisconnect, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks, WebSocket, WebSocketDisconnect, Request, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any, Tuple
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional, Dict, Any, Tuple, Union
 import databases
 import sqlalchemy
 from sqlalchemy import create_engine, Column, Integer, String, JSON, DateTime, Float
@@ -13,7 +15,7 @@ import qrcode
 import io
 import base64
 import json
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import uvicorn
 import os
 from dotenv import load_dotenv
@@ -24,6 +26,21 @@ import secrets
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy import func, extract, case
 import math
+import re
+import csv
+import codecs
+import urllib.parse
+import aiofiles
+import numpy as np
+import hashlib
+import asyncio
+import bisect
+import time
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging to see WebSocket messages
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -75,6 +92,34 @@ tourist_locations = sqlalchemy.Table(
     sqlalchemy.Column("last_updated", sqlalchemy.DateTime, default=datetime.utcnow)
 )
 
+# Append-only location history, partitioned by day (location_history_YYYYMMDD)
+location_history = sqlalchemy.Table(
+    "location_history",
+    metadata,
+    sqlalchemy.Column("tourist_id", sqlalchemy.String, nullable=False),
+    sqlalchemy.Column("lat", sqlalchemy.Float),
+    sqlalchemy.Column("lng", sqlalchemy.Float),
+    sqlalchemy.Column("status", sqlalchemy.String),
+    sqlalchemy.Column("recorded_at", sqlalchemy.DateTime, nullable=False),
+    sqlalchemy.Index("ix_location_history_tourist_time", "tourist_id", "recorded_at"),
+    postgresql_partition_by="RANGE (recorded_at)"
+)
+
+# Geofence zone catalog, loaded into memory at startup and on reload
+geofence_zones = sqlalchemy.Table(
+    "geofence_zones",
+    metadata,
+    sqlalchemy.Column("zone_id", sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.String),
+    sqlalchemy.Column("center_lat", sqlalchemy.Float),
+    sqlalchemy.Column("center_lng", sqlalchemy.Float),
+    sqlalchemy.Column("radius_meters", sqlalchemy.Integer),
+    sqlalchemy.Column("zone_type", sqlalchemy.String),
+    sqlalchemy.Column("description", sqlalchemy.String),
+    sqlalchemy.Column("sort_order", sqlalchemy.Integer, default=0),
+    sqlalchemy.Column("updated_at", sqlalchemy.DateTime, default=datetime.utcnow)
+)
+
 # Create database tables
 engine = create_engine(DATABASE_URL)
 metadata.create_all(engine)
@@ -84,7 +129,24 @@ async def lifespan(app: FastAPI):
     print("Connecting to the database...")
     await database.connect()
     print("Database connection established.")
+    await migrate_legacy_documents()
+    await reload_geofence_zones()
+    await refresh_safety_grid()
+    await load_gazetteer()
+    await live_state.warm()
+    await registration_stats.rebuild()
+    await event_log.load()
+    location_buffer.start()
+    history_writer.start()
+    event_log.start()
+    manager.start()
     yield
+    await manager.stop()
+    await event_log.stop()
+    await location_buffer.stop()
+    await history_writer.stop()
+    qr_renderer.shutdown()
+    route_optimizer.shutdown()
     print("Disconnecting from the database...")
     await database.disconnect()
     print("Database connection closed.")
@@ -102,6 +164,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # Security
@@ -117,6 +180,7 @@ def hash_password(password: str) -> str:
 class TouristResponse(BaseModel):
     tourist_id: str
     qr_code_data: str
+    qr_code_url: str
     message: str
 
 class ItineraryDay(BaseModel):
@@ -195,13 +259,45 @@ class GeofenceCheck(BaseModel):
     lat: float
     lng: float
 
+class GeofenceBatchPoint(BaseModel):
+    tourist_id: Optional[str] = None
+    lat: float
+    lng: float
+
+class GeofenceBatchCheck(BaseModel):
+    points: List[GeofenceBatchPoint]
+
+class SafetyPathRequest(BaseModel):
+    points: List[GeofenceBatchPoint]
+    sample_meters: float = 250
+
 # Utility Functions
+ACCESS_TOKEN_TTL = timedelta(hours=float(os.getenv("ACCESS_TOKEN_TTL_HOURS", "12")))
+
+# Live tokens handed out by /login -> (authority id, issued at), oldest first
+issued_tokens: Dict[str, Tuple[str, datetime]] = {}
+
+def prune_expired_tokens(now: datetime) -> None:
+    """Drop tokens past their TTL; insertion order is issue order, so stop at the first live one"""
+    while issued_tokens:
+        oldest = next(iter(issued_tokens))
+        if now - issued_tokens[oldest][1] < ACCESS_TOKEN_TTL:
+            break
+        del issued_tokens[oldest]
+
 def create_access_token(authority_id: str) -> str:
-    """Create a simple access token (in production, use proper JWT)"""
-    import hashlib
-    import time
-    token_data = f"{authority_id}{time.time()}"
-    return hashlib.sha256(token_data.encode()).hexdigest()
+    """Create a random access token and remember who it was issued to (in production, use proper JWT)"""
+    now = datetime.utcnow()
+    prune_expired_tokens(now)
+    token = secrets.token_urlsafe(32)
+    issued_tokens[token] = (authority_id, now)
+    return token
+
+def token_authority(token: str) -> Optional[str]:
+    """Authority id behind a token that has not expired yet"""
+    prune_expired_tokens(datetime.utcnow())
+    issued = issued_tokens.get(token)
+    return issued[0] if issued else None
 
 def generate_blockchain_hash(data: Dict) -> str:
     import hashlib
@@ -216,7 +312,77 @@ def generate_qr_code_data(tourist_id: str, blockchain_hash: str) -> str:
     direct_url = f"{base_url}?tourist_id={tourist_id}&auth_hash={blockchain_hash}&timestamp={datetime.utcnow().isoformat()}"
     return direct_url
 
-def create_qr_code_image(qr_data: str) -> str:
+def build_itinerary(destination: str, checkin_date: str, checkout_date: str, accommodation: str) -> List[dict]:
+    """Default itinerary: one day at the destination for every date of the stay"""
+    itinerary_data = []
+    
+    try:
+        checkin = datetime.strptime(checkin_date, "%Y-%m-%d")
+        checkout = datetime.strptime(checkout_date, "%Y-%m-%d")
+        
+        current_date = checkin
+        while current_date <= checkout:
+            itinerary_data.append({
+                "date": current_date.strftime("%Y-%m-%d"),
+                "location": destination,
+                "activities": "Exploring the area",
+                "accommodation": accommodation
+            })
+            current_date += timedelta(days=1)
+    except ValueError:
+        itinerary_data = [{
+            "date": checkin_date,
+            "location": destination,
+            "activities": "Exploring the area",
+            "accommodation": accommodation
+        }]
+
+    return itinerary_data
+
+def new_tourist_record(data: TouristCreate) -> dict:
+    """Column values for a new tourists row: ID, blockchain hash, itinerary and QR login URL"""
+    tourist_id = generate_unique_id()
+
+    blockchain_data = {
+        "tourist_id": tourist_id,
+        "full_name": data.fullName,
+        "id_type": data.id_type,
+        "id_number": data.id_number,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+    blockchain_hash = generate_blockchain_hash(blockchain_data)
+
+    if data.itinerary:
+        itinerary_data = [day.model_dump() for day in data.itinerary]
+    else:
+        itinerary_data = build_itinerary(data.destination, data.checkin_date, data.checkout_date, data.accommodation)
+
+    return {
+        "tourist_id": tourist_id,
+        "blockchain_hash": blockchain_hash,
+        "full_name": data.fullName,
+        "nationality": data.nationality,
+        "id_type": data.id_type,
+        "id_number": data.id_number,
+        "phone": data.phone,
+        "emergency_contact_name": data.emergency_contact_name,
+        "emergency_contact_phone": data.emergency_contact_phone,
+        "destination": data.destination,
+        "checkin_date": data.checkin_date,
+        "checkout_date": data.checkout_date,
+        "accommodation": data.accommodation,
+        "itinerary": itinerary_data,
+        "documents": [],
+        # Only the compact login URL is stored; the image is rendered on demand
+        "qr_code_data": generate_qr_code_data(tourist_id, blockchain_hash),
+        "valid_until": datetime.utcnow() + timedelta(days=30),
+        # Set here rather than by the server default so the analytics counters see the same timestamp
+        "created_at": datetime.utcnow()
+    }
+
+def render_qr_png(qr_data: str) -> bytes:
+    """Render QR code PNG bytes (CPU-bound; run it in qr_renderer's pool)"""
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -228,8 +394,219 @@ def create_qr_code_image(qr_data: str) -> str:
     img = qr.make_image(fill_color="black", back_color="white")
     buffered = io.BytesIO()
     img.save(buffered, format="PNG")
-    img_str = base64.b64encode(buffered.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
+    return buffered.getvalue()
+
+# QR rendering pool and cache
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", "2"))
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1024"))
+LEGACY_QR_PREFIX = "data:image/png;base64,"
+
+class QRCodeRenderer:
+    """Renders QR PNGs off the event loop and keeps the most recent ones in an LRU cache"""
+
+    def __init__(self, workers: int, cache_size: int):
+        self.workers = workers
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.cache_size = cache_size
+        # tourist_id -> (png, etag); QR payloads never change once issued
+        self.cache: OrderedDict = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def get_cached(self, tourist_id: str) -> Optional[Tuple[bytes, str]]:
+        entry = self.cache.get(tourist_id)
+        if entry is not None:
+            self.cache.move_to_end(tourist_id)
+        return entry
+
+    def _store(self, tourist_id: str, png: bytes) -> Tuple[bytes, str]:
+        entry = (png, f'"{hashlib.sha256(png).hexdigest()[:32]}"')
+        self.cache[tourist_id] = entry
+        self.cache.move_to_end(tourist_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return entry
+
+    async def render(self, tourist_id: str, qr_data: str) -> Tuple[bytes, str]:
+        cached = self.get_cached(tourist_id)
+        if cached is not None:
+            return cached
+
+        if qr_data.startswith(LEGACY_QR_PREFIX):
+            # Rows created before lazy rendering hold the finished image
+            return self._store(tourist_id, base64.b64decode(qr_data[len(LEGACY_QR_PREFIX):]))
+
+        # Concurrent requests for the same code share one render
+        future = self._inflight.get(tourist_id)
+        if future is None:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="qr-render")
+            future = asyncio.get_running_loop().run_in_executor(self.executor, render_qr_png, qr_data)
+            self._inflight[tourist_id] = future
+            try:
+                png = await future
+            finally:
+                self._inflight.pop(tourist_id, None)
+            return self._store(tourist_id, png)
+
+        await future
+        return self.cache.get(tourist_id) or self._store(tourist_id, future.result())
+
+    async def prewarm(self, tourist_id: str, qr_data: str):
+        try:
+            await self.render(tourist_id, qr_data)
+        except Exception as e:
+            logger.error(f"Error pre-rendering QR code for {tourist_id}: {e}")
+
+    async def prewarm_many(self, codes: List[Tuple[str, str]]):
+        """Pre-render (tourist_id, qr_data) pairs, at most one pool's worth at a time"""
+        for start in range(0, len(codes), self.workers):
+            await asyncio.gather(*(self.prewarm(tourist_id, qr_data)
+                                   for tourist_id, qr_data in codes[start:start + self.workers]))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+qr_renderer = QRCodeRenderer(QR_RENDER_WORKERS, QR_CACHE_SIZE)
+
+# Content-addressed document storage
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "blob_store")
+BLOB_CHUNK_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+class BlobStore:
+    """Stores uploaded documents on disk under their SHA-256, streaming in fixed-size chunks"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return bool(SHA256_PATTERN.match(digest)) and os.path.isfile(self.path_for(digest))
+
+    async def _write_chunks(self, chunks) -> Tuple[str, int]:
+        digest = hashlib.sha256()
+        size = 0
+        # Directories are created on first write so importing the module touches no disk
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as out:
+                async for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    await out.write(chunk)
+
+            key = digest.hexdigest()
+            final_path = self.path_for(key)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            if os.path.exists(final_path):
+                os.remove(tmp_path)  # Same content is already stored
+            else:
+                os.replace(tmp_path, final_path)
+            return key, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def save_upload(self, upload: UploadFile) -> Tuple[str, int]:
+        async def chunks():
+            while True:
+                chunk = await upload.read(BLOB_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        return await self._write_chunks(chunks())
+
+    async def save_bytes(self, content: bytes) -> Tuple[str, int]:
+        async def chunks():
+            for start in range(0, len(content), BLOB_CHUNK_SIZE):
+                yield content[start:start + BLOB_CHUNK_SIZE]
+        return await self._write_chunks(chunks())
+
+    async def iter_range(self, digest: str, start: int, end: int):
+        """Yield bytes start..end (inclusive) of a stored blob"""
+        async with aiofiles.open(self.path_for(digest), "rb") as blob:
+            await blob.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await blob.read(min(BLOB_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+blob_store = BlobStore(BLOB_STORE_DIR)
+
+def content_disposition(disposition: str, filename: str) -> str:
+    """Header value with an ASCII filename fallback and the exact name as RFC 5987 filename*"""
+    fallback = "".join(ch if " " <= ch <= "~" and ch not in '"\\' else "_" for ch in filename) or "download"
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+def document_metadata(tourist_id: str, position: int, filename: str, content_type: str, digest: str, size: int) -> dict:
+    return {
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "sha256": digest,
+        "url": f"/tourist/{tourist_id}/documents/{position}"
+    }
+
+def parse_range_header(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single 'bytes=start-end' range; None means the whole blob"""
+    if not range_header:
+        return None
+    match = re.match(r"^bytes=(\d*)-(\d*)$", range_header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None  # Unsupported forms (e.g. multiple ranges) get the full body
+
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        start = max(0, size - int(match.group(2)))
+        end = size - 1
+
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416, detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+async def migrate_legacy_documents() -> int:
+    """Move base64 document content still stored in tourist rows into the blob store"""
+    query = sqlalchemy.select(tourists.c.id).where(
+        sqlalchemy.cast(tourists.c.documents, sqlalchemy.Text).like('%"content"%')
+    )
+    ids = [row["id"] for row in await database.fetch_all(query)]
+
+    for row_id in ids:
+        row = await database.fetch_one(
+            sqlalchemy.select(tourists.c.tourist_id, tourists.c.documents).where(tourists.c.id == row_id)
+        )
+        documents_data = []
+        for position, document in enumerate(row["documents"] or []):
+            if "content" in document:
+                digest, size = await blob_store.save_bytes(base64.b64decode(document["content"]))
+                document = document_metadata(
+                    row["tourist_id"], position, document.get("filename"),
+                    document.get("content_type"), digest, size
+                )
+            documents_data.append(document)
+
+        await database.execute(
+            tourists.update().where(tourists.c.id == row_id).values(documents=documents_data)
+        )
+
+    if ids:
+        logger.info(f"Moved documents of {len(ids)} tourists into the blob store")
+    return len(ids)
 
 def get_safety_category(score: int) -> str:
     """Convert numeric score to category"""
@@ -355,6 +732,225 @@ def check_geofence_violations(lat: float, lng: float, zones: List[dict]) -> List
     
     return violations
 
+def classify_violations(violations: List[dict]) -> Tuple[str, str]:
+    """Get (status, alert_level) for a list of zone violations"""
+    if not violations:
+        return "safe", "none"
+
+    if any(v["zone"]["zone_type"] == "danger" for v in violations):
+        return "danger", "high"
+    if any(v["zone"]["zone_type"] == "warning" for v in violations):
+        return "warning", "medium"
+    return "safe", "low"
+
+def haversine_distance_array(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """Vectorized calculate_distance over broadcastable NumPy arrays (in meters)"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(lat2 - lat1)
+    delta_lng = np.radians(lng2 - lng1)
+
+    a = (np.sin(delta_lat / 2) ** 2 +
+         np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(delta_lng / 2) ** 2)
+
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTH_RADIUS_METERS * c
+
+# Spatial index for geofence zones
+EARTH_RADIUS_METERS = 6371000
+GEOFENCE_GRID_CELL_DEG = float(os.getenv("GEOFENCE_GRID_CELL_DEG", "0.25"))
+
+def zone_bounding_box(zone: dict) -> Tuple[float, float, float, float]:
+    """Get a conservative (min_lat, min_lng, max_lat, max_lng) box around a circular zone"""
+    # Pad the radius slightly so float rounding can never drop a point the
+    # Haversine check would accept; the exact check still runs afterwards.
+    angular_radius = (zone["radius_meters"] * 1.000001 + 1) / EARTH_RADIUS_METERS
+    center_lat = zone["center_lat"]
+    center_lng = zone["center_lng"]
+    delta_lat = math.degrees(angular_radius)
+    min_lat = center_lat - delta_lat
+    max_lat = center_lat + delta_lat
+
+    # Zones touching a pole (or bigger than a hemisphere) span every longitude
+    if min_lat <= -90 or max_lat >= 90 or angular_radius >= math.pi / 2:
+        return max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0
+
+    delta_lng = math.degrees(math.asin(
+        min(1.0, math.sin(angular_radius) / math.cos(math.radians(center_lat)))
+    ))
+    return min_lat, center_lng - delta_lng, max_lat, center_lng + delta_lng
+
+class GeofenceIndex:
+    """Grid index over zone bounding boxes, built once and queried per location"""
+
+    def __init__(self, zones: List[dict], cell_deg: float = GEOFENCE_GRID_CELL_DEG):
+        self.zones = list(zones)
+        self.cell_deg = cell_deg
+        self.lng_cells = int(math.ceil(360 / cell_deg))
+        self.boxes: List[Tuple[float, float, float, float]] = []
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+
+        for position, zone in enumerate(self.zones):
+            box = zone_bounding_box(zone)
+            self.boxes.append(box)
+            for cell in self._cells_for_box(box):
+                self.cells.setdefault(cell, []).append(position)
+
+    def _lat_cell(self, lat: float) -> int:
+        return int(math.floor((lat + 90) / self.cell_deg))
+
+    def _lng_cell(self, lng: float) -> int:
+        return int(math.floor((lng + 180) / self.cell_deg)) % self.lng_cells
+
+    def _cells_for_box(self, box: Tuple[float, float, float, float]):
+        min_lat, min_lng, max_lat, max_lng = box
+        if max_lng - min_lng >= 360:
+            lng_range = range(self.lng_cells)
+        else:
+            first = int(math.floor((min_lng + 180) / self.cell_deg))
+            last = int(math.floor((max_lng + 180) / self.cell_deg))
+            lng_range = [i % self.lng_cells for i in range(first, last + 1)]
+
+        for lat_cell in range(self._lat_cell(min_lat), self._lat_cell(max_lat) + 1):
+            for lng_cell in lng_range:
+                yield (lat_cell, lng_cell)
+
+    def _box_contains(self, box: Tuple[float, float, float, float], lat: float, lng: float) -> bool:
+        min_lat, min_lng, max_lat, max_lng = box
+        if not min_lat <= lat <= max_lat:
+            return False
+        if max_lng - min_lng >= 360:
+            return True
+        # Compare on the same side of the antimeridian as the box
+        offset = (lng - min_lng) % 360
+        return offset <= max_lng - min_lng
+
+    def candidates(self, lat: float, lng: float) -> List[int]:
+        """Positions of zones whose bounding boxes contain the point, in catalog order"""
+        bucket = self.cells.get((self._lat_cell(lat), self._lng_cell(lng)), [])
+        return [p for p in bucket if self._box_contains(self.boxes[p], lat, lng)]
+
+    def check(self, lat: float, lng: float) -> List[dict]:
+        """Same result as check_geofence_violations over the indexed zones"""
+        return check_geofence_violations(
+            lat, lng, [self.zones[p] for p in self.candidates(lat, lng)]
+        )
+
+    def cell_keys(self, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        """Flat grid cell key for each point, matching the keys used in self.cells"""
+        lat_cells = np.floor((lats + 90) / self.cell_deg).astype(np.int64)
+        lng_cells = np.floor((lngs + 180) / self.cell_deg).astype(np.int64) % self.lng_cells
+        return lat_cells * self.lng_cells + lng_cells
+
+# Largest points x zones distance matrix evaluated at once in batch checks
+GEOFENCE_BATCH_MAX_CELLS = 1_000_000
+
+def check_geofence_batch(lats: np.ndarray, lngs: np.ndarray, snapshot: "GeofenceSnapshot") -> List[List[dict]]:
+    """Evaluate many points against the zone catalog; returns violations per point"""
+    index = snapshot.index
+    results: List[List[dict]] = [[] for _ in range(len(lats))]
+    if not len(lats):
+        return results
+
+    # Group points by grid cell so each group only meets its candidate zones
+    keys = index.cell_keys(lats, lngs)
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.searchsorted(inverse[order], np.arange(len(unique_keys) + 1))
+
+    for group, key in enumerate(unique_keys):
+        bucket = snapshot.cell_arrays.get(int(key))
+        if bucket is None:
+            continue
+
+        point_ids = order[bounds[group]:bounds[group + 1]]
+        chunk = max(1, GEOFENCE_BATCH_MAX_CELLS // len(bucket))
+        for start in range(0, len(point_ids), chunk):
+            ids = point_ids[start:start + chunk]
+            distances = haversine_distance_array(
+                lats[ids][:, None], lngs[ids][:, None],
+                snapshot.zone_lats[bucket][None, :], snapshot.zone_lngs[bucket][None, :]
+            )
+            rows, cols = np.nonzero(distances <= snapshot.zone_radii[bucket][None, :])
+            for row, col in zip(rows.tolist(), cols.tolist()):
+                results[ids[row]].append({
+                    "zone": snapshot.zones[bucket[col]],
+                    "distance_from_center": round(float(distances[row, col]), 2),
+                    "violation_type": "inside_zone"
+                })
+
+    return results
+
+class GeofenceSnapshot:
+    """Immutable view of the zone catalog: zones, spatial index and the /geofence/zones/ payload"""
+
+    def __init__(self, zones: List[dict], source: str):
+        # Validate once here so request handlers can trust the zone dicts
+        self.zones: Tuple[dict, ...] = tuple(GeofenceZone(**zone).model_dump() for zone in zones)
+        self.source = source
+        self.loaded_at = datetime.utcnow()
+        self.index = GeofenceIndex(list(self.zones))
+        self.zones_by_id: Dict[str, dict] = {z["zone_id"]: z for z in self.zones}
+
+        # Columnar copies of the catalog for vectorized batch checks
+        self.zone_lats = np.array([z["center_lat"] for z in self.zones], dtype=np.float64)
+        self.zone_lngs = np.array([z["center_lng"] for z in self.zones], dtype=np.float64)
+        self.zone_radii = np.array([z["radius_meters"] for z in self.zones], dtype=np.float64)
+        self.cell_arrays: Dict[int, np.ndarray] = {
+            lat_cell * self.index.lng_cells + lng_cell: np.array(positions, dtype=np.int64)
+            for (lat_cell, lng_cell), positions in self.index.cells.items()
+        }
+
+        self.response_body = json.dumps({
+            "zones": list(self.zones),
+            "total_zones": len(self.zones),
+            "zone_types": {
+                "safe": len([z for z in self.zones if z["zone_type"] == "safe"]),
+                "warning": len([z for z in self.zones if z["zone_type"] == "warning"]),
+                "danger": len([z for z in self.zones if z["zone_type"] == "danger"])
+            }
+        }).encode()
+        self.etag = f'"{hashlib.sha256(self.response_body).hexdigest()[:32]}"'
+
+# Request handlers read this reference once; reloads swap it in a single assignment
+geofence_snapshot = GeofenceSnapshot(get_predefined_zones(), source="predefined")
+geofence_reload_lock = asyncio.Lock()
+
+async def reload_geofence_zones() -> GeofenceSnapshot:
+    """Load the zone catalog from the database and atomically swap the active snapshot"""
+    global geofence_snapshot
+
+    async with geofence_reload_lock:
+        count = await database.fetch_val(sqlalchemy.select(func.count()).select_from(geofence_zones))
+        if not count:
+            # Seed an empty catalog with the built-in zones
+            await database.execute_many(geofence_zones.insert(), [
+                {**zone, "sort_order": position, "updated_at": datetime.utcnow()}
+                for position, zone in enumerate(get_predefined_zones())
+            ])
+
+        query = geofence_zones.select().order_by(geofence_zones.c.sort_order, geofence_zones.c.zone_id)
+        rows = await database.fetch_all(query)
+        zones = [{
+            "zone_id": row["zone_id"],
+            "name": row["name"],
+            "center_lat": row["center_lat"],
+            "center_lng": row["center_lng"],
+            "radius_meters": row["radius_meters"],
+            "zone_type": row["zone_type"],
+            "description": row["description"]
+        } for row in rows]
+
+        # Build off the event loop; requests keep using the old snapshot meanwhile
+        snapshot = await asyncio.get_running_loop().run_in_executor(
+            None, GeofenceSnapshot, zones, "database"
+        )
+        geofence_snapshot = snapshot
+        dropped = geofence_membership.retain_zones(snapshot.zones_by_id)
+        logger.info(f"Loaded {len(snapshot.zones)} geofence zones (etag {snapshot.etag}); "
+                    f"dropped {dropped} memberships of removed zones")
+        return snapshot
+
 def get_safety_recommendations(violations: List[dict]) -> List[str]:
     """Generate safety recommendations based on zone violations"""
     recommendations = []
@@ -385,272 +981,2541 @@ def get_safety_recommendations(violations: List[dict]) -> List[str]:
     
     return recommendations
 
-def get_coordinates_for_location(location_name: str) -> Tuple[float, float]:
-    """Get coordinates for a location name"""
-    location_coords = {
-        'Delhi': (28.6139, 77.2090),
-        'Mumbai': (19.0760, 72.8777),
-        'Goa': (15.2993, 74.1240),
-        'Rajasthan': (26.9124, 75.7873),
-        'Kerala': (9.9312, 76.2673),
-        'Kolkata': (22.5726, 88.3639),
-        'Tokyo': (35.6762, 139.6503),
-        'London': (51.5074, -0.1278),
-        'Paris': (48.8566, 2.3522),
-        'New York': (40.7128, -74.0060),
-        'Bangkok': (13.7563, 100.5018),
-        'baghi': (30.1204, 78.2706),
-        'thdc-dam': (30.1464, 78.4322)
-    }
-    
-    return location_coords.get(location_name.strip().title(), (28.6139, 77.2090))
+# Gazetteer: place name -> coordinates
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "")  # GeoNames tab-separated dump (e.g. IN.txt, cities15000.txt)
+ITINERARY_CACHE_SIZE = int(os.getenv("ITINERARY_CACHE_SIZE", "10000"))
 
-# WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+BUILTIN_PLACES = {
+    'Delhi': (28.6139, 77.2090),
+    'Mumbai': (19.0760, 72.8777),
+    'Goa': (15.2993, 74.1240),
+    'Rajasthan': (26.9124, 75.7873),
+    'Kerala': (9.9312, 76.2673),
+    'Kolkata': (22.5726, 88.3639),
+    'Tokyo': (35.6762, 139.6503),
+    'London': (51.5074, -0.1278),
+    'Paris': (48.8566, 2.3522),
+    'New York': (40.7128, -74.0060),
+    'Bangkok': (13.7563, 100.5018),
+    'baghi': (30.1204, 78.2706),
+    'thdc-dam': (30.1464, 78.4322)
+}
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"New police dashboard connected. Total connections: {len(self.active_connections)}")
+def normalize_place_name(name: str) -> str:
+    """Lowercase ASCII words separated by single spaces, so 'THDC-Dam' and 'thdc dam' match"""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.findall(r"[a-z0-9]+", ascii_name.lower()))
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        logger.info(f"Police dashboard disconnected. Total connections: {len(self.active_connections)}")
+class Gazetteer:
+    """Sorted normalized names with parallel coordinate arrays; exact and prefix lookups by bisection"""
 
-    async def broadcast(self, message: str):
-        disconnected_connections = []
-        for connection in self.active_connections:
-            try:
-                await connection.send_text(message)
-            except WebSocketDisconnect:
-                disconnected_connections.append(connection)
-            except Exception as e:
-                logger.error(f"Error broadcasting to WebSocket: {e}")
-                disconnected_connections.append(connection)
+    def __init__(self, places: List[Tuple[str, str, float, float, int]]):
+        # places: (name, normalized key, lat, lng, population); the most populous place wins a shared key
+        best: Dict[str, Tuple[str, float, float, int]] = {}
+        for name, key, lat, lng, population in places:
+            if key and (key not in best or population > best[key][3]):
+                best[key] = (name, lat, lng, population)
 
-        for connection in disconnected_connections:
-            if connection in self.active_connections:
-                self.active_connections.remove(connection)
+        self.keys: List[str] = sorted(best)
+        self.names: List[str] = [best[key][0] for key in self.keys]
+        self.lats = np.array([best[key][1] for key in self.keys], dtype=np.float64)
+        self.lngs = np.array([best[key][2] for key in self.keys], dtype=np.float64)
 
-manager = ConnectionManager()
+    def __len__(self) -> int:
+        return len(self.keys)
 
-# Hardcoded admin credentials
-ADMIN_CREDENTIALS = {
-    "admin": {
-        "password_hash": hash_password("1234"),
-        "full_name": "System Administrator",
-        "department": "Tourism Ministry"
-    }
-}
+    def _place(self, index: int) -> dict:
+        return {"name": self.names[index], "lat": float(self.lats[index]), "lng": float(self.lngs[index])}
 
-# API ENDPOINTS
+    def lookup(self, name: str) -> Optional[Tuple[float, float]]:
+        key = normalize_place_name(name)
+        index = bisect.bisect_left(self.keys, key)
+        if key and index < len(self.keys) and self.keys[index] == key:
+            return float(self.lats[index]), float(self.lngs[index])
+        return None
 
-@app.get("/")
-async def root():
-    return {"message": "Tourist Safety System API"}
+    def search(self, prefix: str, limit: int = 10) -> List[dict]:
+        key = normalize_place_name(prefix)
+        if not key:
+            return []
+        results = []
+        index = bisect.bisect_left(self.keys, key)
+        while index < len(self.keys) and len(results) < limit and self.keys[index].startswith(key):
+            results.append(self._place(index))
+            index += 1
+        return results
 
-@app.post("/login", response_model=AdminLoginResponse)
-async def login_admin(credentials: AdminLogin):
-    try:
-        if credentials.authorityId not in ADMIN_CREDENTIALS:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        admin_user = ADMIN_CREDENTIALS[credentials.authorityId]
-        
-        if hash_password(credentials.password) != admin_user["password_hash"]:
-            raise HTTPException(status_code=401, detail="Invalid credentials")
-        
-        access_token = create_access_token(credentials.authorityId)
-        
-        return {
-            "access_token": access_token,
-            "token_type": "bearer",
-            "redirect": "/dashboard",
-            "message": "Login successful"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
+def read_geonames_places(path: str) -> List[Tuple[str, str, float, float, int]]:
+    """Name and ASCII name rows from a GeoNames dump (geonameid, name, asciiname, alternatenames, lat, lng, ...)"""
+    places = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            columns = line.rstrip("\n").split("\t")
+            if len(columns) < 6:
+                continue
+            try:
+                lat, lng = float(columns[4]), float(columns[5])
+                population = int(columns[14]) if len(columns) > 14 and columns[14] else 0
+            except ValueError:
+                continue
+            for name in (columns[1], columns[2]):
+                places.append((name, normalize_place_name(name), lat, lng, population))
+    return places
 
-@app.post("/authenticate-qr/")
-async def authenticate_qr(auth_data: QRAuthRequest):
+def build_gazetteer(path: str) -> Gazetteer:
+    places = read_geonames_places(path) if path else []
+    # Built-in places always win over file entries with the same key
+    places.extend((name, normalize_place_name(name), lat, lng, float("inf")) for name, (lat, lng) in BUILTIN_PLACES.items())
+    return Gazetteer(places)
+
+gazetteer = build_gazetteer("")
+
+async def load_gazetteer():
+    """Load GAZETTEER_PATH off the event loop; keep the built-in places if it is missing or unreadable"""
+    global gazetteer
+    if not GAZETTEER_PATH:
+        return
     try:
-        query = tourists.select().where(tourists.c.tourist_id == auth_data.tourist_id)
-        tourist = await database.fetch_one(query)
-        
-        if not tourist:
-            raise HTTPException(status_code=404, detail="Tourist not found")
-        
-        if tourist.blockchain_hash != auth_data.auth_hash:
-            raise HTTPException(status_code=401, detail="Invalid authentication hash")
-        
-        try:
-            qr_timestamp = datetime.fromisoformat(auth_data.timestamp.replace('Z', ''))
-            if datetime.utcnow() - qr_timestamp > timedelta(days=30):
-                raise HTTPException(status_code=401, detail="QR code expired")
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid timestamp format")
-        
-        return {
-            "tourist_id": tourist.tourist_id,
-            "full_name": tourist.full_name,
-            "nationality": tourist.nationality,
-            "destination": tourist.destination,
-            "checkin_date": tourist.checkin_date,
-            "checkout_date": tourist.checkout_date,
-            "accommodation": tourist.accommodation,
-            "itinerary": tourist.itinerary,
-            "emergency_contact_name": tourist.emergency_contact_name,
-            "emergency_contact_phone": tourist.emergency_contact_phone,
-            "valid_until": tourist.valid_until.isoformat() if tourist.valid_until else None,
-            "qr_code_data": tourist.qr_code_data,
-            "status": "authenticated",
-            "created_at": tourist.created_at.isoformat() if tourist.created_at else None
-        }
-        
+        gazetteer = await asyncio.get_running_loop().run_in_executor(None, build_gazetteer, GAZETTEER_PATH)
+        # Cached itineraries hold coordinates from the previous gazetteer
+        itinerary_cache.clear()
+        logger.info(f"Loaded gazetteer with {len(gazetteer)} names from {GAZETTEER_PATH}")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Authentication failed: {str(e)}")
+        logger.error(f"Error loading gazetteer from {GAZETTEER_PATH}: {e}")
 
-@app.post("/register-tourist/", response_model=TouristResponse)
-async def register_tourist(
-    background_tasks: BackgroundTasks,
-    fullName: str = Form(...),
-    nationality: str = Form(...),
-    id_type: str = Form(...),
-    id_number: str = Form(...),
-    phone: str = Form(...),
-    emergency_contact_name: str = Form(...),
-    emergency_contact_phone: str = Form(...),
-    destination: str = Form(...),
-    checkin_date: str = Form(...),
-    checkout_date: str = Form(...),
-    accommodation: str = Form(...),
-    documents: List[UploadFile] = File([])
-):
+def get_coordinates_for_location(location_name: str) -> Optional[Tuple[float, float]]:
+    """Get coordinates for a location name, or None if the gazetteer does not know it"""
+    return gazetteer.lookup(location_name)
+
+def parse_itinerary_date(value: Any) -> Optional[date]:
     try:
-        itinerary_data = []
-        
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+class ItineraryPlan:
+    """A tourist's itinerary indexed by date, with each day's location already geocoded"""
+
+    def __init__(self, itinerary: List[dict]):
+        # Every entry in stored order with its coordinates
+        self.entries: List[Tuple[dict, Optional[Tuple[float, float]]]] = []
+        self.days: Dict[date, dict] = {}
+        self.coordinates: Dict[date, Optional[Tuple[float, float]]] = {}
+        resolved: Dict[str, Optional[Tuple[float, float]]] = {}
+        for day in itinerary:
+            location = day.get("location") or ""
+            if location not in resolved:
+                resolved[location] = get_coordinates_for_location(location)
+            self.entries.append((day, resolved[location]))
+
+            day_date = parse_itinerary_date(day.get("date"))
+            # The first entry for a date is the plan, as it was with the linear scan
+            if day_date is None or day_date in self.days:
+                continue
+            self.days[day_date] = day
+            self.coordinates[day_date] = resolved[location]
+
+class ItineraryCache:
+    """Parsed itineraries per tourist (bounded LRU); writers invalidate after changing the itinerary"""
+
+    def __init__(self, max_tourists: int):
+        self.max_tourists = max_tourists
+        self._plans: OrderedDict = OrderedDict()
+        # Loads in progress per tourist, and how often the tourist was invalidated meanwhile
+        self._loading: Counter = Counter()
+        self._generations: Counter = Counter()
+
+    async def get(self, tourist_id: str) -> Optional[ItineraryPlan]:
+        """Cached plan, loading only the itinerary column on a miss; None if the tourist does not exist"""
+        plan = self._plans.get(tourist_id)
+        if plan is not None:
+            self._plans.move_to_end(tourist_id)
+            return plan
+
+        generation = self._generations[tourist_id]
+        self._loading[tourist_id] += 1
         try:
-            checkin = datetime.strptime(checkin_date, "%Y-%m-%d")
-            checkout = datetime.strptime(checkout_date, "%Y-%m-%d")
-            
-            current_date = checkin
-            while current_date <= checkout:
-                itinerary_data.append({
-                    "date": current_date.strftime("%Y-%m-%d"),
-                    "location": destination,
-                    "activities": "Exploring the area",
-                    "accommodation": accommodation
-                })
-                current_date += timedelta(days=1)
-        except ValueError:
-            itinerary_data = [{
-                "date": checkin_date,
-                "location": destination,
-                "activities": "Exploring the area",
-                "accommodation": accommodation
-            }]
+            query = sqlalchemy.select(tourists.c.itinerary).where(tourists.c.tourist_id == tourist_id)
+            row = await database.fetch_one(query)
+        finally:
+            current = self._generations[tourist_id]
+            self._loading[tourist_id] -= 1
+            if not self._loading[tourist_id]:
+                del self._loading[tourist_id]
+                self._generations.pop(tourist_id, None)
+        if row is None:
+            return None
 
-        tourist_id = generate_unique_id()
+        plan = ItineraryPlan(row["itinerary"] or [])
+        if current != generation:
+            # Invalidated while loading; this row may predate the write, so do not cache it
+            return plan
+        self._plans[tourist_id] = plan
+        if len(self._plans) > self.max_tourists:
+            self._plans.popitem(last=False)
+        return plan
 
-        blockchain_data = {
-            "tourist_id": tourist_id,
-            "full_name": fullName,
-            "id_type": id_type,
-            "id_number": id_number,
-            "timestamp": datetime.utcnow().isoformat()
-        }
+    def invalidate(self, tourist_id: str):
+        self._plans.pop(tourist_id, None)
+        if tourist_id in self._loading:
+            self._generations[tourist_id] += 1
 
-        blockchain_hash = generate_blockchain_hash(blockchain_data)
+    def clear(self):
+        self._plans.clear()
+        for tourist_id in self._loading:
+            self._generations[tourist_id] += 1
 
-        documents_data = []
-        for document in documents:
-            document_content = await document.read()
-            documents_data.append({
-                "filename": document.filename,
-                "content_type": document.content_type,
-                "size": len(document_content),
-                "content": base64.b64encode(document_content).decode('utf-8')
-            })
+itinerary_cache = ItineraryCache(ITINERARY_CACHE_SIZE)
 
-        qr_data = generate_qr_code_data(tourist_id, blockchain_hash)
-        qr_code_image = create_qr_code_image(qr_data)
+# Safety scores dataset, compiled into an immutable lookup
+SAFETY_SCORES_PATH = os.getenv("SAFETY_SCORES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "safety_scores.json"))
+SAFETY_SCORES_MAX_AGE = int(os.getenv("SAFETY_SCORES_MAX_AGE", "300"))
+SAFETY_SCORES_BATCH_LIMIT = 200
+DEFAULT_SAFETY_ENTRY = {"score": 90, "factors": ["Unknown area"], "tips": ["Research local conditions", "Stay vigilant"]}
 
-        valid_until = datetime.utcnow() + timedelta(days=30)
+class SafetyScoreTable:
+    """One version of the safety scores dataset, keyed by normalized place name"""
 
-        query = tourists.insert().values(
-            tourist_id=tourist_id,
-            blockchain_hash=blockchain_hash,
-            full_name=fullName,
-            nationality=nationality,
-            id_type=id_type,
-            id_number=id_number,
-            phone=phone,
+    def __init__(self, dataset: dict, source: str):
+        self.source = source
+        self.version = str(dataset.get("version", "0"))
+        self.updated_at = dataset.get("updated_at") or datetime.utcnow().isoformat()
+        self.default = self._compile(dataset.get("default") or DEFAULT_SAFETY_ENTRY)
+        self.entries: Dict[str, dict] = {}
+        for name, entry in (dataset.get("locations") or {}).items():
+            key = normalize_place_name(name)
+            if key:
+                self.entries[key] = self._compile(entry)
+
+        body = json.dumps(dataset, sort_keys=True).encode()
+        self.etag = f'"{self.version}-{hashlib.sha256(body).hexdigest()[:16]}"'
+
+    def _compile(self, entry: dict) -> dict:
+        score = int(entry["score"])
+        return {
+            "safety_score": score,
+            "risk_factors": list(entry.get("factors", [])),
+            "safety_tips": list(entry.get("tips", [])),
+            "category": get_safety_category(score)
+        }
+
+    def score(self, location: str) -> dict:
+        """Safety score response for a location; unknown places get the default entry"""
+        entry = self.entries.get(normalize_place_name(location), self.default)
+        return {
+            "location": location,
+            "safety_score": entry["safety_score"],
+            "risk_factors": entry["risk_factors"],
+            "safety_tips": entry["safety_tips"],
+            "last_updated": self.updated_at,
+            "category": entry["category"]
+        }
+
+def load_safety_scores(path: str) -> SafetyScoreTable:
+    with open(path, encoding="utf-8") as f:
+        return SafetyScoreTable(json.load(f), path)
+
+try:
+    safety_table = load_safety_scores(SAFETY_SCORES_PATH)
+except Exception as e:
+    logger.error(f"Error loading safety scores from {SAFETY_SCORES_PATH}: {e}")
+    safety_table = SafetyScoreTable({"version": "builtin"}, "builtin")
+
+# Spatial safety grid: ~500 m cells scored from geofence zones and incident density
+SAFETY_GRID_PATH = os.getenv("SAFETY_GRID_PATH", "safety_grid")  # writes <path>.npy and <path>.json
+SAFETY_GRID_CELL_DEG = float(os.getenv("SAFETY_GRID_CELL_DEG", "0.0045"))  # ~500 m of latitude
+SAFETY_GRID_MAX_AGE = timedelta(hours=float(os.getenv("SAFETY_GRID_MAX_AGE_HOURS", "6")))
+SAFETY_GRID_INCIDENT_DAYS = int(os.getenv("SAFETY_GRID_INCIDENT_DAYS", "30"))
+SAFETY_GRID_BLOCK = 64  # cells per block side; only blocks near zones or incidents are stored
+SAFETY_GRID_FALLOFF_METERS = 2000
+SAFETY_BASE_SCORE = 90
+ZONE_SCORE_ADJUSTMENTS = {"danger": -50, "warning": -25, "safe": 5}
+MAX_INCIDENT_PENALTY = 30
+MAX_PATH_SAMPLES = 100000
+
+class SafetyGrid:
+    """Scores for square cells stored as blocks in one (n, B, B) uint8 array, indexed by block key"""
+
+    def __init__(self, blocks: np.ndarray, block_keys: List[Tuple[int, int]], cell_deg: float, meta: dict):
+        self.blocks = blocks
+        self.cell_deg = cell_deg
+        self.meta = meta
+        self.lng_blocks = int(math.ceil(360 / (cell_deg * SAFETY_GRID_BLOCK)))
+        # Flat block key -> position in self.blocks, plus sorted arrays for vectorized lookups
+        self.positions = {row * self.lng_blocks + col: position for position, (row, col) in enumerate(block_keys)}
+        self.sorted_keys = np.array(sorted(self.positions), dtype=np.int64)
+        self.sorted_positions = np.array([self.positions[k] for k in self.sorted_keys], dtype=np.int64)
+
+    def _cells(self, lats: np.ndarray, lngs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.floor((np.clip(lats, -90, 90 - 1e-9) + 90) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.mod(lngs + 180, 360)) / self.cell_deg).astype(np.int64)
+        return rows, cols
+
+    def score_points(self, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        """Score for each point; points outside every stored block get SAFETY_BASE_SCORE"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        scores = np.full(lats.shape, SAFETY_BASE_SCORE, dtype=np.int64)
+        if not len(self.sorted_keys) or not lats.size:
+            return scores
+
+        rows, cols = self._cells(lats, lngs)
+        keys = (rows // SAFETY_GRID_BLOCK) * self.lng_blocks + cols // SAFETY_GRID_BLOCK
+        found = np.searchsorted(self.sorted_keys, keys)
+        found = np.minimum(found, len(self.sorted_keys) - 1)
+        stored = self.sorted_keys[found] == keys
+        if stored.any():
+            positions = self.sorted_positions[found[stored]]
+            scores[stored] = self.blocks[positions, rows[stored] % SAFETY_GRID_BLOCK, cols[stored] % SAFETY_GRID_BLOCK]
+        return scores
+
+    def score_at(self, lat: float, lng: float) -> int:
+        rows, cols = self._cells(np.array([lat]), np.array([lng]))
+        row, col = int(rows[0]), int(cols[0])
+        position = self.positions.get((row // SAFETY_GRID_BLOCK) * self.lng_blocks + col // SAFETY_GRID_BLOCK)
+        if position is None:
+            return SAFETY_BASE_SCORE
+        return int(self.blocks[position, row % SAFETY_GRID_BLOCK, col % SAFETY_GRID_BLOCK])
+
+    def score_path(self, lats: List[float], lngs: List[float], sample_meters: float) -> dict:
+        """Sample a polyline every sample_meters and score the samples"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        if len(lats) < 2:
+            samples_lat, samples_lng, length = lats, lngs, 0.0
+        else:
+            legs = haversine_distance_array(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+            length = float(legs.sum())
+            steps = np.maximum(np.ceil(legs / max(sample_meters, 1.0)).astype(np.int64), 1)
+            if steps.sum() > MAX_PATH_SAMPLES:
+                steps = np.maximum((steps * MAX_PATH_SAMPLES // steps.sum()), 1)
+            # Interpolate every leg at once: leg index and fraction along it for each sample
+            leg_index = np.repeat(np.arange(len(legs)), steps)
+            offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+            fractions = offsets / steps[leg_index]
+            samples_lat = np.append(lats[leg_index] + (lats[leg_index + 1] - lats[leg_index]) * fractions, lats[-1])
+            samples_lng = np.append(lngs[leg_index] + (lngs[leg_index + 1] - lngs[leg_index]) * fractions, lngs[-1])
+
+        scores = self.score_points(samples_lat, samples_lng)
+        if not scores.size:
+            return {"samples": 0, "length_meters": 0.0, "mean_score": None, "min_score": None, "category": None}
+        worst = int(np.argmin(scores))
+        mean = float(scores.mean())
+        return {
+            "samples": int(scores.size),
+            "length_meters": round(length, 2),
+            "mean_score": round(mean, 1),
+            "min_score": int(scores[worst]),
+            "min_location": {"lat": float(samples_lat[worst]), "lng": float(samples_lng[worst])},
+            "category": get_safety_category(mean)
+        }
+
+def build_safety_grid(zones: Tuple[dict, ...], incidents: List[Tuple[float, float, int]],
+                      cell_deg: float, meta: dict) -> SafetyGrid:
+    """Score every block near a zone or incident (CPU-bound; run it in an executor)"""
+    block_deg = cell_deg * SAFETY_GRID_BLOCK
+    lng_blocks = int(math.ceil(360 / block_deg))
+    # Which zones and incidents touch each block
+    block_zones: Dict[Tuple[int, int], List[dict]] = {}
+    for zone in zones:
+        reach = (zone["radius_meters"] + SAFETY_GRID_FALLOFF_METERS) / 111195.0
+        lng_reach = reach / max(math.cos(math.radians(zone["center_lat"])), 0.01)
+        first_row = int(math.floor((zone["center_lat"] - reach + 90) / block_deg))
+        last_row = int(math.floor((zone["center_lat"] + reach + 90) / block_deg))
+        first_col = int(math.floor((zone["center_lng"] - lng_reach + 180) / block_deg))
+        last_col = int(math.floor((zone["center_lng"] + lng_reach + 180) / block_deg))
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                block_zones.setdefault((row, col % lng_blocks), []).append(zone)
+
+    block_incidents: Dict[Tuple[int, int], List[Tuple[int, int, int]]] = {}
+    for row, col, count in incidents:
+        block = (row // SAFETY_GRID_BLOCK, (col // SAFETY_GRID_BLOCK) % lng_blocks)
+        block_incidents.setdefault(block, []).append((row % SAFETY_GRID_BLOCK, col % SAFETY_GRID_BLOCK, count))
+
+    block_keys = sorted(set(block_zones) | set(block_incidents))
+    blocks = np.empty((len(block_keys), SAFETY_GRID_BLOCK, SAFETY_GRID_BLOCK), dtype=np.uint8)
+    offsets = (np.arange(SAFETY_GRID_BLOCK) + 0.5) * cell_deg
+
+    for position, (row, col) in enumerate(block_keys):
+        center_lats = (row * block_deg - 90 + offsets)[:, None]
+        center_lngs = (col * block_deg - 180 + offsets)[None, :]
+        score = np.full((SAFETY_GRID_BLOCK, SAFETY_GRID_BLOCK), float(SAFETY_BASE_SCORE))
+
+        for zone in block_zones.get((row, col), []):
+            distance = haversine_distance_array(center_lats, center_lngs, zone["center_lat"], zone["center_lng"])
+            # Full adjustment inside the zone, fading to nothing over the falloff distance
+            weight = np.clip(1 - (distance - zone["radius_meters"]) / SAFETY_GRID_FALLOFF_METERS, 0, 1)
+            score += ZONE_SCORE_ADJUSTMENTS.get(zone["zone_type"], 0) * weight
+
+        for cell_row, cell_col, count in block_incidents.get((row, col), []):
+            score[cell_row, cell_col] -= min(MAX_INCIDENT_PENALTY, 10 * math.log1p(count))
+
+        blocks[position] = np.clip(np.rint(score), 0, 100)
+
+    return SafetyGrid(blocks, block_keys, cell_deg, meta)
+
+def save_safety_grid(grid: SafetyGrid, path: str):
+    """Write <path>.npy and <path>.json, replacing any previous grid atomically"""
+    with open(f"{path}.npy.tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(grid.blocks))
+    os.replace(f"{path}.npy.tmp", f"{path}.npy")
+    keys = [[int(key // grid.lng_blocks), int(key % grid.lng_blocks)]
+            for key, _ in sorted(grid.positions.items(), key=lambda item: item[1])]
+    with open(f"{path}.json.tmp", "w") as f:
+        json.dump({**grid.meta, "cell_deg": grid.cell_deg, "block_keys": keys}, f)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+
+def load_safety_grid(path: str) -> Optional[SafetyGrid]:
+    """Memory-map a saved grid, or None if there is none"""
+    if not (os.path.exists(f"{path}.npy") and os.path.exists(f"{path}.json")):
+        return None
+    with open(f"{path}.json") as f:
+        meta = json.load(f)
+    blocks = np.load(f"{path}.npy", mmap_mode="r")
+    block_keys = [tuple(key) for key in meta.pop("block_keys")]
+    return SafetyGrid(blocks, block_keys, meta.pop("cell_deg"), meta)
+
+async def fetch_incident_cells(cell_deg: float) -> List[Tuple[int, int, int]]:
+    """Distinct tourists per grid cell with a danger status in recent location history"""
+    row = func.floor((location_history.c.lat + 90) / cell_deg).label("row")
+    col = func.floor((location_history.c.lng + 180) / cell_deg).label("col")
+    query = sqlalchemy.select(
+        row, col, func.count(sqlalchemy.distinct(location_history.c.tourist_id)).label("count")
+    ).where(
+        location_history.c.status == "danger",
+        location_history.c.recorded_at >= datetime.utcnow() - timedelta(days=SAFETY_GRID_INCIDENT_DAYS),
+        location_history.c.lat.isnot(None),
+        location_history.c.lng.isnot(None)
+    ).group_by(row, col)
+    return [(int(r["row"]), int(r["col"]), r["count"]) for r in await database.fetch_all(query)]
+
+safety_grid = SafetyGrid(np.empty((0, SAFETY_GRID_BLOCK, SAFETY_GRID_BLOCK), dtype=np.uint8), [], SAFETY_GRID_CELL_DEG, {})
+safety_grid_lock = asyncio.Lock()
+
+async def refresh_safety_grid(force: bool = False) -> SafetyGrid:
+    """Use the saved grid if it matches the current zones and is fresh enough; otherwise rebuild it"""
+    global safety_grid
+
+    async with safety_grid_lock:
+        snapshot = geofence_snapshot
+        loop = asyncio.get_running_loop()
+        if not force:
+            try:
+                saved = await loop.run_in_executor(None, load_safety_grid, SAFETY_GRID_PATH)
+            except Exception as e:
+                logger.error(f"Error loading safety grid from {SAFETY_GRID_PATH}: {e}")
+                saved = None
+            if (saved is not None and saved.meta.get("zones_etag") == snapshot.etag
+                    and saved.cell_deg == SAFETY_GRID_CELL_DEG
+                    and datetime.utcnow() - datetime.fromisoformat(saved.meta["built_at"]) < SAFETY_GRID_MAX_AGE):
+                safety_grid = saved
+                return saved
+
+        incidents = await fetch_incident_cells(SAFETY_GRID_CELL_DEG)
+        meta = {"zones_etag": snapshot.etag, "built_at": datetime.utcnow().isoformat(), "incident_cells": len(incidents)}
+        grid = await loop.run_in_executor(None, build_safety_grid, snapshot.zones, incidents, SAFETY_GRID_CELL_DEG, meta)
+        try:
+            await loop.run_in_executor(None, save_safety_grid, grid, SAFETY_GRID_PATH)
+        except Exception as e:
+            logger.error(f"Error saving safety grid to {SAFETY_GRID_PATH}: {e}")
+        safety_grid = grid
+        logger.info(f"Built safety grid with {len(grid.blocks)} blocks from {len(snapshot.zones)} zones "
+                    f"and {len(incidents)} incident cells")
+        return grid
+
+# Route optimizer: safety-weighted stop ordering with danger-zone detours
+ROUTE_OPTIMIZER_WORKERS = int(os.getenv("ROUTE_OPTIMIZER_WORKERS", "2"))
+ROUTE_OPTIMIZER_BUDGET = float(os.getenv("ROUTE_OPTIMIZER_BUDGET_SECONDS", "2.0"))
+ROUTE_MATRIX_CACHE_SIZE = 128
+ROUTE_LEG_SAMPLES = 32
+# Leg cost = distance * (1 + weight * risk), risk = (100 - mean leg score) / 100
+ROUTE_SAFETY_WEIGHT = float(os.getenv("ROUTE_SAFETY_WEIGHT", "2.0"))
+ROUTE_DETOUR_MARGIN = 1.2  # detour legs stay at least 1.2x the danger zone radius from its center
+ROUTE_DETOUR_MAX_PASSES = 4  # detours tried per danger zone before giving up on a leg
+
+def leg_matrices(lats: np.ndarray, lngs: np.ndarray, grid: SafetyGrid) -> Tuple[np.ndarray, np.ndarray]:
+    """Distance (meters) and mean safety score of the straight leg between every pair of stops"""
+    distance = haversine_distance_array(lats[:, None], lngs[:, None], lats[None, :], lngs[None, :])
+    # Sample every leg at the same fractions in one vectorized lookup
+    fractions = (np.arange(ROUTE_LEG_SAMPLES) + 0.5) / ROUTE_LEG_SAMPLES
+    sample_lats = lats[:, None, None] + (lats[None, :, None] - lats[:, None, None]) * fractions
+    sample_lngs = lngs[:, None, None] + (lngs[None, :, None] - lngs[:, None, None]) * fractions
+    scores = grid.score_points(sample_lats.ravel(), sample_lngs.ravel()).reshape(sample_lats.shape)
+    mean_scores = scores.mean(axis=2)
+    return distance, (mean_scores + mean_scores.T) / 2
+
+class RouteMatrixCache:
+    """Recent (distance, score) matrices keyed by stop coordinates and safety grid version"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._matrices: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, stops: List[Tuple[float, float]], grid: SafetyGrid) -> Tuple[np.ndarray, np.ndarray]:
+        key = (grid.meta.get("built_at"), tuple((round(lat, 6), round(lng, 6)) for lat, lng in stops))
+        with self._lock:
+            cached = self._matrices.get(key)
+            if cached is not None:
+                self._matrices.move_to_end(key)
+                return cached
+
+        matrices = leg_matrices(np.array([s[0] for s in stops]), np.array([s[1] for s in stops]), grid)
+        with self._lock:
+            self._matrices[key] = matrices
+            while len(self._matrices) > self.size:
+                self._matrices.popitem(last=False)
+        return matrices
+
+route_matrix_cache = RouteMatrixCache(ROUTE_MATRIX_CACHE_SIZE)
+
+def path_cost(order: List[int], cost: np.ndarray) -> float:
+    return float(sum(cost[a, b] for a, b in zip(order, order[1:])))
+
+def nearest_neighbour_order(cost: np.ndarray) -> List[int]:
+    """Greedy open path starting at the first stop"""
+    n = len(cost)
+    order = [0]
+    remaining = set(range(1, n))
+    while remaining:
+        last = order[-1]
+        nearest = min(remaining, key=lambda j: cost[last, j])
+        order.append(nearest)
+        remaining.remove(nearest)
+    return order
+
+def two_opt(order: List[int], cost: np.ndarray, deadline: float) -> Tuple[List[int], bool]:
+    """Improve an open path with fixed start by segment reversals; returns (order, converged)"""
+    order = list(order)
+    n = len(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, n - 1):
+            if time.monotonic() > deadline:
+                return order, False
+            a, b = order[i - 1], order[i]
+            for j in range(i + 1, n):
+                c = order[j]
+                d = order[j + 1] if j + 1 < n else None
+                # Reversing order[i..j] swaps edges (a,b),(c,d) for (a,c),(b,d); the path end is free
+                delta = cost[a, c] - cost[a, b]
+                if d is not None:
+                    delta += cost[b, d] - cost[c, d]
+                if delta < -1e-9:
+                    order[i:j + 1] = reversed(order[i:j + 1])
+                    improved = True
+                    b = order[i]
+    return order, True
+
+def segment_distance(p: Tuple[float, float], q: Tuple[float, float], c: Tuple[float, float]) -> float:
+    """Distance from c to the segment p-q in local planar meters"""
+    dx, dy = q[0] - p[0], q[1] - p[1]
+    length_sq = dx * dx + dy * dy
+    t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((c[0] - p[0]) * dx + (c[1] - p[1]) * dy) / length_sq))
+    return math.hypot(p[0] + dx * t - c[0], p[1] + dy * t - c[1])
+
+def tangent_detours(p: Tuple[float, float], q: Tuple[float, float], c: Tuple[float, float],
+                    radius: float) -> List[List[Tuple[float, float]]]:
+    """Corner points of the paths from p to q hugging the circle (c, radius) on either side, shorter first.
+    Every resulting segment lies on a tangent line, so none comes closer than radius. Empty if p or q is inside"""
+    dp = math.hypot(p[0] - c[0], p[1] - c[1])
+    dq = math.hypot(q[0] - c[0], q[1] - c[1])
+    if dp <= radius or dq <= radius:
+        return []
+    phi_p = math.atan2(p[1] - c[1], p[0] - c[0])
+    phi_q = math.atan2(q[1] - c[1], q[0] - c[0])
+    alpha_p, alpha_q = math.acos(radius / dp), math.acos(radius / dq)
+
+    # Sweep counter-clockwise or clockwise between the tangent points
+    options = []
+    for side in (1, -1):
+        theta_p = phi_p + side * alpha_p
+        theta_q = phi_q - side * alpha_q
+        sweep = ((theta_q - theta_p) * side) % (2 * math.pi)
+        # Corners where consecutive tangent lines meet, at most 60 degrees apart
+        steps = max(1, int(math.ceil(sweep / (math.pi / 3))))
+        step = sweep / steps
+        corner = radius / math.cos(step / 2)
+        points = []
+        for i in range(steps):
+            angle = theta_p + side * step * (i + 0.5)
+            points.append((c[0] + corner * math.cos(angle), c[1] + corner * math.sin(angle)))
+        options.append((sweep, points))
+    return [points for _, points in sorted(options, key=lambda option: option[0])]
+
+def detour_waypoints(start: Tuple[float, float], end: Tuple[float, float],
+                     zones: Tuple[dict, ...]) -> Tuple[List[dict], List[str], List[str]]:
+    """Waypoints that take a straight leg around the danger zones it crosses.
+    Returns (waypoints, avoided zone ids, zone ids the leg still crosses)"""
+    mid_lat = math.radians((start[0] + end[0]) / 2)
+    meters_per_deg_lat = 111195.0
+    meters_per_deg_lng = 111195.0 * max(math.cos(mid_lat), 0.01)
+
+    # Local planar coordinates (meters, x east / y north) relative to the leg start
+    def to_plane(lat, lng):
+        return ((lng - start[1]) * meters_per_deg_lng, (lat - start[0]) * meters_per_deg_lat)
+
+    danger = [(zone, to_plane(zone["center_lat"], zone["center_lng"]), zone["radius_meters"])
+              for zone in zones if zone["zone_type"] == "danger"]
+
+    def crossed_by(path):
+        return [zone["zone_id"] for zone, center, radius in danger
+                if any(segment_distance(a, b, center) < radius for a, b in zip(path, path[1:]))]
+
+    path = [(0.0, 0.0), to_plane(end[0], end[1])]
+    initially = crossed_by(path)
+    if not initially:
+        return [], [], []
+
+    unavoidable = set()
+    for _ in range(ROUTE_DETOUR_MAX_PASSES * len(danger)):
+        # First leg of the current path that still enters a zone we can go around
+        hit = None
+        for i, (a, b) in enumerate(zip(path, path[1:])):
+            for zone, center, radius in danger:
+                if zone["zone_id"] not in unavoidable and segment_distance(a, b, center) < radius:
+                    hit = (i, zone, center, radius)
+                    break
+            if hit:
+                break
+        if hit is None:
+            break
+
+        i, zone, center, radius = hit
+        a, b = path[i], path[i + 1]
+        # Keep a margin, but never so wide that a leg end sits inside the inflated circle
+        clearance = min(radius * ROUTE_DETOUR_MARGIN,
+                        0.999 * math.hypot(a[0] - center[0], a[1] - center[1]),
+                        0.999 * math.hypot(b[0] - center[0], b[1] - center[1]))
+        options = tangent_detours(a, b, center, clearance) if clearance > radius else []
+        if not options:
+            # A stop (or an earlier detour corner) lies in or at the edge of this zone
+            unavoidable.add(zone["zone_id"])
+            continue
+        # Prefer the side whose new legs enter the fewest other zones; ties keep the shorter side
+        corners = min(options, key=lambda points: len(crossed_by([a] + points + [b])))
+        path[i + 1:i + 1] = corners
+
+    still_crossed = crossed_by(path)
+    waypoints = [{"lat": start[0] + y / meters_per_deg_lat, "lng": start[1] + x / meters_per_deg_lng}
+                 for x, y in path[1:-1]]
+    avoided = [zone_id for zone_id in initially if zone_id not in still_crossed]
+    return waypoints, avoided, still_crossed
+
+def optimize_route(stops: List[Tuple[float, float]], zones: Tuple[dict, ...], grid: SafetyGrid, budget: float) -> dict:
+    """Order stops (first stop fixed) to minimise safety-weighted distance, then detour legs around
+    danger zones. CPU-bound; runs in route_optimizer's pool and stops improving after budget seconds"""
+    deadline = time.monotonic() + budget
+    distance, scores = route_matrix_cache.get(stops, grid)
+    cost = distance * (1 + ROUTE_SAFETY_WEIGHT * (100 - scores) / 100)
+
+    original = list(range(len(stops)))
+    order, converged = two_opt(nearest_neighbour_order(cost), cost, deadline)
+    # Never suggest something worse than the planned order
+    if path_cost(original, cost) <= path_cost(order, cost):
+        order = original
+
+    legs = []
+    for a, b in zip(order, order[1:]):
+        waypoints, avoided, crossed = detour_waypoints(stops[a], stops[b], zones)
+        legs.append({
+            "from": a,
+            "to": b,
+            "distance_meters": round(float(distance[a, b]), 2),
+            "mean_safety_score": round(float(scores[a, b]), 1),
+            "waypoints": waypoints,
+            "avoided_zones": avoided,
+            "crossed_zones": crossed
+        })
+
+    return {
+        "order": order,
+        "legs": legs,
+        "planned_cost": round(path_cost(original, cost), 2),
+        "optimized_cost": round(path_cost(order, cost), 2),
+        "planned_distance_meters": round(path_cost(original, distance), 2),
+        "optimized_distance_meters": round(path_cost(order, distance), 2),
+        "converged": converged
+    }
+
+class RouteOptimizer:
+    """Runs optimize_route in a small thread pool with a time budget"""
+
+    def __init__(self, workers: int, budget: float):
+        self.workers = workers
+        self.budget = budget
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    async def optimize(self, stops: List[Tuple[float, float]]) -> Optional[dict]:
+        """Optimized route, or None if the pool did not answer within the budget (plus slack)"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="route")
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, optimize_route, stops, geofence_snapshot.zones, safety_grid, self.budget
+        )
+        try:
+            # 2-opt honours the budget itself; the slack covers building the matrices
+            return await asyncio.wait_for(future, timeout=self.budget * 2 + 1)
+        except asyncio.TimeoutError:
+            logger.error(f"Route optimization for {len(stops)} stops exceeded its time budget")
+            return None
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+route_optimizer = RouteOptimizer(ROUTE_OPTIMIZER_WORKERS, ROUTE_OPTIMIZER_BUDGET)
+
+# WebSocket Manager
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop_oldest")  # 'drop_oldest', 'coalesce', 'disconnect'
+WS_LOCATION_BATCH_INTERVAL = float(os.getenv("WS_LOCATION_BATCH_INTERVAL", "0.25"))
+
+# SOS priority lane
+SOS_RETRY_INTERVAL = float(os.getenv("SOS_RETRY_INTERVAL", "2.0"))
+SOS_MAX_ATTEMPTS = int(os.getenv("SOS_MAX_ATTEMPTS", "5"))
+SOS_LATENCY_SAMPLES = 1000
+
+class LatencyMetrics:
+    """Recent priority alert latencies: receipt to first socket write (dispatch) and to dashboard ack"""
+
+    def __init__(self, size: int):
+        self.samples: Dict[str, deque] = {"dispatch": deque(maxlen=size), "ack": deque(maxlen=size)}
+        self.alerts = 0
+        self.retries = 0
+        self.failed = 0
+
+    def record(self, kind: str, seconds: float):
+        self.samples[kind].append(seconds * 1000)
+
+    def summary(self) -> dict:
+        result = {"alerts": self.alerts, "retries": self.retries, "failed_deliveries": self.failed}
+        for kind, samples in self.samples.items():
+            values = np.array(samples, dtype=np.float64)
+            result[f"{kind}_ms"] = {
+                "count": int(values.size),
+                "p50": round(float(np.percentile(values, 50)), 3) if values.size else None,
+                "p99": round(float(np.percentile(values, 99)), 3) if values.size else None,
+                "max": round(float(values.max()), 3) if values.size else None
+            }
+        return result
+
+def is_priority_alert(message: Union[str, dict]) -> bool:
+    return isinstance(message, dict) and message.get("priority") is True
+
+def priority_alert_kind(message: dict) -> str:
+    """Metrics bucket of a priority alert: a tourist's SOS or a danger zone geofence alert"""
+    return "danger" if message.get("type") == "geofence_alert" else "sos"
+
+# Kept apart so geofence traffic does not skew the SOS latency figures
+priority_metrics: Dict[str, LatencyMetrics] = {kind: LatencyMetrics(SOS_LATENCY_SAMPLES) for kind in ("sos", "danger")}
+
+class DashboardConnection:
+    """One police dashboard socket with a bounded send queue drained by its own writer task"""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, overflow_policy: str, stream_mode: str = "realtime"):
+        self.websocket = websocket
+        # 'realtime' gets every location_update, 'batched' gets periodic location_batch frames
+        self.stream_mode = stream_mode
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        # Items are [key, payload]; key is the tourist_id for coalescable messages
+        self.queue: deque = deque()
+        self.keyed: Dict[str, list] = {}
+        self.ready = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.writer: Optional[asyncio.Task] = None
+        # Priority lane: never dropped, sent before anything in self.queue, retried until acknowledged
+        self.priority: deque = deque()
+        self.next_seq = 1
+        self.unacked: Dict[int, dict] = {}
+
+    def enqueue_priority(self, message: dict, created_at: float) -> Optional[int]:
+        """Queue a priority alert with this connection's next sequence number"""
+        if self.closed:
+            return None
+        seq = self.next_seq
+        self.next_seq += 1
+        self.unacked[seq] = {
+            "payload": json.dumps({**message, "seq": seq}),
+            "kind": priority_alert_kind(message),
+            "created_at": created_at,
+            "sent_at": None,
+            "attempts": 0
+        }
+        self.priority.append(seq)
+        self.ready.set()
+        return seq
+
+    def ack(self, seq: int) -> Optional[dict]:
+        return self.unacked.pop(seq, None)
+
+    def due_for_retry(self, now: float, interval: float) -> List[int]:
+        """Sent but unacknowledged alerts whose last attempt is older than interval"""
+        return [seq for seq, entry in self.unacked.items()
+                if entry["sent_at"] is not None and now - entry["sent_at"] >= interval and seq not in self.priority]
+
+    def enqueue(self, payload: str, key: Optional[str] = None) -> bool:
+        """Queue a serialized message; returns False if the client should be disconnected"""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            if self.overflow_policy == "disconnect":
+                return False
+            if self.overflow_policy == "coalesce" and key is not None and key in self.keyed:
+                # Replace the queued update for this tourist, keeping its place in line
+                self.keyed[key][1] = payload
+                self.dropped += 1
+                return True
+            self._pop()
+            self.dropped += 1
+
+        item = [key, payload]
+        self.queue.append(item)
+        if key is not None:
+            self.keyed[key] = item
+        self.ready.set()
+        return True
+
+    def _pop(self) -> list:
+        item = self.queue.popleft()
+        if item[0] is not None and self.keyed.get(item[0]) is item:
+            del self.keyed[item[0]]
+        return item
+
+    async def run(self):
+        while True:
+            while not self.queue and not self.priority:
+                self.ready.clear()
+                await self.ready.wait()
+            if self.priority:
+                entry = self.unacked.get(self.priority.popleft())
+                if entry is None:
+                    continue  # acknowledged while waiting for a retry
+                await self.websocket.send_text(entry["payload"])
+                entry["attempts"] += 1
+                now = time.monotonic()
+                if entry["sent_at"] is None:
+                    priority_metrics[entry["kind"]].record("dispatch", now - entry["created_at"])
+                entry["sent_at"] = now
+                continue
+            _, payload = self._pop()
+            await self.websocket.send_text(payload)
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.keyed.clear()
+        self.priority.clear()
+        self.unacked.clear()
+        if self.writer and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+# Dashboard region subscriptions
+SUBSCRIPTION_CELL_DEG = 1.0
+SUBSCRIPTION_MAX_CELLS = 4096
+
+def bbox_contains(bbox: Tuple[float, float, float, float], lat: float, lng: float) -> bool:
+    """Check a (min_lat, min_lng, max_lat, max_lng) box; min_lng > max_lng wraps the antimeridian"""
+    min_lat, min_lng, max_lat, max_lng = bbox
+    if not min_lat <= lat <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= lng <= max_lng
+    return lng >= min_lng or lng <= max_lng
+
+class SubscriptionIndex:
+    """Finds the dashboards interested in a point or zone; unsubscribed dashboards match everything"""
+
+    def __init__(self, cell_deg: float = SUBSCRIPTION_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.lng_cells = int(math.ceil(360 / cell_deg))
+        self.unfiltered: set = set()
+        self.subscriptions: Dict[Any, dict] = {}
+        self.cells: Dict[Tuple[int, int], set] = {}
+        # Boxes covering too many cells are checked directly
+        self.wide: set = set()
+        self.zones: Dict[str, set] = {}
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (int(math.floor((lat + 90) / self.cell_deg)),
+                int(math.floor((lng + 180) / self.cell_deg)) % self.lng_cells)
+
+    def _cells_for_box(self, bbox: Tuple[float, float, float, float]) -> List[Tuple[int, int]]:
+        min_lat, min_lng, max_lat, max_lng = bbox
+        first_lat, first_lng = self._cell(min_lat, min_lng)
+        last_lat, _ = self._cell(max_lat, max_lng)
+        # Count columns on the unwrapped axis so -180..180 spans every column, not one
+        end_lng = max_lng if min_lng <= max_lng else max_lng + 360
+        lng_span = min(int(math.floor((end_lng + 180) / self.cell_deg))
+                       - int(math.floor((min_lng + 180) / self.cell_deg)) + 1, self.lng_cells)
+        if (last_lat - first_lat + 1) * lng_span > SUBSCRIPTION_MAX_CELLS:
+            return []
+        return [(lat_cell, (first_lng + i) % self.lng_cells)
+                for lat_cell in range(first_lat, last_lat + 1) for i in range(lng_span)]
+
+    def add(self, connection):
+        self.unfiltered.add(connection)
+
+    def remove(self, connection):
+        self.unfiltered.discard(connection)
+        self._clear(connection)
+
+    def subscribe(self, connection, bbox: Optional[Tuple[float, float, float, float]], zone_ids: List[str]):
+        self._clear(connection)
+        self.unfiltered.discard(connection)
+        cells = self._cells_for_box(bbox) if bbox else []
+        self.subscriptions[connection] = {"bbox": bbox, "zone_ids": set(zone_ids), "cells": cells}
+
+        if bbox and not cells:
+            self.wide.add(connection)
+        for cell in cells:
+            self.cells.setdefault(cell, set()).add(connection)
+        for zone_id in zone_ids:
+            self.zones.setdefault(zone_id, set()).add(connection)
+
+    def unsubscribe(self, connection):
+        self._clear(connection)
+        self.unfiltered.add(connection)
+
+    def _clear(self, connection):
+        subscription = self.subscriptions.pop(connection, None)
+        if subscription is None:
+            return
+        self.wide.discard(connection)
+        for cell in subscription["cells"]:
+            bucket = self.cells[cell]
+            bucket.discard(connection)
+            if not bucket:
+                del self.cells[cell]
+        for zone_id in subscription["zone_ids"]:
+            bucket = self.zones[zone_id]
+            bucket.discard(connection)
+            if not bucket:
+                del self.zones[zone_id]
+
+    def matches(self, connection, lat: Optional[float], lng: Optional[float], zone_ids: List[str] = ()) -> bool:
+        """Whether match() for this point and zones would include the connection"""
+        if connection in self.unfiltered:
+            return True
+        subscription = self.subscriptions.get(connection)
+        if subscription is None:
+            return False
+        if subscription["bbox"] and lat is not None and lng is not None and bbox_contains(subscription["bbox"], lat, lng):
+            return True
+        return any(zone_id in subscription["zone_ids"] for zone_id in zone_ids)
+
+    def match(self, lat: Optional[float], lng: Optional[float], zone_ids: List[str] = ()) -> set:
+        targets = set(self.unfiltered)
+        if lat is not None and lng is not None:
+            for connection in self.cells.get(self._cell(lat, lng), ()):
+                if bbox_contains(self.subscriptions[connection]["bbox"], lat, lng):
+                    targets.add(connection)
+            for connection in self.wide:
+                if bbox_contains(self.subscriptions[connection]["bbox"], lat, lng):
+                    targets.add(connection)
+        for zone_id in zone_ids:
+            targets.update(self.zones.get(zone_id, ()))
+        return targets
+
+class ConnectionManager:
+    def __init__(self, max_queue: int = WS_SEND_QUEUE_SIZE, overflow_policy: str = WS_OVERFLOW_POLICY,
+                 batch_interval: float = WS_LOCATION_BATCH_INTERVAL):
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.batch_interval = batch_interval
+        self.active_connections: Dict[WebSocket, DashboardConnection] = {}
+        self.subscriptions = SubscriptionIndex()
+        # Latest (update, zone_ids) per tourist since the last location_batch frame
+        self.pending_locations: Dict[str, Tuple[dict, List[str]]] = {}
+        self._batcher: Optional[asyncio.Task] = None
+        self._retrier: Optional[asyncio.Task] = None
+
+    async def connect(self, websocket: WebSocket, stream_mode: str = "realtime") -> DashboardConnection:
+        await websocket.accept()
+        connection = DashboardConnection(websocket, self.max_queue, self.overflow_policy, stream_mode)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self.active_connections[websocket] = connection
+        self.subscriptions.add(connection)
+        logger.info(f"New police dashboard connected. Total connections: {len(self.active_connections)}")
+        return connection
+
+    async def _write(self, connection: DashboardConnection):
+        try:
+            await connection.run()
+        except asyncio.CancelledError:
+            pass
+        except WebSocketDisconnect:
+            self.disconnect(connection.websocket)
+        except Exception as e:
+            logger.error(f"Error sending to WebSocket: {e}")
+            self.disconnect(connection.websocket)
+
+    def disconnect(self, websocket: WebSocket):
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.close()
+        self.subscriptions.remove(connection)
+        logger.info(f"Police dashboard disconnected. Total connections: {len(self.active_connections)}")
+
+    def _drop_slow(self, connection: DashboardConnection):
+        logger.warning(f"Disconnecting slow police dashboard ({len(connection.queue)} messages queued)")
+        self.disconnect(connection.websocket)
+        asyncio.create_task(self._close_socket(connection.websocket))
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def send(self, websocket: WebSocket, message: Union[str, dict]):
+        """Queue a message for a single dashboard"""
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        payload = message if isinstance(message, str) else json.dumps(message)
+        if not connection.enqueue(payload):
+            self._drop_slow(connection)
+
+    def send_priority(self, message: dict, connections: Optional[List[DashboardConnection]] = None,
+                      created_at: Optional[float] = None) -> int:
+        """Put an alert on the priority lane of every dashboard (or the given ones); returns the count"""
+        created_at = time.monotonic() if created_at is None else created_at
+        message = self._log(message)
+        targets = list(self.active_connections.values()) if connections is None else list(connections)
+        for connection in targets:
+            connection.enqueue_priority(message, created_at)
+        priority_metrics[priority_alert_kind(message)].alerts += 1
+        return len(targets)
+
+    def ack(self, websocket: WebSocket, seq: int) -> bool:
+        connection = self.active_connections.get(websocket)
+        entry = connection.ack(seq) if connection is not None else None
+        if entry is None:
+            return False
+        priority_metrics[entry["kind"]].record("ack", time.monotonic() - entry["created_at"])
+        return True
+
+    def retry_unacknowledged(self):
+        now = time.monotonic()
+        for connection in list(self.active_connections.values()):
+            for seq in connection.due_for_retry(now, SOS_RETRY_INTERVAL):
+                entry = connection.unacked[seq]
+                if entry["attempts"] >= SOS_MAX_ATTEMPTS:
+                    del connection.unacked[seq]
+                    priority_metrics[entry["kind"]].failed += 1
+                    logger.warning(f"Priority alert {seq} not acknowledged after {SOS_MAX_ATTEMPTS} attempts")
+                    continue
+                connection.priority.append(seq)
+                connection.ready.set()
+                priority_metrics[entry["kind"]].retries += 1
+
+    def _log(self, message: dict, audience: Optional[dict] = None) -> dict:
+        """Record a dashboard event for replay unless it already carries an event_seq"""
+        return message if "event_seq" in message else event_log.record(message, audience)
+
+    def replay_payloads(self, connection: DashboardConnection, events: List[tuple],
+                        positions: List[Tuple[dict, List[str]]]) -> List[str]:
+        """Logged events and latest positions this dashboard's subscription would have received,
+        in its stream format"""
+        payloads = [
+            payload for _, payload, audience in events
+            if audience is None or self.subscriptions.matches(
+                connection, audience.get("lat"), audience.get("lng"), audience.get("zone_ids", []))
+        ]
+        updates = [update for update, zone_ids in positions
+                   if self.subscriptions.matches(connection, update["lat"], update["lng"], zone_ids)]
+        if connection.stream_mode == "realtime":
+            payloads.extend(json.dumps({"type": "location_update", **update}) for update in updates)
+        elif updates:
+            payloads.append(json.dumps({
+                "type": "location_batch",
+                "updates": updates,
+                "event_seq": event_log.last_seq,
+                "timestamp": datetime.utcnow().isoformat()
+            }))
+        return payloads
+
+    def broadcast(self, message: Union[str, dict], key: Optional[str] = None, stream_mode: Optional[str] = None):
+        """Queue a message for every dashboard (optionally one stream mode) without waiting on any socket"""
+        if isinstance(message, dict):
+            message = self._log(message)
+        if is_priority_alert(message):
+            self.send_priority(message)
+            return
+        # Serialize once; every queue holds the same string object
+        payload = message if isinstance(message, str) else json.dumps(message)
+        for connection in list(self.active_connections.values()):
+            if stream_mode is not None and connection.stream_mode != stream_mode:
+                continue
+            if not connection.enqueue(payload, key):
+                self._drop_slow(connection)
+
+    def subscribe(self, websocket: WebSocket, bbox: Optional[Tuple[float, float, float, float]], zone_ids: List[str]):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            self.subscriptions.subscribe(connection, bbox, zone_ids)
+
+    def unsubscribe(self, websocket: WebSocket):
+        connection = self.active_connections.get(websocket)
+        if connection is not None:
+            self.subscriptions.unsubscribe(connection)
+
+    def route(self, message: dict, lat: Optional[float], lng: Optional[float], zone_ids: List[str] = (),
+              key: Optional[str] = None, stream_mode: Optional[str] = None):
+        """Queue a message only for dashboards subscribed to its location or zones"""
+        message = self._log(message, {"lat": lat, "lng": lng, "zone_ids": list(zone_ids)})
+        if is_priority_alert(message):
+            self.send_priority(message, self.subscriptions.match(lat, lng, zone_ids))
+            return
+        payload = json.dumps(message)
+        for connection in self.subscriptions.match(lat, lng, zone_ids):
+            if stream_mode is not None and connection.stream_mode != stream_mode:
+                continue
+            if not connection.enqueue(payload, key):
+                self._drop_slow(connection)
+
+    def publish_location(self, update_message: dict, alerts: List[dict] = (), zone_ids: Optional[List[str]] = None):
+        """Send a fix's alerts and location_update in one pass over the subscribed dashboards;
+        batched dashboards get the alerts now and the location in the next batch frame"""
+        if zone_ids is None:
+            zone_ids = [v["zone"]["zone_id"] for v in update_message.get("geofence_violations", [])]
+        position = {
+            "tourist_id": update_message["tourist_id"],
+            "lat": update_message["lat"],
+            "lng": update_message["lng"],
+            "status": update_message["status"],
+            "timestamp": update_message["timestamp"]
+        }
+        # Only the latest position per tourist is kept for replay, not every fix
+        position["event_seq"] = event_log.record_position(position, zone_ids)
+        update_payload = json.dumps({**update_message, "event_seq": position["event_seq"]})
+        audience = {"lat": update_message["lat"], "lng": update_message["lng"], "zone_ids": list(zone_ids)}
+        alerts = [self._log(alert, audience) for alert in alerts]
+        priority_alerts = [alert for alert in alerts if is_priority_alert(alert)]
+        alert_payloads = [json.dumps(alert) for alert in alerts if not is_priority_alert(alert)]
+        connections = self.subscriptions.match(update_message["lat"], update_message["lng"], zone_ids)
+        for alert in priority_alerts:
+            self.send_priority(alert, connections)
+        for connection in connections:
+            ok = True
+            for payload in alert_payloads:
+                ok = ok and connection.enqueue(payload)
+            if ok and connection.stream_mode == "realtime":
+                ok = connection.enqueue(update_payload, update_message["tourist_id"])
+            if not ok:
+                self._drop_slow(connection)
+        self.pending_locations[update_message["tourist_id"]] = (position, zone_ids)
+
+    def flush_location_batch(self):
+        if not self.pending_locations:
+            return
+        pending, self.pending_locations = self.pending_locations, {}
+        batched = [c for c in self.active_connections.values() if c.stream_mode == "batched"]
+        if not batched:
+            return
+
+        # Positions are already in the event log; a frame only reports how far it brings the dashboard
+        batch = {
+            "type": "location_batch",
+            "updates": [update for update, _ in pending.values()],
+            "event_seq": event_log.last_seq,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+
+        unfiltered = [c for c in batched if c in self.subscriptions.unfiltered]
+        if unfiltered:
+            # One frame shared by every dashboard watching the whole map
+            payload = json.dumps(batch)
+            for connection in unfiltered:
+                if not connection.enqueue(payload):
+                    self._drop_slow(connection)
+
+        if len(unfiltered) == len(batched):
+            return
+        per_connection: Dict[DashboardConnection, List[dict]] = {}
+        for update, zone_ids in pending.values():
+            for connection in self.subscriptions.match(update["lat"], update["lng"], zone_ids):
+                if connection.stream_mode == "batched" and connection not in self.subscriptions.unfiltered:
+                    per_connection.setdefault(connection, []).append(update)
+        for connection, updates in per_connection.items():
+            payload = json.dumps({**batch, "updates": updates})
+            if not connection.enqueue(payload):
+                self._drop_slow(connection)
+
+    async def _run_batches(self):
+        while True:
+            await asyncio.sleep(self.batch_interval)
+            try:
+                self.flush_location_batch()
+            except Exception as e:
+                logger.error(f"Error sending location batch: {e}")
+
+    async def _run_retries(self):
+        while True:
+            await asyncio.sleep(SOS_RETRY_INTERVAL / 2)
+            try:
+                self.retry_unacknowledged()
+            except Exception as e:
+                logger.error(f"Error retrying priority alerts: {e}")
+
+    def start(self):
+        self._batcher = asyncio.create_task(self._run_batches())
+        self._retrier = asyncio.create_task(self._run_retries())
+
+    async def stop(self):
+        for task in (self._batcher, self._retrier):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._batcher = None
+        self._retrier = None
+        self.pending_locations.clear()
+
+manager = ConnectionManager()
+
+# Write-behind buffer for tourist_locations
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "1.0"))
+LOCATION_FLUSH_MAX_PENDING = int(os.getenv("LOCATION_FLUSH_MAX_PENDING", "500"))
+LOCATION_FLUSH_CHUNK = 1000
+
+class BackgroundFlusher(ABC):
+    """Runs flush() every flush_interval seconds, on demand when full, and once more at shutdown"""
+
+    name = "buffer"
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._size_flush: Optional[asyncio.Task] = None
+
+    @abstractmethod
+    async def flush(self) -> int:
+        """Write out everything pending; returns the number of items written"""
+
+    async def on_tick(self):
+        """Extra periodic work run after each timed flush"""
+
+    def _flush_soon(self):
+        if self._size_flush is None or self._size_flush.done():
+            self._size_flush = asyncio.create_task(self._flush_logged())
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing {self.name}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_logged()
+            try:
+                await self.on_tick()
+            except Exception as e:
+                logger.error(f"Error in {self.name} maintenance: {e}")
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self._flush_logged()
+
+class LocationWriteBuffer(BackgroundFlusher):
+    """Keeps the latest fix per tourist in memory and upserts them in bulk"""
+
+    name = "location buffer"
+
+    def __init__(self, flush_interval: float, max_pending: int):
+        super().__init__(flush_interval, max_pending)
+        self._pending: Dict[str, dict] = {}
+
+    def put(self, tourist_id: str, lat: float, lng: float, status: str, last_updated: datetime):
+        self._pending[tourist_id] = {
+            "tourist_id": tourist_id,
+            "lat": lat,
+            "lng": lng,
+            "status": status,
+            "last_updated": last_updated
+        }
+        if len(self._pending) >= self.max_pending:
+            self._flush_soon()
+
+    def set_status(self, tourist_id: str, status: str):
+        """Keep a pending fix from overwriting a status written directly to the database"""
+        if tourist_id in self._pending:
+            self._pending[tourist_id]["status"] = status
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, {}
+            rows = list(batch.values())
+            try:
+                for start in range(0, len(rows), LOCATION_FLUSH_CHUNK):
+                    insert = sqlalchemy.dialects.postgresql.insert(tourist_locations).values(
+                        rows[start:start + LOCATION_FLUSH_CHUNK]
+                    )
+                    upsert = insert.on_conflict_do_update(
+                        index_elements=['tourist_id'],
+                        set_=dict(
+                            lat=insert.excluded.lat,
+                            lng=insert.excluded.lng,
+                            status=insert.excluded.status,
+                            last_updated=insert.excluded.last_updated
+                        )
+                    )
+                    await database.execute(upsert)
+            except Exception:
+                # Retry on the next flush unless a newer fix has arrived meanwhile
+                for tourist_id, row in batch.items():
+                    self._pending.setdefault(tourist_id, row)
+                raise
+
+            return len(rows)
+
+location_buffer = LocationWriteBuffer(LOCATION_FLUSH_INTERVAL, LOCATION_FLUSH_MAX_PENDING)
+
+# Batched, append-only writes to location_history
+LOCATION_HISTORY_RETENTION_DAYS = int(os.getenv("LOCATION_HISTORY_RETENTION_DAYS", "30"))
+LOCATION_HISTORY_MAX_BUFFER = 200000
+RETENTION_CHECK_INTERVAL = timedelta(hours=1)
+
+def history_partition_name(day) -> str:
+    return f"location_history_{day.strftime('%Y%m%d')}"
+
+class LocationHistoryWriter(BackgroundFlusher):
+    """Queues every fix and appends them to day partitions of location_history in bulk"""
+
+    name = "location history"
+
+    def __init__(self, flush_interval: float, max_pending: int, retention_days: int):
+        super().__init__(flush_interval, max_pending)
+        self.retention_days = retention_days
+        self._pending: List[dict] = []
+        # Rows taken by a flush that has not committed yet
+        self._in_flight: List[dict] = []
+        self._partitions: set = set()
+        self._last_retention_check: Optional[datetime] = None
+
+    def append(self, tourist_id: str, lat: float, lng: float, status: str, recorded_at: datetime):
+        self._pending.append({
+            "tourist_id": tourist_id,
+            "lat": lat,
+            "lng": lng,
+            "status": status,
+            "recorded_at": recorded_at
+        })
+        if len(self._pending) >= self.max_pending:
+            self._flush_soon()
+
+    def pending_for(self, tourist_id: str, start: datetime, end: datetime) -> List[dict]:
+        """Uncommitted fixes in time order; some may also reach the table while a reader uses them"""
+        rows = [row for row in self._in_flight + self._pending
+                if row["tourist_id"] == tourist_id and start <= row["recorded_at"] <= end]
+        return sorted(rows, key=lambda row: row["recorded_at"])
+
+    async def ensure_partition(self, day):
+        name = history_partition_name(day)
+        if name in self._partitions:
+            return
+        await database.execute(sqlalchemy.text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF location_history "
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + timedelta(days=1)).isoformat()}')"
+        ))
+        self._partitions.add(name)
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            rows, self._pending = self._pending, []
+            self._in_flight = rows
+            try:
+                for day in sorted({row["recorded_at"].date() for row in rows}):
+                    await self.ensure_partition(day)
+                # One transaction, so a retry after a failed chunk cannot insert rows twice
+                async with database.transaction():
+                    for start in range(0, len(rows), LOCATION_FLUSH_CHUNK):
+                        await database.execute(location_history.insert().values(rows[start:start + LOCATION_FLUSH_CHUNK]))
+            except Exception:
+                # Keep the rows for the next attempt, bounded so an outage cannot exhaust memory
+                self._pending = (rows + self._pending)[-LOCATION_HISTORY_MAX_BUFFER:]
+                raise
+            finally:
+                self._in_flight = []
+
+            return len(rows)
+
+    async def enforce_retention(self) -> List[str]:
+        """Drop whole day partitions older than the retention period"""
+        query = sqlalchemy.text(
+            "SELECT child.relname AS name FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = 'location_history'"
+        )
+        cutoff = history_partition_name(datetime.utcnow().date() - timedelta(days=self.retention_days))
+        dropped = []
+        for row in await database.fetch_all(query):
+            name = row["name"]
+            # Names sort by date because the suffix is YYYYMMDD
+            if re.match(r"^location_history_\d{8}$", name) and name < cutoff:
+                await database.execute(sqlalchemy.text(f"DROP TABLE IF EXISTS {name}"))
+                self._partitions.discard(name)
+                dropped.append(name)
+
+        self._last_retention_check = datetime.utcnow()
+        if dropped:
+            logger.info(f"Dropped expired location history partitions: {', '.join(dropped)}")
+        return dropped
+
+    async def on_tick(self):
+        if (self._last_retention_check is None
+                or datetime.utcnow() - self._last_retention_check >= RETENTION_CHECK_INTERVAL):
+            await self.enforce_retention()
+
+history_writer = LocationHistoryWriter(LOCATION_FLUSH_INTERVAL, LOCATION_FLUSH_CHUNK, LOCATION_HISTORY_RETENTION_DAYS)
+
+# Replayable dashboard event log
+EVENT_LOG_PATH = os.getenv("EVENT_LOG_PATH", "event_log.ndjson")
+EVENT_LOG_SIZE = int(os.getenv("EVENT_LOG_SIZE", "10000"))
+EVENT_LOG_MEMORY_BYTES = int(os.getenv("EVENT_LOG_MEMORY_BYTES", str(16 * 1024 * 1024)))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "1.0"))
+EVENT_LOG_FLUSH_BATCH = int(os.getenv("EVENT_LOG_FLUSH_BATCH", "1000"))
+EVENT_LOG_MAX_BYTES = int(os.getenv("EVENT_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+
+class EventLog(BackgroundFlusher):
+    """Sequence-numbered ring of recent dashboard events, appended to a local log file
+    so reconnecting dashboards can catch up with only the events they missed.
+
+    Each event keeps its audience so a replay reaches the same dashboards the live send did:
+    None for every dashboard, or {"lat", "lng", "zone_ids"} for routed messages. Positions are
+    not logged as events; the latest one per tourist is kept with the event_seq it changed at."""
+
+    name = "event log"
+
+    def __init__(self, path: str, size: int, flush_interval: float, max_pending: int, max_bytes: int,
+                 memory_bytes: int = EVENT_LOG_MEMORY_BYTES):
+        super().__init__(flush_interval, max_pending)
+        self.path = path
+        self.size = size
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        # (event_seq, serialized message, audience) for the newest events, oldest first
+        self.events: deque = deque()
+        self.events_bytes = 0
+        # Newest event_seq no longer held; a gap reaching back to it cannot be replayed
+        self.evicted_seq = 0
+        # tourist_id -> (event_seq, update, zone_ids) for each tourist's latest position
+        self.positions: Dict[str, Tuple[int, dict, List[str]]] = {}
+        # Positions from before this seq were lost in a restart
+        self.positions_from = 0
+        self.last_seq = 0
+        self._pending: List[str] = []
+        self._compacted_size = 0
+
+    @staticmethod
+    def _line(payload: str, audience: Optional[dict]) -> str:
+        return f'{{"audience": {json.dumps(audience)}, "event": {payload}}}\n'
+
+    def _append(self, event_seq: int, payload: str, audience: Optional[dict]):
+        self.events.append((event_seq, payload, audience))
+        self.events_bytes += len(payload)
+        # Bounded by bytes as well as count, since events vary widely in size
+        while len(self.events) > self.size or self.events_bytes > self.memory_bytes:
+            self._evict()
+
+    def _evict(self):
+        event_seq, payload, _ = self.events.popleft()
+        self.events_bytes -= len(payload)
+        self.evicted_seq = event_seq
+
+    def record(self, message: dict, audience: Optional[dict] = None) -> dict:
+        """Stamp a message with the next event_seq and keep it for replay"""
+        self.last_seq += 1
+        message = {**message, "event_seq": self.last_seq}
+        payload = json.dumps(message)
+        self._append(self.last_seq, payload, audience)
+        self._pending.append(self._line(payload, audience))
+        if len(self._pending) >= self.max_pending:
+            self._flush_soon()
+        return message
+
+    def record_position(self, update: dict, zone_ids: List[str]) -> int:
+        """Note a tourist's new position under the next event_seq, replacing the previous one"""
+        self.last_seq += 1
+        self.positions[update["tourist_id"]] = (self.last_seq, update, list(zone_ids))
+        return self.last_seq
+
+    def since(self, seq: int) -> Optional[Tuple[List[tuple], List[Tuple[dict, List[str]]]]]:
+        """(events, latest positions) after seq, or None when the gap is no longer held in memory"""
+        if seq > self.last_seq or seq < max(self.evicted_seq, self.positions_from):
+            return None
+        events = [event for event in self.events if event[0] > seq]
+        positions = [(update, zone_ids) for event_seq, update, zone_ids in self.positions.values() if event_seq > seq]
+        return events, positions
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            lines, self._pending = self._pending, []
+            try:
+                async with aiofiles.open(self.path, "a") as out:
+                    await out.write("".join(lines))
+            except Exception:
+                self._pending = (lines + self._pending)[-self.size:]
+                raise
+
+            size = os.path.getsize(self.path)
+            # Compaction leaves the file at half the limit, so it runs again only after real growth
+            if size > self.max_bytes and size - self._compacted_size > self.max_bytes // 2:
+                await self.compact()
+            return len(lines)
+
+    async def compact(self):
+        """Rewrite the log with the newest events that fit in half of max_bytes, dropping older ones
+        from the ring too so the file is not over the limit again right away"""
+        kept, total = [], 0
+        for event_seq, payload, audience in reversed(self.events):
+            line = self._line(payload, audience)
+            if total + len(line) > self.max_bytes // 2:
+                break
+            kept.append(line)
+            total += len(line)
+        while len(self.events) > len(kept):
+            self._evict()
+        kept.reverse()
+
+        await asyncio.get_running_loop().run_in_executor(None, self._write_file, kept)
+        self._compacted_size = total
+
+    def _write_file(self, lines: List[str]):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as out:
+            out.writelines(lines)
+        os.replace(tmp_path, self.path)
+
+    async def load(self):
+        """Restore the ring and sequence counter from the log file after a restart"""
+        if not os.path.exists(self.path):
+            return
+        async with aiofiles.open(self.path, "r") as log_file:
+            async for line in log_file:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    message = entry["event"]
+                    event_seq = int(message["event_seq"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # Torn write from a crash
+                if event_seq > self.last_seq:
+                    self._append(event_seq, json.dumps(message), entry.get("audience"))
+                    self.last_seq = event_seq
+        # Positions were not persisted; older gaps fall back to a snapshot
+        self.positions_from = self.last_seq
+        logger.info(f"Restored {len(self.events)} dashboard events (last event_seq {self.last_seq})")
+
+event_log = EventLog(EVENT_LOG_PATH, EVENT_LOG_SIZE, EVENT_LOG_FLUSH_INTERVAL, EVENT_LOG_FLUSH_BATCH, EVENT_LOG_MAX_BYTES)
+
+# Multi-resolution density grid for heatmap tiles
+HEATMAP_MAX_ZOOM = int(os.getenv("HEATMAP_MAX_ZOOM", "16"))
+HEATMAP_TILE_BITS = 4  # each tile is split into 2**4 x 2**4 cells
+MERCATOR_MAX_LAT = 85.05112878
+
+def lat_lng_to_tile_fraction(lat: float, lng: float, zoom: int) -> Tuple[float, float]:
+    """Web Mercator (slippy map) tile coordinates at zoom, as floats"""
+    lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+    n = 2 ** zoom
+    x = (lng + 180.0) / 360.0 * n
+    lat_rad = math.radians(lat)
+    y = (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1e-9), min(max(y, 0.0), n - 1e-9)
+
+def tile_fraction_to_lat_lng(x: float, y: float, zoom: int) -> Tuple[float, float]:
+    n = 2 ** zoom
+    lng = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lat, lng
+
+class HeatmapGrid:
+    """Tourist counts per status for every tile cell at zooms 0..max_zoom, updated as tourists move"""
+
+    def __init__(self, max_zoom: int, tile_bits: int):
+        self.max_zoom = max_zoom
+        self.tile_bits = tile_bits
+        # levels[z][(tile_x, tile_y)][(cell_i, cell_j)] -> Counter of statuses
+        self.levels: List[Dict[Tuple[int, int], Dict[Tuple[int, int], Counter]]] = [{} for _ in range(max_zoom + 1)]
+
+    def reset(self):
+        for level in self.levels:
+            level.clear()
+
+    def apply(self, entry: dict, delta: int):
+        """Add or remove one tourist's contribution; called by TouristLiveState around each change"""
+        if not entry["located"] or entry["lat"] is None or entry["lng"] is None:
+            return
+        status = entry["status"] or "unknown"
+        cells_per_tile = 1 << self.tile_bits
+
+        # Cell coordinates at the finest level; coarser levels are found by shifting
+        finest = self.max_zoom + self.tile_bits
+        fx, fy = lat_lng_to_tile_fraction(entry["lat"], entry["lng"], finest)
+        cell_x, cell_y = int(fx), int(fy)
+
+        for zoom in range(self.max_zoom, -1, -1):
+            shift = self.max_zoom - zoom
+            cx, cy = cell_x >> shift, cell_y >> shift
+            tile_key = (cx >> self.tile_bits, cy >> self.tile_bits)
+            cell_key = (cx & (cells_per_tile - 1), cy & (cells_per_tile - 1))
+
+            tile = self.levels[zoom].setdefault(tile_key, {})
+            counts = tile.setdefault(cell_key, Counter())
+            counts[status] += delta
+            if counts[status] <= 0:
+                del counts[status]
+                if not counts:
+                    del tile[cell_key]
+                    if not tile:
+                        del self.levels[zoom][tile_key]
+
+    def tile(self, zoom: int, x: int, y: int) -> dict:
+        cells_per_tile = 1 << self.tile_bits
+        cell_zoom = zoom + self.tile_bits
+        cells = []
+        total = 0
+        for (i, j), counts in sorted(self.levels[zoom].get((x, y), {}).items()):
+            count = sum(counts.values())
+            total += count
+            lat, lng = tile_fraction_to_lat_lng(x * cells_per_tile + i + 0.5, y * cells_per_tile + j + 0.5, cell_zoom)
+            cells.append({"i": i, "j": j, "lat": lat, "lng": lng, "count": count, "statuses": dict(counts)})
+
+        north, west = tile_fraction_to_lat_lng(x, y, zoom)
+        south, east = tile_fraction_to_lat_lng(x + 1, y + 1, zoom)
+        return {
+            "z": zoom,
+            "x": x,
+            "y": y,
+            "grid_size": cells_per_tile,
+            "bounds": {"north": north, "south": south, "west": west, "east": east},
+            "total": total,
+            "cells": cells
+        }
+
+heatmap_grid = HeatmapGrid(HEATMAP_MAX_ZOOM, HEATMAP_TILE_BITS)
+
+# In-process live state for dashboards
+ACTIVITY_WINDOWS = {"active": timedelta(hours=1), "recently_active": timedelta(hours=24)}
+
+class TouristLiveState:
+    """Current position and status of every tourist, with counters kept up to date on each change"""
+
+    def __init__(self):
+        self.entries: Dict[str, dict] = {}
+        # Statuses of tourist_locations rows (alert statistics)
+        self.status_counts: Counter = Counter()
+        # Statuses of registered tourists, "unknown" without a location (status overview)
+        self.registered_status_counts: Counter = Counter()
+        # tourist_id -> last_updated, oldest first; expired entries are evicted lazily
+        self.windows: Dict[str, OrderedDict] = {name: OrderedDict() for name in ACTIVITY_WINDOWS}
+        # Derived views with apply(entry, delta) and reset(), kept in step with every change
+        self.observers: List[Any] = [heatmap_grid]
+
+    def _entry(self, tourist_id: str) -> dict:
+        entry = self.entries.get(tourist_id)
+        if entry is None:
+            entry = self.entries[tourist_id] = {
+                "tourist_id": tourist_id,
+                "full_name": None,
+                "lat": None,
+                "lng": None,
+                "status": None,
+                "last_updated": None,
+                "registered": False,
+                "located": False
+            }
+        return entry
+
+    def _count(self, entry: dict, delta: int):
+        if entry["located"]:
+            self.status_counts[entry["status"]] += delta
+        if entry["registered"]:
+            self.registered_status_counts[entry["status"] or "unknown"] += delta
+        for observer in self.observers:
+            observer.apply(entry, delta)
+
+    def _touch(self, tourist_id: str, last_updated: Optional[datetime]):
+        if last_updated is None:
+            return
+        for window in self.windows.values():
+            window.pop(tourist_id, None)
+            window[tourist_id] = last_updated
+
+    def register(self, tourist_id: str, full_name: str):
+        entry = self._entry(tourist_id)
+        self._count(entry, -1)
+        entry["registered"] = True
+        entry["full_name"] = full_name
+        self._count(entry, 1)
+
+    def update_location(self, tourist_id: str, lat: float, lng: float, status: str, last_updated: datetime):
+        entry = self._entry(tourist_id)
+        self._count(entry, -1)
+        entry.update(lat=lat, lng=lng, status=status, last_updated=last_updated, located=True)
+        self._count(entry, 1)
+        self._touch(tourist_id, last_updated)
+
+    def set_status(self, tourist_id: str, status: str, last_updated: Optional[datetime] = None):
+        """Mirror a status UPDATE on tourist_locations; tourists without a location row are unaffected"""
+        entry = self.entries.get(tourist_id)
+        if entry is None or not entry["located"]:
+            return
+        self._count(entry, -1)
+        entry["status"] = status
+        if last_updated is not None:
+            entry["last_updated"] = last_updated
+        self._count(entry, 1)
+        self._touch(tourist_id, last_updated)
+
+    def active_count(self, window_name: str, now: datetime) -> int:
+        window = self.windows[window_name]
+        cutoff = now - ACTIVITY_WINDOWS[window_name]
+        while window:
+            tourist_id, last_updated = next(iter(window.items()))
+            if last_updated >= cutoff:
+                break
+            window.popitem(last=False)
+        return len(window)
+
+    async def warm(self):
+        """Load registrations and last known locations from the database"""
+        self.entries.clear()
+        self.status_counts.clear()
+        self.registered_status_counts.clear()
+        for window in self.windows.values():
+            window.clear()
+        for observer in self.observers:
+            observer.reset()
+
+        for row in await database.fetch_all(sqlalchemy.select(tourists.c.tourist_id, tourists.c.full_name)):
+            self.register(row["tourist_id"], row["full_name"])
+
+        query = tourist_locations.select().order_by(tourist_locations.c.last_updated.asc().nullsfirst())
+        for row in await database.fetch_all(query):
+            self.update_location(row["tourist_id"], row["lat"], row["lng"], row["status"], row["last_updated"])
+
+        logger.info(f"Live state warmed with {len(self.entries)} tourists")
+
+live_state = TouristLiveState()
+
+class RegistrationAggregates:
+    """Registration counts per nationality, destination, accommodation, month and day"""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        """Clear every counter"""
+        self.total = 0
+        self.by_nationality: Counter = Counter()
+        self.by_destination: Counter = Counter()
+        self.by_accommodation: Counter = Counter()
+        # Month number 1-12 across all years, as the dashboard chart shows it
+        self.by_month: Counter = Counter()
+        self.by_day: Counter = Counter()
+
+    def add(self, nationality: Optional[str], destination: Optional[str], accommodation: Optional[str],
+            created_on: Optional[date], count: int = 1):
+        self.total += count
+        self.by_nationality[nationality] += count
+        self.by_destination[destination] += count
+        self.by_accommodation[accommodation] += count
+        if created_on is not None:
+            self.by_month[created_on.month] += count
+            self.by_day[created_on] += count
+
+    def daily(self, days: int, now: datetime) -> List[Tuple[date, int]]:
+        start = (now - timedelta(days=days)).date()
+        today = now.date()
+        result = []
+        day = start
+        while day <= today:
+            if self.by_day[day]:
+                result.append((day, self.by_day[day]))
+            day += timedelta(days=1)
+        return result
+
+    async def rebuild(self):
+        """Recount everything from the tourists table with a single GROUP BY"""
+        created_on = func.date(tourists.c.created_at).label('created_on')
+        query = sqlalchemy.select(
+            tourists.c.nationality,
+            tourists.c.destination,
+            tourists.c.accommodation,
+            created_on,
+            func.count().label('count')
+        ).group_by(tourists.c.nationality, tourists.c.destination, tourists.c.accommodation, created_on)
+        rows = await database.fetch_all(query)
+
+        # Reset only once the rows are in, so readers never see half-empty counters
+        self._reset()
+        for row in rows:
+            self.add(row["nationality"], row["destination"], row["accommodation"], row["created_on"], row["count"])
+
+        logger.info(f"Registration aggregates rebuilt for {self.total} tourists")
+
+registration_stats = RegistrationAggregates()
+
+def record_registrations(records: List[dict]):
+    """Update in-memory state after tourists rows have been inserted"""
+    for record in records:
+        live_state.register(record["tourist_id"], record["full_name"])
+        created_at = record.get("created_at")
+        registration_stats.add(
+            record.get("nationality"),
+            record.get("destination"),
+            record.get("accommodation"),
+            created_at.date() if created_at else None
+        )
+
+# Short-lived cache for computed responses
+ANALYTICS_SUMMARY_TTL = float(os.getenv("ANALYTICS_SUMMARY_TTL", "5"))
+
+class TTLCache:
+    """Caches one computed value for ttl seconds; concurrent misses share a single computation"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0.0
+        self._inflight: Optional[asyncio.Future] = None
+
+    async def get(self, compute):
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._expires_at:
+            return self._value
+
+        if self._inflight is None:
+            self._inflight = loop.create_future()
+            try:
+                value = await compute()
+            except asyncio.CancelledError:
+                self._inflight.cancel()
+                raise
+            except Exception as e:
+                self._inflight.set_exception(e)
+                # Retrieved here so a failure nobody else waited on is not logged as unhandled
+                self._inflight.exception()
+                raise
+            else:
+                self._value = value
+                self._expires_at = loop.time() + self.ttl
+                self._inflight.set_result(value)
+                return value
+            finally:
+                self._inflight = None
+
+        return await asyncio.shield(self._inflight)
+
+analytics_summary_cache = TTLCache(ANALYTICS_SUMMARY_TTL)
+
+# Hardcoded admin credentials
+ADMIN_CREDENTIALS = {
+    "admin": {
+        "password_hash": hash_password("1234"),
+        "full_name": "System Administrator",
+        "department": "Tourism Ministry"
+    }
+}
+
+def require_admin(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    """Dependency for admin-only endpoints; returns the authority id behind the bearer token"""
+    authority_id = token_authority(credentials.credentials)
+    if authority_id not in ADMIN_CREDENTIALS:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return authority_id
+
+# API ENDPOINTS
+
+@app.get("/")
+async def root():
+    return {"message": "Tourist Safety System API"}
+
+@app.post("/login", response_model=AdminLoginResponse)
+async def login_admin(credentials: AdminLogin):
+    try:
+        if credentials.authorityId not in ADMIN_CREDENTIALS:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        
+        admin_user = ADMIN_CREDENTIALS[credentials.authorityId]
+        
+        if hash_password(credentials.password) != admin_user["password_hash"]:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        
+        access_token = create_access_token(credentials.authorityId)
+        
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "redirect": "/dashboard",
+            "message": "Login successful"
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
+
+@app.post("/authenticate-qr/")
+async def authenticate_qr(auth_data: QRAuthRequest):
+    try:
+        query = tourists.select().where(tourists.c.tourist_id == auth_data.tourist_id)
+        tourist = await database.fetch_one(query)
+        
+        if not tourist:
+            raise HTTPException(status_code=404, detail="Tourist not found")
+        
+        if tourist.blockchain_hash != auth_data.auth_hash:
+            raise HTTPException(status_code=401, detail="Invalid authentication hash")
+        
+        try:
+            qr_timestamp = datetime.fromisoformat(auth_data.timestamp.replace('Z', ''))
+            if datetime.utcnow() - qr_timestamp > timedelta(days=30):
+                raise HTTPException(status_code=401, detail="QR code expired")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid timestamp format")
+        
+        return {
+            "tourist_id": tourist.tourist_id,
+            "full_name": tourist.full_name,
+            "nationality": tourist.nationality,
+            "destination": tourist.destination,
+            "checkin_date": tourist.checkin_date,
+            "checkout_date": tourist.checkout_date,
+            "accommodation": tourist.accommodation,
+            "itinerary": tourist.itinerary,
+            "emergency_contact_name": tourist.emergency_contact_name,
+            "emergency_contact_phone": tourist.emergency_contact_phone,
+            "valid_until": tourist.valid_until.isoformat() if tourist.valid_until else None,
+            "qr_code_data": tourist.qr_code_data,
+            "status": "authenticated",
+            "created_at": tourist.created_at.isoformat() if tourist.created_at else None
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Authentication failed: {str(e)}")
+
+@app.post("/register-tourist/", response_model=TouristResponse)
+async def register_tourist(
+    background_tasks: BackgroundTasks,
+    fullName: str = Form(...),
+    nationality: str = Form(...),
+    id_type: str = Form(...),
+    id_number: str = Form(...),
+    phone: str = Form(...),
+    emergency_contact_name: str = Form(...),
+    emergency_contact_phone: str = Form(...),
+    destination: str = Form(...),
+    checkin_date: str = Form(...),
+    checkout_date: str = Form(...),
+    accommodation: str = Form(...),
+    documents: List[UploadFile] = File([])
+):
+    try:
+        record = new_tourist_record(TouristCreate(
+            fullName=fullName,
+            nationality=nationality,
+            id_type=id_type,
+            id_number=id_number,
+            phone=phone,
             emergency_contact_name=emergency_contact_name,
             emergency_contact_phone=emergency_contact_phone,
             destination=destination,
             checkin_date=checkin_date,
             checkout_date=checkout_date,
-            accommodation=accommodation,
-            itinerary=itinerary_data,
-            documents=documents_data,
-            qr_code_data=qr_code_image,
-            valid_until=valid_until
-        )
+            accommodation=accommodation
+        ))
+        tourist_id = record["tourist_id"]
+        qr_data = record["qr_code_data"]
+
+        # Stream uploads to the blob store; the row keeps only metadata
+        for position, document in enumerate(documents):
+            digest, size = await blob_store.save_upload(document)
+            record["documents"].append(document_metadata(
+                tourist_id, position, document.filename, document.content_type, digest, size
+            ))
+
+        await database.execute(tourists.insert().values(**record))
+        record_registrations([record])
+        background_tasks.add_task(qr_renderer.prewarm, tourist_id, qr_data)
+
+        return {
+            "tourist_id": tourist_id,
+            "qr_code_data": qr_data,
+            "qr_code_url": f"/tourist/{tourist_id}/qr.png",
+            "message": "Tourist registered successfully"
+        }
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
+
+# Bulk registration import
+BULK_IMPORT_CHUNK = 500
+
+BULK_IMPORT_READ_SIZE = 64 * 1024
+
+async def iter_upload_lines(upload: UploadFile):
+    """Yield decoded lines (with their endings) from an upload without blocking on file reads"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffered = ""
+    while True:
+        data = await upload.read(BULK_IMPORT_READ_SIZE)
+        buffered += decoder.decode(data, final=not data)
+        *lines, buffered = buffered.split("\n")
+        for line in lines:
+            yield line + "\n"
+        if not data:
+            break
+    if buffered:
+        yield buffered
+
+async def iter_import_rows(upload: UploadFile, import_format: str):
+    """Yield (line number, raw row dict or ValueError) from a CSV or NDJSON upload"""
+    line_number = 0
+    if import_format == "csv":
+        header = None
+        record, record_line = "", 0
+        async for line in iter_upload_lines(upload):
+            line_number += 1
+            if not record:
+                record_line = line_number
+            record += line
+            # An odd number of quotes means a quoted field continues on the next line
+            if record.count('"') % 2:
+                continue
+            values = next(csv.reader([record]), [])
+            record = ""
+            if not values:
+                continue
+            if header is None:
+                header = values
+                continue
+            if len(values) > len(header):
+                yield record_line, ValueError(f"Row has {len(values) - len(header)} more fields than the header")
+                continue
+            row = dict(zip(header, values + [None] * (len(header) - len(values))))
+            # Optional itinerary column holds a JSON list of days
+            try:
+                row["itinerary"] = json.loads(row["itinerary"]) if row.get("itinerary") else None
+            except ValueError as e:
+                yield record_line, ValueError(f"Invalid itinerary JSON: {str(e)}")
+                continue
+            yield record_line, row
+        if record:
+            raise csv.Error(f"unexpected end of file inside a quoted field starting on line {record_line}")
+    else:
+        async for line in iter_upload_lines(upload):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(str(e))
+
+def detect_import_format(upload: UploadFile, requested: Optional[str]) -> str:
+    if requested:
+        return requested.lower()
+    name = (upload.filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (upload.content_type or ""):
+        return "ndjson"
+    return "csv"
+
+async def insert_tourist_chunk(records: List[dict]) -> Dict[str, str]:
+    """Insert rows with one multi-row INSERT; on failure retry one by one. Returns errors by tourist_id"""
+    try:
+        await database.execute(tourists.insert().values(records))
+        return {}
+    except Exception:
+        errors = {}
+        for record in records:
+            try:
+                await database.execute(tourists.insert().values(**record))
+            except Exception as e:
+                errors[record["tourist_id"]] = str(e)
+        return errors
+
+@app.post("/tourists/bulk-import")
+async def bulk_import_tourists(file: UploadFile = File(...), format: Optional[str] = Form(None)):
+    """Import a CSV or NDJSON manifest of TouristCreate rows; streams per-row results as NDJSON"""
+    import_format = detect_import_format(file, format)
+    if import_format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+
+    created_codes: List[Tuple[str, str]] = []
+
+    async def run_import():
+        processed = created = failed = 0
+        rows = iter_import_rows(file, import_format)
+        finished = False
+
+        while not finished:
+            # Validate and prepare one chunk
+            lines = []
+            chunk: List[Tuple[int, dict]] = []
+            while len(chunk) < BULK_IMPORT_CHUNK:
+                try:
+                    row_number, raw = await rows.__anext__()
+                except StopAsyncIteration:
+                    finished = True
+                    break
+                except (UnicodeDecodeError, csv.Error) as e:
+                    # The rest of the file cannot be read reliably
+                    lines.append({"type": "row", "row": None, "status": "error", "errors": [f"Unreadable input: {str(e)}"]})
+                    finished = True
+                    break
+
+                if isinstance(raw, ValueError):
+                    lines.append({"type": "row", "row": row_number, "status": "error", "errors": [f"Unreadable row: {str(raw)}"]})
+                    continue
+
+                try:
+                    record = new_tourist_record(TouristCreate(**raw))
+                except ValidationError as e:
+                    lines.append({"type": "row", "row": row_number, "status": "error",
+                                  "errors": [f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]})
+                    continue
+                except TypeError:
+                    lines.append({"type": "row", "row": row_number, "status": "error", "errors": ["Row must be an object"]})
+                    continue
+
+                lines.append({"type": "row", "row": row_number, "status": "created", "tourist_id": record["tourist_id"]})
+                chunk.append((len(lines) - 1, record))
+
+            if chunk:
+                records = [record for _, record in chunk]
+                errors = await insert_tourist_chunk(records)
+                inserted = [record for record in records if record["tourist_id"] not in errors]
+                record_registrations(inserted)
+                created_codes.extend((record["tourist_id"], record["qr_code_data"]) for record in inserted)
+
+                for line_index, record in chunk:
+                    if record["tourist_id"] in errors:
+                        lines[line_index] = {"type": "row", "row": lines[line_index]["row"], "status": "error",
+                                             "errors": [errors[record["tourist_id"]]]}
+
+            processed += len(lines)
+            created += sum(1 for line in lines if line["status"] == "created")
+            failed += sum(1 for line in lines if line["status"] == "error")
+
+            if lines:
+                yield "".join(json.dumps(line) + "\n" for line in lines)
+                yield json.dumps({"type": "progress", "processed": processed, "created": created, "failed": failed}) + "\n"
+
+        yield json.dumps({
+            "type": "summary",
+            "processed": processed,
+            "created": created,
+            "failed": failed,
+            "message": "Bulk import finished"
+        }) + "\n"
+
+    async def prewarm_created():
+        await qr_renderer.prewarm_many(created_codes)
+
+    return StreamingResponse(
+        run_import(),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(prewarm_created)
+    )
+
+@app.get("/tourist/{tourist_id}")
+async def get_tourist(tourist_id: str):
+    query = tourists.select().where(tourists.c.tourist_id == tourist_id)
+    tourist = await database.fetch_one(query)
+
+    if not tourist:
+        raise HTTPException(status_code=404, detail="Tourist not found")
+
+    return dict(tourist)
+
+@app.get("/tourist/{tourist_id}/qr.png")
+async def get_tourist_qr_code(tourist_id: str, request: Request):
+    """Serve the tourist's QR code as PNG, rendering it on first use"""
+    try:
+        cached = qr_renderer.get_cached(tourist_id)
+        if cached is None:
+            query = sqlalchemy.select(tourists.c.qr_code_data).where(tourists.c.tourist_id == tourist_id)
+            qr_data = await database.fetch_val(query)
+            if not qr_data:
+                raise HTTPException(status_code=404, detail="Tourist not found")
+            cached = await qr_renderer.render(tourist_id, qr_data)
+
+        png, etag = cached
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        return Response(content=png, media_type="image/png", headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rendering QR code: {str(e)}")
+
+def parse_track_time(value: Optional[str], default: datetime) -> datetime:
+    if not value:
+        return default
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    return parsed
+
+@app.get("/tourist/{tourist_id}/track")
+async def get_tourist_track(
+    tourist_id: str,
+    from_: Optional[str] = Query(None, alias="from"),
+    to: Optional[str] = None,
+    interval_seconds: Optional[int] = Query(None, ge=1)
+):
+    """Stream a tourist's recorded positions in time order as NDJSON, optionally one point per interval"""
+    end = parse_track_time(to, datetime.utcnow())
+    start = parse_track_time(from_, end - timedelta(hours=24))
+    if start > end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    query = sqlalchemy.select(
+        location_history.c.lat,
+        location_history.c.lng,
+        location_history.c.status,
+        location_history.c.recorded_at
+    ).where(
+        location_history.c.tourist_id == tourist_id,
+        location_history.c.recorded_at >= start,
+        location_history.c.recorded_at <= end
+    ).order_by(location_history.c.recorded_at)
+
+    # Fixes not committed yet; the flusher may insert some of them before the query reads
+    # the table, so table rows already in this snapshot are skipped
+    unflushed = history_writer.pending_for(tourist_id, start, end)
+    unflushed_times = {row["recorded_at"] for row in unflushed}
+
+    async def stream_points():
+        last_bucket = None
+
+        async def rows():
+            position = 0
+            async for row in database.iterate(query):
+                if row["recorded_at"] in unflushed_times:
+                    continue
+                while position < len(unflushed) and unflushed[position]["recorded_at"] < row["recorded_at"]:
+                    yield unflushed[position]
+                    position += 1
+                yield row
+            for row in unflushed[position:]:
+                yield row
+
+        async for row in rows():
+            if interval_seconds:
+                bucket = int((row["recorded_at"] - start).total_seconds()) // interval_seconds
+                if bucket == last_bucket:
+                    continue
+                last_bucket = bucket
+            yield json.dumps({
+                "lat": row["lat"],
+                "lng": row["lng"],
+                "status": row["status"],
+                "recorded_at": row["recorded_at"].isoformat()
+            }) + "\n"
+
+    return StreamingResponse(stream_points(), media_type="application/x-ndjson")
+
+@app.get("/tourist/{tourist_id}/documents/{position}")
+async def download_tourist_document(tourist_id: str, position: int, request: Request):
+    """Stream a stored document, honouring a single Range request"""
+    query = sqlalchemy.select(tourists.c.documents).where(tourists.c.tourist_id == tourist_id)
+    documents_data = await database.fetch_val(query)
+
+    if documents_data is None:
+        raise HTTPException(status_code=404, detail="Tourist not found")
+    if not 0 <= position < len(documents_data):
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    document = documents_data[position]
+    digest = document.get("sha256", "")
+    if not blob_store.exists(digest):
+        raise HTTPException(status_code=404, detail="Document content not found")
+
+    size = os.path.getsize(blob_store.path_for(digest))
+    byte_range = parse_range_header(request.headers.get("range"), size)
+    start, end = byte_range if byte_range else (0, size - 1)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{digest}"',
+        "Content-Length": str(end - start + 1),
+        "Content-Disposition": content_disposition("inline", document.get("filename") or digest)
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return StreamingResponse(
+        blob_store.iter_range(digest, start, end) if size else iter(()),
+        status_code=206 if byte_range else 200,
+        media_type=document.get("content_type") or "application/octet-stream",
+        headers=headers
+    )
+
+# Tourist listing
+TOURIST_PAGE_SIZE = 100
+TOURIST_PAGE_MAX = 1000
+TOURIST_HEAVY_FIELDS = {"documents", "itinerary", "qr_code_data"}
+TOURIST_DEFAULT_FIELDS = [c.name for c in tourists.columns if c.name not in TOURIST_HEAVY_FIELDS]
+
+TOURIST_VERIFICATION_STATES = ("verified", "pending", "expired")
+
+def tourist_verification_clause(verification: str):
+    """Same rules as the ID records page: no documents is pending, else expired past valid_until"""
+    pending = sqlalchemy.or_(
+        tourists.c.documents.is_(None),
+        sqlalchemy.cast(tourists.c.documents, sqlalchemy.Text).in_(["null", "[]"])
+    )
+    if verification == "pending":
+        return pending
+    expired = tourists.c.valid_until < datetime.utcnow()
+    if verification == "expired":
+        return sqlalchemy.and_(sqlalchemy.not_(pending), expired)
+    return sqlalchemy.and_(sqlalchemy.not_(pending), sqlalchemy.or_(tourists.c.valid_until.is_(None), sqlalchemy.not_(expired)))
 
-        await database.execute(query)
+def build_tourist_list_query(fields: List[str], after_id: Optional[int], nationality: Optional[str],
+                             destination: Optional[str], status: Optional[str],
+                             search: Optional[str] = None, verification: Optional[str] = None):
+    """Keyset-paginated, column-projected SELECT on tourists ordered by id"""
+    query = sqlalchemy.select(*[tourists.c[name] for name in fields])
 
-        return {
-            "tourist_id": tourist_id,
-            "qr_code_data": qr_code_image,
-            "message": "Tourist registered successfully"
-        }
+    if status:
+        query = query.select_from(
+            tourists.outerjoin(tourist_locations, tourists.c.tourist_id == tourist_locations.c.tourist_id)
+        ).where(func.coalesce(tourist_locations.c.status, 'unknown') == status)
+    if nationality:
+        query = query.where(tourists.c.nationality == nationality)
+    if destination:
+        query = query.where(tourists.c.destination == destination)
+    if search:
+        term = search.lower()
+        query = query.where(sqlalchemy.or_(*[
+            func.lower(column).contains(term, autoescape=True)
+            for column in (tourists.c.full_name, tourists.c.tourist_id, tourists.c.nationality)
+        ]))
+    if verification:
+        query = query.where(tourist_verification_clause(verification))
+    if after_id is not None:
+        query = query.where(tourists.c.id > after_id)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
+    return query.order_by(tourists.c.id)
 
-@app.get("/tourist/{tourist_id}")
-async def get_tourist(tourist_id: str):
-    query = tourists.select().where(tourists.c.tourist_id == tourist_id)
-    tourist = await database.fetch_one(query)
+@app.get("/tourists/")
+async def get_all_tourists(
+    limit: Optional[int] = None,
+    after_id: Optional[int] = None,
+    fields: Optional[str] = None,
+    nationality: Optional[str] = None,
+    destination: Optional[str] = None,
+    status: Optional[str] = None,
+    search: Optional[str] = None,
+    verification: Optional[str] = None,
+    format: str = "json"
+):
+    """List tourists a page at a time; format=ndjson streams every matching row from a cursor"""
+    if verification and verification not in TOURIST_VERIFICATION_STATES:
+        raise HTTPException(status_code=400, detail=f"verification must be one of {', '.join(TOURIST_VERIFICATION_STATES)}")
+    if fields:
+        field_names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in field_names if name not in tourists.c]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    else:
+        field_names = list(TOURIST_DEFAULT_FIELDS)
+    if "id" not in field_names:
+        field_names.insert(0, "id")  # Needed for the next cursor
 
-    if not tourist:
-        raise HTTPException(status_code=404, detail="Tourist not found")
+    query = build_tourist_list_query(field_names, after_id, nationality, destination, status, search, verification)
 
-    return dict(tourist)
+    if format == "ndjson":
+        if limit is not None:
+            query = query.limit(max(1, limit))
 
-@app.get("/tourists/")
-async def get_all_tourists():
-    query = tourists.select()
-    results = await database.fetch_all(query)
-    return [dict(row) for row in results]
+        async def stream_rows():
+            async for row in database.iterate(query):
+                yield json.dumps(jsonable_encoder(dict(row))) + "\n"
+
+        return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+
+    page_size = max(1, min(limit or TOURIST_PAGE_SIZE, TOURIST_PAGE_MAX))
+    results = await database.fetch_all(query.limit(page_size))
+    rows = [dict(row) for row in results]
+
+    headers = {}
+    if len(rows) == page_size:
+        headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return JSONResponse(content=jsonable_encoder(rows), headers=headers)
+
+def parse_dashboard_command(message: str) -> Optional[dict]:
+    """Get a {"action": ...} command from a dashboard message, or None for plain text"""
+    try:
+        command = json.loads(message)
+    except ValueError:
+        return None
+    if isinstance(command, dict) and "action" in command:
+        return command
+    return None
+
+def handle_dashboard_command(websocket: WebSocket, command: dict) -> Optional[dict]:
+    """Apply a subscribe/unsubscribe/ack command and build the reply (acks get none)"""
+    action = command.get("action")
+    timestamp = datetime.utcnow().isoformat()
+
+    if action == "ack":
+        try:
+            manager.ack(websocket, int(command.get("seq")))
+        except (TypeError, ValueError):
+            return {"type": "error", "message": "ack needs an integer seq", "timestamp": timestamp}
+        return None
+
+    if action == "unsubscribe":
+        manager.unsubscribe(websocket)
+        return {"type": "subscription_status", "subscribed": False, "timestamp": timestamp}
+
+    if action == "subscribe":
+        bbox = command.get("bbox")
+        zone_ids = command.get("zone_ids") or []
+        try:
+            if bbox is not None:
+                bbox = tuple(float(v) for v in bbox)
+                if len(bbox) != 4 or not -90 <= bbox[0] <= bbox[2] <= 90:
+                    raise ValueError("bbox must be [min_lat, min_lng, max_lat, max_lng]")
+                # min_lng > max_lng is a box crossing the antimeridian
+                if not (-180 <= bbox[1] <= 180 and -180 <= bbox[3] <= 180):
+                    raise ValueError("bbox longitudes must be within [-180, 180]")
+            zone_ids = [str(zone_id) for zone_id in zone_ids]
+            if bbox is None and not zone_ids:
+                raise ValueError("subscribe needs a bbox or zone_ids")
+        except (TypeError, ValueError) as e:
+            return {"type": "error", "message": f"Invalid subscription: {str(e)}", "timestamp": timestamp}
+
+        manager.subscribe(websocket, bbox, zone_ids)
+        return {
+            "type": "subscription_status",
+            "subscribed": True,
+            "bbox": list(bbox) if bbox else None,
+            "zone_ids": zone_ids,
+            "timestamp": timestamp
+        }
+
+    return {"type": "error", "message": f"Unknown action: {action}", "timestamp": timestamp}
+
+async def send_catch_up(websocket: WebSocket, since: int):
+    """Replay the events a reconnecting dashboard missed, or a full snapshot when they have left the log;
+    both are limited to the dashboard's subscription"""
+    connection = manager.active_connections.get(websocket)
+    if connection is None:
+        return
+    # No await before queueing the replay, so no live event can slip in ahead of it
+    last_seq = event_log.last_seq
+    missed = event_log.since(since)
+    if missed is not None:
+        # Events are already serialized; splice them into the frame instead of re-encoding
+        events = ",".join(manager.replay_payloads(connection, *missed))
+        manager.send(websocket, (
+            f'{{"type": "replay", "from_seq": {since}, "to_seq": {last_seq}, '
+            f'"stream_mode": "{connection.stream_mode}", "events": [{events}]}}'
+        ))
+        return
+
+    locations = await get_all_current_tourist_locations()
+    if connection not in manager.subscriptions.unfiltered:
+        index = geofence_snapshot.index
+        locations = [
+            location for location in locations
+            if manager.subscriptions.matches(connection, location["lat"], location["lng"],
+                                             [v["zone"]["zone_id"] for v in index.check(location["lat"], location["lng"])])
+        ]
+    manager.send(websocket, {
+        "type": "snapshot",
+        "tourists": jsonable_encoder(locations),
+        "zones_etag": geofence_snapshot.etag,
+        "event_seq": last_seq,
+        "timestamp": datetime.utcnow().isoformat()
+    })
 
 @app.websocket("/ws/police_dashboard")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, stream: str = "realtime", since: Optional[int] = None,
+                             bbox: Optional[str] = None, zone_ids: Optional[str] = None):
     try:
-        await manager.connect(websocket)
+        stream_mode = "batched" if stream == "batched" else "realtime"
+        await manager.connect(websocket, stream_mode)
         logger.info("Police dashboard WebSocket connected successfully")
+        # Subscribing in the URL applies the filter before the catch-up below
+        if bbox or zone_ids:
+            manager.send(websocket, handle_dashboard_command(websocket, {
+                "action": "subscribe",
+                "bbox": bbox.split(",") if bbox else None,
+                "zone_ids": [zone_id for zone_id in (zone_ids or "").split(",") if zone_id]
+            }))
         
-        await websocket.send_text(json.dumps({
+        manager.send(websocket, {
             "type": "connection_status",
             "status": "connected",
             "message": "Successfully connected to police dashboard",
+            "stream_mode": stream_mode,
+            "event_seq": event_log.last_seq,
             "timestamp": datetime.utcnow().isoformat()
-        }))
+        })
+        if since is not None:
+            await send_catch_up(websocket, since)
         
         while True:
             try:
                 message = await websocket.receive_text()
                 logger.info(f"Received WebSocket message: {message}")
                 
-                await websocket.send_text(json.dumps({
+                command = parse_dashboard_command(message)
+                if command is not None:
+                    reply = handle_dashboard_command(websocket, command)
+                    if reply is not None:
+                        manager.send(websocket, reply)
+                    continue
+                
+                manager.send(websocket, {
                     "type": "echo",
                     "message": f"Server received: {message}",
                     "timestamp": datetime.utcnow().isoformat()
-                }))
+                })
                 
             except WebSocketDisconnect:
                 logger.info("WebSocket client disconnected")
@@ -670,133 +3535,364 @@ async def websocket_endpoint(websocket: WebSocket):
 # GEOFENCING ENDPOINTS
 
 @app.get("/geofence/zones/")
-async def get_geofence_zones():
-    """Get all predefined geofence zones"""
+async def get_geofence_zones(request: Request):
+    """Get all geofence zones from the active snapshot"""
     try:
-        zones = get_predefined_zones()
+        snapshot = geofence_snapshot
+        headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+
+        if request.headers.get("if-none-match") == snapshot.etag:
+            return Response(status_code=304, headers=headers)
+
+        return Response(content=snapshot.response_body, media_type="application/json", headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching zones: {str(e)}")
+
+@app.post("/geofence/zones/reload")
+async def reload_geofence_zones_endpoint(authority_id: str = Depends(require_admin)):
+    """Reload the zone catalog from the database (admin)"""
+    try:
+        snapshot = await reload_geofence_zones()
+        await refresh_safety_grid()
         return {
-            "zones": zones,
-            "total_zones": len(zones),
-            "zone_types": {
-                "safe": len([z for z in zones if z["zone_type"] == "safe"]),
-                "warning": len([z for z in zones if z["zone_type"] == "warning"]),
-                "danger": len([z for z in zones if z["zone_type"] == "danger"])
-            }
+            "message": "Geofence zones reloaded",
+            "total_zones": len(snapshot.zones),
+            "etag": snapshot.etag,
+            "loaded_at": snapshot.loaded_at.isoformat()
         }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching zones: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error reloading zones: {str(e)}")
+
+# Alerting for location fixes
+ROUTE_DEVIATION_THRESHOLD = 5000  # meters
+ALERT_REPEAT_SECONDS = float(os.getenv("ALERT_REPEAT_SECONDS", "300"))
+# A tourist inside a zone only exits beyond radius * (1 + hysteresis), and at least the minimum margin
+GEOFENCE_EXIT_HYSTERESIS = float(os.getenv("GEOFENCE_EXIT_HYSTERESIS", "0.1"))
+GEOFENCE_EXIT_MIN_MARGIN = float(os.getenv("GEOFENCE_EXIT_MIN_MARGIN", "25"))  # meters
+GEOFENCE_DWELL_SECONDS = float(os.getenv("GEOFENCE_DWELL_SECONDS", "600"))
+ALERTING_ZONE_TYPES = ("warning", "danger")
+
+class GeofenceMembership:
+    """Zones each tourist is currently in; turns location fixes into enter, exit and dwell events"""
+
+    def __init__(self, exit_hysteresis: float, exit_min_margin: float, dwell_after: timedelta):
+        self.exit_hysteresis = exit_hysteresis
+        self.exit_min_margin = exit_min_margin
+        self.dwell_after = dwell_after
+        # tourist_id -> zone_id -> {"entered_at", "dwell_sent"}
+        self.members: Dict[str, Dict[str, dict]] = {}
+
+    def retain_zones(self, zone_ids) -> int:
+        """Forget memberships of zones no longer in the catalog; returns how many were dropped"""
+        dropped = 0
+        for tourist_id in list(self.members):
+            members = self.members[tourist_id]
+            for zone_id in [zone_id for zone_id in members if zone_id not in zone_ids]:
+                del members[zone_id]
+                dropped += 1
+            if not members:
+                del self.members[tourist_id]
+        return dropped
+
+    def exit_radius(self, zone: dict) -> float:
+        radius = zone["radius_meters"]
+        return radius + max(radius * self.exit_hysteresis, self.exit_min_margin)
+
+    def update(self, tourist_id: str, lat: float, lng: float, now: datetime,
+               snapshot: "GeofenceSnapshot") -> Tuple[List[dict], List[dict]]:
+        """Record a fix; returns (zones the tourist counts as inside, transition events)"""
+        inside = {v["zone"]["zone_id"]: v for v in snapshot.index.check(lat, lng)}
+        current = self.members.get(tourist_id, {})
+        violations = list(inside.values())
+        events = []
+        members = {}
+
+        for zone_id, member in current.items():
+            if zone_id in inside:
+                members[zone_id] = member
+                continue
+            zone = snapshot.zones_by_id.get(zone_id)
+            distance = calculate_distance(lat, lng, zone["center_lat"], zone["center_lng"]) if zone else None
+            if zone is not None and distance <= self.exit_radius(zone):
+                # Within the hysteresis band: still inside until clearly out
+                members[zone_id] = member
+                violations.append({
+                    "zone": zone,
+                    "distance_from_center": round(distance, 2),
+                    "violation_type": "inside_zone"
+                })
+            else:
+                events.append({"event": "exit", "zone_id": zone_id, "zone": zone,
+                               "dwell_seconds": round((now - member["entered_at"]).total_seconds())})
+
+        for zone_id, violation in inside.items():
+            if zone_id not in current:
+                members[zone_id] = {"entered_at": now, "dwell_sent": False}
+                events.append({"event": "enter", "zone_id": zone_id, "zone": violation["zone"], "dwell_seconds": 0})
+
+        for zone_id, member in members.items():
+            if not member["dwell_sent"] and now - member["entered_at"] >= self.dwell_after:
+                member["dwell_sent"] = True
+                events.append({"event": "dwell", "zone_id": zone_id, "zone": snapshot.zones_by_id[zone_id],
+                               "dwell_seconds": round((now - member["entered_at"]).total_seconds())})
+
+        if members:
+            self.members[tourist_id] = members
+        else:
+            self.members.pop(tourist_id, None)
+        return violations, events
+
+geofence_membership = GeofenceMembership(
+    GEOFENCE_EXIT_HYSTERESIS, GEOFENCE_EXIT_MIN_MARGIN, timedelta(seconds=GEOFENCE_DWELL_SECONDS)
+)
+
+def geofence_event_messages(tourist_id: str, lat: float, lng: float, status: str, alert_level: str,
+                            violations: List[dict], events: List[dict], now: datetime) -> List[dict]:
+    """Police messages for the transitions of warning and danger zones: one alert and/or one exit notice"""
+    alerting = [e for e in events if e["zone"] is None or e["zone"]["zone_type"] in ALERTING_ZONE_TYPES]
+    messages = []
+
+    entered = [e for e in alerting if e["event"] in ("enter", "dwell")]
+    if entered:
+        first = entered[0]
+        if first["event"] == "enter":
+            text = f"Tourist entered {first['zone']['zone_type']} zone: {first['zone']['name']}"
+        else:
+            text = f"Tourist has been in {first['zone']['zone_type']} zone {first['zone']['name']} for {first['dwell_seconds'] // 60} minutes"
+        messages.append({
+            "type": "geofence_alert",
+            "priority": alert_level == "high",
+            "event": first["event"],
+            "tourist_id": tourist_id,
+            "alert_level": alert_level,
+            "status": status,
+            "violations": violations,
+            "events": [{"event": e["event"], "zone_id": e["zone_id"], "dwell_seconds": e["dwell_seconds"]} for e in entered],
+            "location": {"lat": lat, "lng": lng},
+            "timestamp": now.isoformat(),
+            "message": text
+        })
+
+    exited = [e for e in alerting if e["event"] == "exit"]
+    if exited:
+        names = ", ".join(e["zone"]["name"] if e["zone"] else e["zone_id"] for e in exited)
+        messages.append({
+            "type": "geofence_exit",
+            "tourist_id": tourist_id,
+            "status": status,
+            "events": [{"event": "exit", "zone_id": e["zone_id"], "dwell_seconds": e["dwell_seconds"]} for e in exited],
+            "location": {"lat": lat, "lng": lng},
+            "timestamp": now.isoformat(),
+            "message": f"Tourist left zone: {names}"
+        })
+
+    return messages
+
+def assess_geofence(tourist_id: str, lat: float, lng: float, now: datetime) -> Tuple[dict, List[dict]]:
+    """Geofence result for a fix and the police messages its zone transitions call for"""
+    violations, events = geofence_membership.update(tourist_id, lat, lng, now, geofence_snapshot)
+    status, alert_level = classify_violations(violations)
+
+    result = {
+        "tourist_id": tourist_id,
+        "status": status,
+        "alert_level": alert_level,
+        "violations": violations,
+        "events": [{"event": e["event"], "zone_id": e["zone_id"]} for e in events],
+        "safe_zones_nearby": [v for v in violations if v["zone"]["zone_type"] == "safe"],
+        "recommendations": get_safety_recommendations(violations)
+    }
+    return result, geofence_event_messages(tourist_id, lat, lng, status, alert_level, violations, events, now)
+
+def assess_route_deviation(tourist_id: str, plan: ItineraryPlan, lat: float, lng: float) -> Tuple[dict, Optional[dict]]:
+    """Deviation from today's planned location and the police alert it calls for, if any"""
+    if not plan.entries:
+        return {"message": "No itinerary to check against", "deviation": False}, None
+
+    today = datetime.utcnow().date()
+    today_plan = plan.days.get(today)
+    if not today_plan:
+        return {"message": "No plan for today", "deviation": False}, None
+
+    planned_coords = plan.coordinates[today]
+    if not planned_coords:
+        return {"message": "Cannot determine planned location coordinates", "deviation": False}, None
+
+    deviation_distance = calculate_distance(lat, lng, planned_coords[0], planned_coords[1])
+    is_deviating = deviation_distance > ROUTE_DEVIATION_THRESHOLD
+
+    alert_message = None
+    if is_deviating:
+        alert_message = {
+            "type": "route_deviation",
+            "tourist_id": tourist_id,
+            "current_location": {"lat": lat, "lng": lng},
+            "planned_location": {"lat": planned_coords[0], "lng": planned_coords[1]},
+            "deviation_distance": round(deviation_distance, 2),
+            "planned_destination": today_plan["location"],
+            "timestamp": datetime.utcnow().isoformat(),
+            "message": f"Tourist is {round(deviation_distance/1000, 1)}km away from planned destination: {today_plan['location']}"
+        }
+
+    result = {
+        "deviation": is_deviating,
+        "deviation_distance": round(deviation_distance, 2),
+        "planned_location": today_plan["location"],
+        "threshold": ROUTE_DEVIATION_THRESHOLD,
+        "coordinates": {
+            "current": {"lat": lat, "lng": lng},
+            "planned": {"lat": planned_coords[0], "lng": planned_coords[1]}
+        }
+    }
+    return result, alert_message
+
+def alert_signature(alert_message: dict) -> tuple:
+    """What makes a route deviation alert new: the planned destination"""
+    return (alert_message.get("planned_destination"),)
+
+class AlertDeduplicator:
+    """Suppresses repeats of an ongoing route deviation alert per tourist until it changes, clears,
+    or realert_after passes (geofence alerts are transition based, see GeofenceMembership)"""
+
+    def __init__(self, realert_after: timedelta):
+        self.realert_after = realert_after
+        # (tourist_id, alert type) -> (signature, sent_at)
+        self._sent: Dict[Tuple[str, str], Tuple[tuple, datetime]] = {}
+
+    def filter(self, tourist_id: str, alerts: Dict[str, Optional[dict]], now: datetime) -> List[dict]:
+        """alerts maps each evaluated alert type to its alert, or None when the condition is clear"""
+        to_send = []
+        for alert_type, alert_message in alerts.items():
+            key = (tourist_id, alert_type)
+            if alert_message is None:
+                self._sent.pop(key, None)
+                continue
+            signature = alert_signature(alert_message)
+            previous = self._sent.get(key)
+            if previous and previous[0] == signature and now - previous[1] < self.realert_after:
+                continue
+            self._sent[key] = (signature, now)
+            to_send.append(alert_message)
+        return to_send
+
+alert_deduplicator = AlertDeduplicator(timedelta(seconds=ALERT_REPEAT_SECONDS))
+
+def send_alerts(alerts: List[dict], lat: float, lng: float, zone_ids: List[str] = ()):
+    for alert_message in alerts:
+        manager.route(alert_message, lat, lng, zone_ids)
+
+def event_zone_ids(result: dict) -> List[str]:
+    """Zones a fix is inside or just left, for routing its messages to zone subscribers"""
+    return list({v["zone"]["zone_id"] for v in result["violations"]} | {e["zone_id"] for e in result["events"]})
+
+async def evaluate_geofence(check_data: GeofenceCheck) -> dict:
+    """Evaluate a location against the zones and alert police on transitions; does not touch the database"""
+    result, alerts = assess_geofence(check_data.tourist_id, check_data.lat, check_data.lng, datetime.utcnow())
+    send_alerts(alerts, check_data.lat, check_data.lng, event_zone_ids(result))
+    return result
+
+async def process_location_fix(data: LocationUpdate) -> dict:
+    """Single ingest stage for a location fix: geofence and route checks, state update, one fan-out"""
+    now = datetime.utcnow()
+    geofence_result, alerts = assess_geofence(data.tourist_id, data.lat, data.lng, now)
+    status = geofence_result["status"]
+
+    deviation_result, deviation_alert = None, None
+    plan = await itinerary_cache.get(data.tourist_id)
+    if plan is not None:
+        deviation_result, deviation_alert = assess_route_deviation(data.tourist_id, plan, data.lat, data.lng)
+
+    # Queue location with geofence status; flushed in bulk by location_buffer
+    live_state.update_location(data.tourist_id, data.lat, data.lng, status, now)
+    location_buffer.put(data.tourist_id, data.lat, data.lng, status, now)
+    history_writer.append(data.tourist_id, data.lat, data.lng, status, now)
+
+    if plan is not None:
+        alerts += alert_deduplicator.filter(data.tourist_id, {"route_deviation": deviation_alert}, now)
+
+    update_message = {
+        "type": "location_update",
+        "tourist_id": data.tourist_id,
+        "lat": data.lat,
+        "lng": data.lng,
+        "status": status,
+        "geofence_violations": geofence_result["violations"],
+        "timestamp": now.isoformat()
+    }
+    manager.publish_location(update_message, alerts, event_zone_ids(geofence_result))
+
+    return {
+        "geofence": geofence_result,
+        "route_deviation": deviation_result
+    }
 
 @app.post("/geofence/check/")
 async def check_geofence(check_data: GeofenceCheck):
     """Check if tourist location violates any geofence zones"""
     try:
-        zones = get_predefined_zones()
-        violations = check_geofence_violations(
-            check_data.lat, check_data.lng, zones
-        )
+        result = await evaluate_geofence(check_data)
         
-        if not violations:
-            status = "safe"
-            alert_level = "none"
-        else:
-            danger_zones = [v for v in violations if v["zone"]["zone_type"] == "danger"]
-            warning_zones = [v for v in violations if v["zone"]["zone_type"] == "warning"]
+        # Update tourist status in database only when it changes
+        entry = live_state.entries.get(check_data.tourist_id)
+        if entry is None or not entry["located"] or entry["status"] != result["status"]:
+            update_query = tourist_locations.update().where(
+                tourist_locations.c.tourist_id == check_data.tourist_id
+            ).values(status=result["status"], last_updated=datetime.utcnow())
             
-            if danger_zones:
-                status = "danger"
-                alert_level = "high"
-            elif warning_zones:
-                status = "warning"
-                alert_level = "medium"
-            else:
-                status = "safe"
-                alert_level = "low"
+            await database.execute(update_query)
+            location_buffer.set_status(check_data.tourist_id, result["status"])
+            live_state.set_status(check_data.tourist_id, result["status"], datetime.utcnow())
         
-        # Update tourist status in database
-        update_query = tourist_locations.update().where(
-            tourist_locations.c.tourist_id == check_data.tourist_id
-        ).values(status=status, last_updated=datetime.utcnow())
+        return result
         
-        await database.execute(update_query)
-        
-        # Send alert to police if dangerous
-        if alert_level in ["high", "medium"]:
-            alert_message = {
-                "type": "geofence_alert",
-                "tourist_id": check_data.tourist_id,
-                "alert_level": alert_level,
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Geofence check failed: {str(e)}")
+
+@app.post("/geofence/check-batch/")
+async def check_geofence_batch_endpoint(batch: GeofenceBatchCheck):
+    """Evaluate a batch of location fixes against all geofence zones"""
+    try:
+        snapshot = geofence_snapshot
+        lats = np.array([p.lat for p in batch.points], dtype=np.float64)
+        lngs = np.array([p.lng for p in batch.points], dtype=np.float64)
+        all_violations = check_geofence_batch(lats, lngs, snapshot)
+
+        results = []
+        status_counts = {"safe": 0, "warning": 0, "danger": 0}
+        for point, violations in zip(batch.points, all_violations):
+            status, alert_level = classify_violations(violations)
+            status_counts[status] += 1
+            results.append({
+                "tourist_id": point.tourist_id,
+                "lat": point.lat,
+                "lng": point.lng,
                 "status": status,
-                "violations": violations,
-                "location": {"lat": check_data.lat, "lng": check_data.lng},
-                "timestamp": datetime.utcnow().isoformat(),
-                "message": f"Tourist entered {status} zone: {violations[0]['zone']['name']}"
-            }
-            
-            await manager.broadcast(json.dumps(alert_message))
-        
+                "alert_level": alert_level,
+                "violations": violations
+            })
+
         return {
-            "tourist_id": check_data.tourist_id,
-            "status": status,
-            "alert_level": alert_level,
-            "violations": violations,
-            "safe_zones_nearby": [v for v in violations if v["zone"]["zone_type"] == "safe"],
-            "recommendations": get_safety_recommendations(violations)
+            "total_points": len(results),
+            "status_counts": status_counts,
+            "results": results
         }
-        
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Geofence check failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch geofence check failed: {str(e)}")
 
 @app.post("/update-location/")
 async def update_location(data: LocationUpdate):
     """Update location with automatic geofence checking"""
     try:
-        # Perform geofence check
-        geofence_check = GeofenceCheck(
-            tourist_id=data.tourist_id,
-            lat=data.lat,
-            lng=data.lng
-        )
-        
-        geofence_result = await check_geofence(geofence_check)
-        status = geofence_result["status"]
-        
-        # Update location with geofence status
-        on_conflict = sqlalchemy.dialects.postgresql.insert(tourist_locations).values(
-            tourist_id=data.tourist_id,
-            lat=data.lat,
-            lng=data.lng,
-            status=status,
-            last_updated=datetime.utcnow()
-        ).on_conflict_do_update(
-            index_elements=['tourist_id'],
-            set_=dict(
-                lat=data.lat, 
-                lng=data.lng, 
-                status=status, 
-                last_updated=datetime.utcnow()
-            )
-        )
-        
-        await database.execute(on_conflict)
-        
-        # Broadcast location update with geofence status
-        update_message = {
-            "type": "location_update",
-            "tourist_id": data.tourist_id,
-            "lat": data.lat,
-            "lng": data.lng,
-            "status": status,
-            "geofence_violations": geofence_result.get("violations", []),
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        await manager.broadcast(json.dumps(update_message))
+        result = await process_location_fix(data)
+        geofence_result = result["geofence"]
         
         return {
             "message": "Location updated successfully",
-            "geofence_status": status,
-            "violations": geofence_result.get("violations", []),
-            "recommendations": geofence_result.get("recommendations", [])
+            "geofence_status": geofence_result["status"],
+            "violations": geofence_result["violations"],
+            "recommendations": geofence_result["recommendations"],
+            "route_deviation": result["route_deviation"]
         }
         
     except Exception as e:
@@ -806,106 +3902,109 @@ async def update_location(data: LocationUpdate):
 async def check_route_deviation(data: LocationUpdate):
     """Check if tourist is deviating from planned route"""
     try:
-        query = tourists.select().where(tourists.c.tourist_id == data.tourist_id)
-        tourist = await database.fetch_one(query)
+        plan = await itinerary_cache.get(data.tourist_id)
         
-        if not tourist:
+        if plan is None:
             raise HTTPException(status_code=404, detail="Tourist not found")
         
-        itinerary = tourist.itinerary or []
-        if not itinerary:
-            return {"message": "No itinerary to check against", "deviation": False}
-        
-        # Get today's planned location
-        today = datetime.utcnow().date()
-        today_plan = None
-        
-        for day in itinerary:
-            try:
-                day_date = datetime.strptime(day["date"], "%Y-%m-%d").date()
-                if day_date == today:
-                    today_plan = day
-                    break
-            except:
-                continue
-        
-        if not today_plan:
-            return {"message": "No plan for today", "deviation": False}
+        result, alert_message = assess_route_deviation(data.tourist_id, plan, data.lat, data.lng)
+        alerts = alert_deduplicator.filter(data.tourist_id, {"route_deviation": alert_message}, datetime.utcnow())
+        send_alerts(alerts, data.lat, data.lng)
         
-        planned_coords = get_coordinates_for_location(today_plan["location"])
-        if not planned_coords:
-            return {"message": "Cannot determine planned location coordinates", "deviation": False}
-        
-        # Calculate deviation distance
-        deviation_distance = calculate_distance(
-            data.lat, data.lng,
-            planned_coords[0], planned_coords[1]
-        )
-        
-        # Deviation threshold (5km)
-        deviation_threshold = 5000  # meters
-        is_deviating = deviation_distance > deviation_threshold
-        
-        if is_deviating:
-            alert_message = {
-                "type": "route_deviation",
-                "tourist_id": data.tourist_id,
-                "current_location": {"lat": data.lat, "lng": data.lng},
-                "planned_location": {"lat": planned_coords[0], "lng": planned_coords[1]},
-                "deviation_distance": round(deviation_distance, 2),
-                "planned_destination": today_plan["location"],
-                "timestamp": datetime.utcnow().isoformat(),
-                "message": f"Tourist is {round(deviation_distance/1000, 1)}km away from planned destination: {today_plan['location']}"
-            }
-            
-            await manager.broadcast(json.dumps(alert_message))
-        
-        return {
-            "deviation": is_deviating,
-            "deviation_distance": round(deviation_distance, 2),
-            "planned_location": today_plan["location"],
-            "threshold": deviation_threshold,
-            "coordinates": {
-                "current": {"lat": data.lat, "lng": data.lng},
-                "planned": {"lat": planned_coords[0], "lng": planned_coords[1]}
-            }
-        }
+        return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Route deviation check failed: {str(e)}")
 
+@app.get("/gazetteer/search")
+async def search_gazetteer(q: str, limit: int = Query(10, ge=1, le=100)):
+    """Place names starting with q, for itinerary autocomplete"""
+    return {"query": q, "results": gazetteer.search(q, limit)}
+
 # SAFETY SCORING ENDPOINTS
 
-@app.get("/safety-scores/{location}")
-async def get_safety_score(location: str):
-    """Get safety score for a specific location"""
+def safety_scores_headers(table: SafetyScoreTable) -> Dict[str, str]:
+    return {"ETag": table.etag, "Cache-Control": f"public, max-age={SAFETY_SCORES_MAX_AGE}"}
+
+@app.get("/safety-scores/batch")
+async def get_safety_scores_batch(request: Request, locations: List[str] = Query(...)):
+    """Get safety scores for many locations in one call (?locations=Delhi&locations=Goa)"""
+    if len(locations) > SAFETY_SCORES_BATCH_LIMIT:
+        raise HTTPException(status_code=400, detail=f"At most {SAFETY_SCORES_BATCH_LIMIT} locations per request")
     try:
-        safety_data = {
-            "Delhi": {"score": 75, "factors": ["Heavy traffic", "Air pollution", "Crowded areas"], "tips": ["Avoid isolated areas at night", "Use registered taxis"]},
-            "Mumbai": {"score": 80, "factors": ["Monsoon flooding", "Dense population"], "tips": ["Be cautious during monsoon", "Keep valuables secure"]},
-            "Baghi": {"score": 90, "factors": ["Tourist-friendly", "Good infrastructure"], "tips": ["Beach safety", "Licensed water sports only"]},
-            "Rajasthan": {"score": 85, "factors": ["Desert climate", "Cultural sites"], "tips": ["Stay hydrated", "Respect local customs"]},
-            "Kerala": {"score": 88, "factors": ["Natural disasters", "Monsoon season"], "tips": ["Check weather conditions", "Use reputable tour operators"]},
-            "Thdc-Dam": {"score": 78, "factors": ["Traffic congestion", "Old infrastructure"], "tips": ["Use metro when possible", "Be aware of surroundings"]},
-            "Tokyo": {"score": 95, "factors": ["Very safe", "Natural disasters possible"], "tips": ["Learn basic earthquake safety", "Respect local etiquette"]},
-            "London": {"score": 92, "factors": ["Generally safe", "Weather changes"], "tips": ["Be aware in tourist areas", "Carry umbrella"]},
-            "Paris": {"score": 88, "factors": ["Pickpocketing in tourist areas"], "tips": ["Secure belongings", "Avoid crowded metro during rush hour"]},
-            "New York": {"score": 85, "factors": ["Busy traffic", "Varied neighborhoods"], "tips": ["Stay in well-lit areas", "Use official taxis"]},
-            "Bangkok": {"score": 82, "factors": ["Traffic congestion", "Monsoon flooding"], "tips": ["Use BTS/MRT when possible", "Stay hydrated"]},
-            "default": {"score": 90, "factors": ["Unknown area"], "tips": ["Research local conditions", "Stay vigilant"]}
-        }
-        
-        location_key = location.strip().title()
-        location_data = safety_data.get(location_key, safety_data["default"])
-        
+        table = safety_table
+        headers = safety_scores_headers(table)
+        if request.headers.get("if-none-match") == table.etag:
+            return Response(status_code=304, headers=headers)
+
+        content = {"version": table.version, "scores": [table.score(location) for location in locations]}
+        return JSONResponse(content=content, headers=headers)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching safety scores: {str(e)}")
+
+@app.post("/safety-scores/reload")
+async def reload_safety_scores(authority_id: str = Depends(require_admin)):
+    """Reload the safety scores dataset from SAFETY_SCORES_PATH (admin)"""
+    global safety_table
+    try:
+        safety_table = load_safety_scores(SAFETY_SCORES_PATH)
         return {
-            "location": location,
-            "safety_score": location_data["score"],
-            "risk_factors": location_data["factors"],
-            "safety_tips": location_data["tips"],
-            "last_updated": datetime.utcnow().isoformat(),
-            "category": get_safety_category(location_data["score"])
+            "message": "Safety scores reloaded",
+            "version": safety_table.version,
+            "total_locations": len(safety_table.entries),
+            "etag": safety_table.etag
         }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reloading safety scores: {str(e)}")
+
+@app.post("/safety-scores/")
+async def score_location(data: SafetyScoreRequest):
+    """Safety score for a named location, refined by the spatial grid when lat/lng are given"""
+    try:
+        result = safety_table.score(data.location)
+        if data.lat is not None and data.lng is not None:
+            grid_score = safety_grid.score_at(data.lat, data.lng)
+            result.update(
+                safety_score=grid_score,
+                category=get_safety_category(grid_score),
+                location_score=result["safety_score"],
+                coordinates={"lat": data.lat, "lng": data.lng}
+            )
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error scoring location: {str(e)}")
+
+@app.post("/safety-scores/path")
+async def score_path(data: SafetyPathRequest):
+    """Score a polyline by sampling it against the spatial safety grid"""
+    if not data.points:
+        raise HTTPException(status_code=400, detail="At least one point is required")
+    try:
+        return safety_grid.score_path(
+            [p.lat for p in data.points], [p.lng for p in data.points], data.sample_meters
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error scoring path: {str(e)}")
+
+@app.post("/safety-grid/rebuild")
+async def rebuild_safety_grid(authority_id: str = Depends(require_admin)):
+    """Rebuild the spatial safety grid from the current zones and incidents (admin)"""
+    try:
+        grid = await refresh_safety_grid(force=True)
+        return {"message": "Safety grid rebuilt", "blocks": len(grid.blocks), **grid.meta}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rebuilding safety grid: {str(e)}")
+
+@app.get("/safety-scores/{location}")
+async def get_safety_score(request: Request, location: str):
+    """Get safety score for a specific location"""
+    try:
+        table = safety_table
+        headers = safety_scores_headers(table)
+        if request.headers.get("if-none-match") == table.etag:
+            return Response(status_code=304, headers=headers)
+
+        return JSONResponse(content=table.score(location), headers=headers)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching safety score: {str(e)}")
@@ -921,7 +4020,7 @@ async def add_destination_to_itinerary(destination: DestinationRequest):
             raise HTTPException(status_code=404, detail="Tourist not found")
         
         current_itinerary = tourist.itinerary or []
-        safety_response = await get_safety_score(destination.location)
+        safety_response = safety_table.score(destination.location)
         
         new_destination = {
             "date": destination.date,
@@ -942,6 +4041,7 @@ async def add_destination_to_itinerary(destination: DestinationRequest):
         ).values(itinerary=current_itinerary)
         
         await database.execute(update_query)
+        itinerary_cache.invalidate(destination.tourist_id)
         
         return {
             "message": "Destination added successfully",
@@ -953,25 +4053,74 @@ async def add_destination_to_itinerary(destination: DestinationRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error adding destination: {str(e)}")
 
+@app.post("/update-itinerary/")
+async def update_itinerary(data: ItineraryUpdate):
+    """Replace a tourist's itinerary"""
+    try:
+        itinerary_data = sorted((day.model_dump() for day in data.itinerary), key=lambda x: x["date"])
+        
+        update_query = tourists.update().where(
+            tourists.c.tourist_id == data.tourist_id
+        ).values(itinerary=itinerary_data).returning(tourists.c.tourist_id)
+        
+        if await database.fetch_one(update_query) is None:
+            raise HTTPException(status_code=404, detail="Tourist not found")
+        itinerary_cache.invalidate(data.tourist_id)
+        
+        return {
+            "message": "Itinerary updated successfully",
+            "itinerary": itinerary_data,
+            "total_destinations": len(itinerary_data)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating itinerary: {str(e)}")
+
 @app.get("/route-optimization/{tourist_id}")
 async def get_optimized_route(tourist_id: str):
     """Get route optimization suggestions based on safety scores"""
     try:
-        query = tourists.select().where(tourists.c.tourist_id == tourist_id)
-        tourist = await database.fetch_one(query)
+        plan = await itinerary_cache.get(tourist_id)
         
-        if not tourist:
+        if plan is None:
             raise HTTPException(status_code=404, detail="Tourist not found")
         
-        itinerary = tourist.itinerary or []
-        
-        if not itinerary:
+        if not plan.entries:
             return {"message": "No itinerary found", "suggestions": []}
         
+        # Geocoded stops are scored on the spatial grid; the rest keep their stored score
+        itinerary = [day for day, _ in plan.entries]
+        located = [(i, coords) for i, (_, coords) in enumerate(plan.entries) if coords]
+        day_scores = {i: day.get("safety_score", 80) for i, day in enumerate(itinerary)}
+        if located:
+            grid_scores = safety_grid.score_points(
+                np.array([coords[0] for _, coords in located]), np.array([coords[1] for _, coords in located])
+            )
+            day_scores.update({i: int(score) for (i, _), score in zip(located, grid_scores)})
+        path_safety = safety_grid.score_path(
+            [coords[0] for _, coords in located], [coords[1] for _, coords in located], 250
+        ) if located else None
+        
+        # Reorder distinct geocoded stops, keeping the first one as the starting point
+        stops = list(dict.fromkeys(coords for _, coords in located))
+        optimized_route = None
+        if len(stops) >= 2:
+            optimized_route = await route_optimizer.optimize(stops)
+        if optimized_route is not None:
+            stop_locations = {}
+            for i, coords in located:
+                stop_locations.setdefault(coords, itinerary[i].get("location"))
+            optimized_route["stops"] = [
+                {"location": stop_locations[stops[k]], "lat": stops[k][0], "lng": stops[k][1]}
+                for k in optimized_route["order"]
+            ]
+        
         suggestions = []
         
         for i, day in enumerate(itinerary):
-            safety_score = day.get("safety_score", 80)
+            safety_score = day_scores[i]
             
             if safety_score < 70:
                 suggestions.append({
@@ -991,13 +4140,15 @@ async def get_optimized_route(tourist_id: str):
                 })
         
         total_locations = len(itinerary)
-        avg_safety = sum(day.get("safety_score", 80) for day in itinerary) / total_locations if total_locations > 0 else 80
+        avg_safety = sum(day_scores.values()) / total_locations if total_locations > 0 else 80
         
         return {
             "tourist_id": tourist_id,
             "total_destinations": total_locations,
             "average_safety_score": round(avg_safety, 1),
             "route_category": get_safety_category(avg_safety),
+            "path_safety": path_safety,
+            "optimized_route": optimized_route,
             "suggestions": suggestions,
             "optimized": len(suggestions) == 0
         }
@@ -1011,6 +4162,8 @@ async def get_optimized_route(tourist_id: str):
 async def geofence_alert(data: AlertMessage):
     update_query = tourist_locations.update().where(tourist_locations.c.tourist_id == data.tourist_id).values(status="warning")
     await database.execute(update_query)
+    location_buffer.set_status(data.tourist_id, "warning")
+    live_state.set_status(data.tourist_id, "warning")
 
     alert_message = {
         "type": "alert",
@@ -1018,55 +4171,66 @@ async def geofence_alert(data: AlertMessage):
         "message": data.message,
         "timestamp": datetime.utcnow().isoformat()
     }
-    await manager.broadcast(json.dumps(alert_message))
+    manager.broadcast(alert_message)
     return {"message": "Geo-fence alert received"}
 
 @app.post("/sos-alert/")
 async def sos_alert(data: AlertMessage):
-    update_query = tourist_locations.update().where(tourist_locations.c.tourist_id == data.tourist_id).values(status="danger")
-    await database.execute(update_query)
+    received_at = time.monotonic()
 
+    # Dispatch first on the priority lane; the status write follows
     alert_message = {
         "type": "alert",
+        "priority": True,
+        "alert_type": data.alert_type,
         "tourist_id": data.tourist_id,
         "message": data.message,
         "timestamp": datetime.utcnow().isoformat()
     }
-    await manager.broadcast(json.dumps(alert_message))
+    manager.send_priority(alert_message, created_at=received_at)
+
+    update_query = tourist_locations.update().where(tourist_locations.c.tourist_id == data.tourist_id).values(status="danger")
+    await database.execute(update_query)
+    location_buffer.set_status(data.tourist_id, "danger")
+    live_state.set_status(data.tourist_id, "danger")
+
+    # Record the SOS at the last known position; danger points feed the safety grid's incident density
+    entry = live_state.entries.get(data.tourist_id)
+    if entry is not None and entry["located"]:
+        history_writer.append(data.tourist_id, entry["lat"], entry["lng"], "danger", datetime.utcnow())
+
     return {"message": "SOS alert received"}
 
+@app.get("/metrics/sos-latency")
+async def get_sos_latency_metrics():
+    """p50/p99 latency of priority alerts from receipt to socket write and to dashboard acknowledgement,
+    separately for SOS alerts and danger zone alerts"""
+    return {
+        **{kind: metrics.summary() for kind, metrics in priority_metrics.items()},
+        "unacknowledged": sum(len(c.unacked) for c in manager.active_connections.values()),
+        "connections": len(manager.active_connections)
+    }
+
 # ANALYTICS ENDPOINTS
 
 @app.get("/analytics/tourists-by-nationality")
 async def get_tourists_by_nationality():
     try:
-        query = sqlalchemy.select([
-            tourists.c.nationality,
-            func.count(tourists.c.id).label('count')
-        ]).group_by(tourists.c.nationality)
-        
-        results = await database.fetch_all(query)
-        return [{"nationality": row.nationality or "Unknown", "count": row.count} for row in results]
+        counts = registration_stats.by_nationality
+        return [{"nationality": nationality or "Unknown", "count": count} for nationality, count in counts.items() if count]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching nationality data: {str(e)}")
 
 @app.get("/analytics/tourists-by-month")
 async def get_tourists_by_month():
     try:
-        query = sqlalchemy.select([
-            extract('month', tourists.c.created_at).label('month'),
-            func.count(tourists.c.id).label('count')
-        ]).group_by('month').order_by('month')
-        
-        results = await database.fetch_all(query)
-        
         month_names = {
             1: "Jan", 2: "Feb", 3: "Mar", 4: "Apr", 5: "May", 6: "Jun",
             7: "Jul", 8: "Aug", 9: "Sep", 10: "Oct", 11: "Nov", 12: "Dec"
         }
         
         monthly_data = []
-        result_map = {row.month: row.count for row in results}
+        result_map = registration_stats.by_month
         for month_num in range(1, 13):
             monthly_data.append({
                 "month": month_names.get(month_num, f"Month {month_num}"),
@@ -1080,35 +4244,16 @@ async def get_tourists_by_month():
 @app.get("/analytics/destination-stats")
 async def get_destination_stats():
     try:
-        query = sqlalchemy.select([
-            tourists.c.destination,
-            func.count(tourists.c.id).label('count')
-        ]).group_by(tourists.c.destination)
-        
-        results = await database.fetch_all(query)
-        return [{"destination": row.destination or "Unknown", "count": row.count} for row in results]
+        counts = registration_stats.by_destination
+        return [{"destination": destination or "Unknown", "count": count} for destination, count in counts.items() if count]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching destination data: {str(e)}")
 
 @app.get("/analytics/status-overview")
 async def get_status_overview():
     try:
-        subquery = sqlalchemy.select([
-            tourists.c.tourist_id,
-            func.coalesce(tourist_locations.c.status, 'unknown').label('status')
-        ]).select_from(
-            tourists.outerjoin(tourist_locations, tourists.c.tourist_id == tourist_locations.c.tourist_id)
-        ).alias('status_subquery')
-        
-        query = sqlalchemy.select([
-            subquery.c.status,
-            func.count().label('count')
-        ]).group_by(subquery.c.status)
-
-        results = await database.fetch_all(query)
-
         all_statuses = ["safe", "warning", "danger", "unknown"]
-        status_counts = {row.status: row.count for row in results}
+        status_counts = live_state.registered_status_counts
         
         overview = [{"status": s, "count": status_counts.get(s, 0)} for s in all_statuses]
         
@@ -1119,9 +4264,7 @@ async def get_status_overview():
 @app.get("/analytics/total-tourists")
 async def get_total_tourists():
     try:
-        query = sqlalchemy.select([func.count()]).select_from(tourists)
-        count = await database.fetch_val(query)
-        return {"total": count}
+        return {"total": registration_stats.total}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1137,43 +4280,24 @@ async def get_recent_tourists(limit: int = 5):
 @app.get("/analytics/daily-registrations")
 async def get_daily_registrations(days: int = 30):
     try:
-        query = sqlalchemy.select([
-            func.date(tourists.c.created_at).label('date'),
-            func.count(tourists.c.id).label('count')
-        ]).where(
-            tourists.c.created_at >= datetime.utcnow() - timedelta(days=days)
-        ).group_by('date').order_by('date')
-        
-        results = await database.fetch_all(query)
-        return [{"date": row.date.strftime('%Y-%m-%d'), "count": row.count} for row in results]
+        results = registration_stats.daily(days, datetime.utcnow())
+        return [{"date": day.strftime('%Y-%m-%d'), "count": count} for day, count in results]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching daily registrations: {str(e)}")
 
 @app.get("/analytics/alert-statistics")
 async def get_alert_statistics():
     try:
-        query = sqlalchemy.select([
-            tourist_locations.c.status.label('alert_type'),
-            func.count().label('count')
-        ]).where(
-            tourist_locations.c.status.in_(['warning', 'danger'])
-        ).group_by('alert_type')
-        
-        results = await database.fetch_all(query)
-        return [{"alert_type": row.alert_type, "count": row.count} for row in results]
+        counts = live_state.status_counts
+        return [{"alert_type": t, "count": counts[t]} for t in ("warning", "danger") if counts[t] > 0]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/analytics/accommodation-stats")
 async def get_accommodation_stats():
     try:
-        query = sqlalchemy.select([
-            tourists.c.accommodation,
-            func.count(tourists.c.id).label('count')
-        ]).group_by(tourists.c.accommodation).order_by(func.count(tourists.c.id).desc())
-        
-        results = await database.fetch_all(query)
-        return [{"accommodation": row.accommodation or "Unknown", "count": row.count} for row in results]
+        counts = registration_stats.by_accommodation
+        return [{"accommodation": accommodation or "Unknown", "count": count} for accommodation, count in counts.most_common() if count]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1181,38 +4305,60 @@ async def get_accommodation_stats():
 async def get_active_tourists():
     try:
         now = datetime.utcnow()
-        one_hour_ago = now - timedelta(hours=1)
-        twenty_four_hours_ago = now - timedelta(hours=24)
-
-        active_query = sqlalchemy.select([func.count()]).select_from(tourist_locations).where(
-            tourist_locations.c.last_updated >= one_hour_ago
-        )
-        recent_query = sqlalchemy.select([func.count()]).select_from(tourist_locations).where(
-            tourist_locations.c.last_updated >= twenty_four_hours_ago
-        )
-        
-        active_count = await database.fetch_val(active_query)
-        recently_active_count = await database.fetch_val(recent_query)
+        active_count = live_state.active_count("active", now)
+        recently_active_count = live_state.active_count("recently_active", now)
         
         return {"active_tourists": active_count, "recently_active": recently_active_count}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def compute_analytics_summary() -> dict:
+    (nationality, monthly, destinations, status_overview, alert_statistics,
+     accommodation, active) = await asyncio.gather(
+        get_tourists_by_nationality(),
+        get_tourists_by_month(),
+        get_destination_stats(),
+        get_status_overview(),
+        get_alert_statistics(),
+        get_accommodation_stats(),
+        get_active_tourists()
+    )
+    return {
+        "total_tourists": registration_stats.total,
+        "tourists_by_nationality": nationality,
+        "tourists_by_month": monthly,
+        "destination_stats": destinations,
+        "status_overview": status_overview,
+        "alert_statistics": alert_statistics,
+        "accommodation_stats": accommodation,
+        "active_tourists": active,
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+@app.get("/analytics/summary")
+async def get_analytics_summary():
+    """All dashboard analytics blocks in one response, cached for ANALYTICS_SUMMARY_TTL seconds"""
+    try:
+        return await analytics_summary_cache.get(compute_analytics_summary)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error building analytics summary: {str(e)}")
+
+@app.get("/police/heatmap/{z}/{x}/{y}")
+async def get_heatmap_tile(z: int, x: int, y: int):
+    """Tourist counts per status for a 16x16 grid of cells covering map tile z/x/y"""
+    if z < 0 or z > heatmap_grid.max_zoom:
+        raise HTTPException(status_code=400, detail=f"Zoom must be between 0 and {heatmap_grid.max_zoom}")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Tile coordinates out of range for zoom")
+    return heatmap_grid.tile(z, x, y)
+
 @app.get("/police/locations/")
 async def get_all_current_tourist_locations():
     try:
-        # First get tourists with location data
-        query = sqlalchemy.select([
-            tourists.c.tourist_id,
-            tourists.c.full_name,
-            tourist_locations.c.lat,
-            tourist_locations.c.lng,
-            tourist_locations.c.status
-        ]).select_from(
-            tourists.join(tourist_locations, tourists.c.tourist_id == tourist_locations.c.tourist_id, isouter=True)
-        )
-
-        results = await database.fetch_all(query)
+        # Registered tourists with their live location data
+        results = [entry for entry in live_state.entries.values() if entry["registered"]]
         
         # Filter out results with invalid coordinates and add mock coordinates if needed
         processed_results = []
@@ -1225,7 +4371,13 @@ async def get_all_current_tourist_locations():
         ]
         
         for i, row in enumerate(results):
-            row_dict = dict(row)
+            row_dict = {
+                "tourist_id": row["tourist_id"],
+                "full_name": row["full_name"],
+                "lat": row["lat"],
+                "lng": row["lng"],
+                "status": row["status"]
+            }
             
             # If no coordinates exist, add mock coordinates
             if not row_dict.get('lat') or not row_dict.get('lng'):
@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+
+import main
+from test_geofence_index import destination, random_zones
+
+
+def test_batch_matches_scalar_index():
+    rng = random.Random(11)
+    zones = random_zones(rng, 800)
+    # Nested zones so some points fall in several at once
+    for i, radius in enumerate((300, 2000, 8000)):
+        zones.append({"zone_id": f"nested{i}", "name": "n", "center_lat": 28.6139, "center_lng": 77.2090,
+                      "radius_meters": radius, "zone_type": "danger", "description": ""})
+    snapshot = main.GeofenceSnapshot(zones, source="test")
+
+    points = [(28.6139, 77.2090), (28.62, 77.21), (0.5, -140.3), (-89.9, 0.0)]
+    for zone in rng.sample(zones, 300):
+        points.append(destination(zone["center_lat"], zone["center_lng"], rng.uniform(0, 360),
+                                  zone["radius_meters"] * rng.choice([0.5, 0.999, 1.001, 3])))
+    points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(300)]
+
+    lats = np.array([lat for lat, _ in points])
+    lngs = np.array([lng for _, lng in points])
+    results = main.check_geofence_batch(lats, lngs, snapshot)
+
+    assert len(results) == len(points)
+    for (lat, lng), result in zip(points, results):
+        assert result == snapshot.index.check(lat, lng), (lat, lng)
+    assert len(results[0]) >= 3
+    assert any(result == [] for result in results)
+
+
+def test_batch_of_no_points():
+    snapshot = main.GeofenceSnapshot(main.get_predefined_zones(), source="test")
+    assert main.check_geofence_batch(np.array([]), np.array([]), snapshot) == []
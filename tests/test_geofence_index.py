@@ -0,0 +1,64 @@
+import math
+import random
+
+import main
+
+
+def destination(lat, lng, bearing_deg, meters):
+    """Point reached from (lat, lng) after meters along a great circle"""
+    angular = meters / main.EARTH_RADIUS_METERS
+    bearing = math.radians(bearing_deg)
+    lat1, lng1 = math.radians(lat), math.radians(lng)
+    lat2 = math.asin(math.sin(lat1) * math.cos(angular) + math.cos(lat1) * math.sin(angular) * math.cos(bearing))
+    lng2 = lng1 + math.atan2(math.sin(bearing) * math.sin(angular) * math.cos(lat1),
+                             math.cos(angular) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lng2) + 540) % 360 - 180
+
+
+def random_zones(rng, count):
+    cell = main.GEOFENCE_GRID_CELL_DEG
+    zones = []
+    for i in range(count):
+        if i % 3 == 0:
+            # Centered on a grid corner so the zone straddles four cells
+            lat = round(rng.uniform(-60, 60) / cell) * cell
+            lng = round(rng.uniform(-179, 179) / cell) * cell
+        else:
+            lat, lng = rng.uniform(-80, 80), rng.uniform(-180, 180)
+        zones.append({
+            "zone_id": f"z{i}", "name": f"Zone {i}", "center_lat": lat, "center_lng": lng,
+            "radius_meters": rng.choice([30, 500, 5000, 30000, 300000]),
+            "zone_type": rng.choice(["safe", "warning", "danger"]), "description": ""
+        })
+    zones.append({"zone_id": "antimeridian", "name": "a", "center_lat": -16.5, "center_lng": 179.95,
+                  "radius_meters": 20000, "zone_type": "warning", "description": ""})
+    zones.append({"zone_id": "pole", "name": "p", "center_lat": 89.6, "center_lng": 10,
+                  "radius_meters": 100000, "zone_type": "safe", "description": ""})
+    return zones
+
+
+def test_index_matches_linear_scan_in_order():
+    rng = random.Random(7)
+    zones = random_zones(rng, 800)
+    index = main.GeofenceIndex(zones)
+
+    points = []
+    for zone in rng.sample(zones, 300) + zones[-2:]:
+        for _ in range(5):
+            # Just inside, just outside and exactly on the edge of the zone
+            offset = rng.choice([-0.01, 0.0, 0.01, -0.3 * zone["radius_meters"], 0.2 * zone["radius_meters"]])
+            points.append(destination(zone["center_lat"], zone["center_lng"], rng.uniform(0, 360),
+                                      zone["radius_meters"] + offset))
+    points += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(300)]
+
+    for lat, lng in points:
+        assert index.check(lat, lng) == main.check_geofence_violations(lat, lng, zones), (lat, lng)
+
+
+def test_overlapping_zones_keep_catalog_order():
+    zones = [{"zone_id": zone_id, "name": zone_id, "center_lat": 28.6, "center_lng": 77.2, "radius_meters": radius,
+              "zone_type": "warning", "description": ""} for zone_id, radius in (("big", 5000), ("small", 100), ("mid", 1000))]
+    index = main.GeofenceIndex(zones)
+
+    assert [v["zone"]["zone_id"] for v in index.check(28.6, 77.2)] == ["big", "small", "mid"]
+    assert index.check(0, 0) == []
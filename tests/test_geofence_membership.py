@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import main
+from test_geofence_index import destination
+
+START = datetime(2026, 10, 17, 9, 0, 0)
+CENTER = (28.6139, 77.2090)
+
+
+def zone(zone_id="z", radius=1000, zone_type="danger"):
+    return {"zone_id": zone_id, "name": zone_id, "center_lat": CENTER[0], "center_lng": CENTER[1],
+            "radius_meters": radius, "zone_type": zone_type, "description": ""}
+
+
+def at(meters):
+    """A point the given distance due east of the zone center"""
+    return destination(CENTER[0], CENTER[1], 90, meters)
+
+
+def new_membership():
+    # Exit band: max(10% of 1000 m, 25 m) = 100 m beyond the radius; dwell after 10 minutes
+    return main.GeofenceMembership(0.1, 25, timedelta(minutes=10))
+
+
+def drive(membership, snapshot, fixes):
+    """Feed (seconds after START, meters from center) fixes; returns the event names per fix"""
+    names = []
+    for seconds, meters in fixes:
+        _, events = membership.update("T1", *at(meters), START + timedelta(seconds=seconds), snapshot)
+        names.append([event["event"] for event in events])
+    return names
+
+
+def test_single_enter_then_inside():
+    membership = new_membership()
+    snapshot = main.GeofenceSnapshot([zone()], source="test")
+
+    assert drive(membership, snapshot, [(0, 2000), (10, 500), (20, 400), (30, 900)]) == [[], ["enter"], [], []]
+
+
+def test_no_flapping_inside_the_hysteresis_band():
+    membership = new_membership()
+    snapshot = main.GeofenceSnapshot([zone()], source="test")
+
+    events = drive(membership, snapshot, [(0, 900), (10, 1050), (20, 980), (30, 1090), (40, 1000)])
+    assert events == [["enter"], [], [], [], []]
+    violations, _ = membership.update("T1", *at(1060), START + timedelta(seconds=50), snapshot)
+    assert [v["zone"]["zone_id"] for v in violations] == ["z"]
+
+
+def test_exit_after_leaving_the_band_and_reenter():
+    membership = new_membership()
+    snapshot = main.GeofenceSnapshot([zone()], source="test")
+
+    events = drive(membership, snapshot, [(0, 900), (60, 1150), (70, 1050), (80, 950)])
+    assert events == [["enter"], ["exit"], [], ["enter"]]
+    _, exit_events = membership.update("T1", *at(5000), START + timedelta(seconds=200), snapshot)
+    assert exit_events[0]["event"] == "exit" and exit_events[0]["dwell_seconds"] == 120
+
+
+def test_one_dwell_event_after_the_threshold():
+    membership = new_membership()
+    snapshot = main.GeofenceSnapshot([zone()], source="test")
+
+    events = drive(membership, snapshot, [(0, 500), (599, 500), (600, 500), (900, 500), (3600, 500)])
+    assert events == [["enter"], [], ["dwell"], [], []]
+
+
+def test_reload_drops_state_for_removed_zones():
+    membership = new_membership()
+    both = main.GeofenceSnapshot([zone("kept"), zone("removed", radius=2000)], source="test")
+    drive(membership, both, [(0, 500)])
+    membership.update("T2", *at(1500), START, both)
+    assert set(membership.members["T1"]) == {"kept", "removed"} and set(membership.members["T2"]) == {"removed"}
+
+    reloaded = main.GeofenceSnapshot([zone("kept")], source="test")
+    assert membership.retain_zones(reloaded.zones_by_id) == 2
+    assert set(membership.members) == {"T1"} and set(membership.members["T1"]) == {"kept"}
+    # No exit is reported later for a zone that no longer exists
+    assert drive(membership, reloaded, [(10, 500)]) == [[]]
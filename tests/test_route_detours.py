@@ -0,0 +1,51 @@
+import main
+
+
+def danger_zone(zone_id, lat, lng, radius):
+    return {"zone_id": zone_id, "center_lat": lat, "center_lng": lng, "radius_meters": radius, "zone_type": "danger"}
+
+
+def closest_approach(start, waypoints, end, zone, samples=400):
+    path = [start] + [(w["lat"], w["lng"]) for w in waypoints] + [end]
+    closest = float("inf")
+    for (lat1, lng1), (lat2, lng2) in zip(path, path[1:]):
+        for i in range(samples + 1):
+            t = i / samples
+            closest = min(closest, main.calculate_distance(
+                lat1 + (lat2 - lat1) * t, lng1 + (lng2 - lng1) * t, zone["center_lat"], zone["center_lng"]))
+    return closest
+
+
+def test_detour_legs_stay_outside_the_zone():
+    zone = danger_zone("d", 0, 0, 2000)
+    start, end = (0, -0.02), (0, 0.02)
+    waypoints, avoided, crossed = main.detour_waypoints(start, end, (zone,))
+
+    assert avoided == ["d"] and crossed == []
+    assert closest_approach(start, waypoints, end, zone) >= zone["radius_meters"]
+
+
+def test_detour_around_a_zone_close_to_both_stops():
+    zone = danger_zone("d", 0, 0, 2000)
+    start, end = (0, -0.0185), (0.001, 0.0185)
+    waypoints, avoided, crossed = main.detour_waypoints(start, end, (zone,))
+
+    assert avoided == ["d"] and len(waypoints) > 1
+    assert closest_approach(start, waypoints, end, zone) >= zone["radius_meters"]
+
+
+def test_detour_clears_zones_hit_by_earlier_detours():
+    zones = (danger_zone("a", 0, 0, 2000), danger_zone("b", 0.024, 0, 1500))
+    start, end = (0, -0.03), (0, 0.03)
+    waypoints, avoided, crossed = main.detour_waypoints(start, end, zones)
+
+    assert crossed == []
+    for zone in zones:
+        assert closest_approach(start, waypoints, end, zone) >= zone["radius_meters"]
+
+
+def test_zone_containing_a_stop_is_not_reported_avoided():
+    zone = danger_zone("d", 0, 0, 2000)
+    waypoints, avoided, crossed = main.detour_waypoints((0, 0.001), (0, 0.05), (zone,))
+
+    assert avoided == [] and crossed == ["d"]
@@ -0,0 +1,35 @@
+import main
+
+
+def test_full_longitude_box_matches_everywhere():
+    index = main.SubscriptionIndex()
+    band, world = object(), object()
+    index.subscribe(band, (10, -180, 40, 180), [])
+    index.subscribe(world, (-90, -180, 90, 180), [])
+
+    assert index.match(28.6139, 77.2090) == {band, world}
+    assert index.match(-33.87, 151.21) == {world}
+
+
+def test_narrow_full_longitude_band_is_indexed_in_every_column():
+    index = main.SubscriptionIndex()
+    band = object()
+    index.subscribe(band, (10, -180, 11, 180), [])
+
+    for lng in (-180, -90.5, 0, 77.2, 179.9, 180):
+        assert index.match(10.5, lng) == {band}
+
+
+def test_antimeridian_box():
+    index = main.SubscriptionIndex()
+    pacific = object()
+    index.subscribe(pacific, (-20, 170, 0, -170), [])
+
+    assert index.match(-10, 175) == {pacific}
+    assert index.match(-10, -175) == {pacific}
+    assert index.match(-10, 0) == set()
+
+
+def test_subscribe_rejects_out_of_range_longitude():
+    reply = main.handle_dashboard_command(None, {"action": "subscribe", "bbox": [10, -200, 20, 30]})
+    assert reply["type"] == "error"